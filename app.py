@@ -1,95 +1,385 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
-from werkzeug.utils import secure_filename
+from flask import Flask, render_template, request, redirect, url_for, jsonify, g, Response
 from pathlib import Path
 import os
+import math
 import json
-from utils.analysis import TrafficAnalyzer, generate_all_charts
-from utils.user_profile import UserProfileAnalyzer
+import time
+import threading
+import sqlite3
+from collections import Counter
+from contextlib import nullcontext
+from functools import partial
+import pandas as pd
+from werkzeug.wsgi import get_input_stream
+from utils.metrics import timed_stage, record_request, record_dataset, render_metrics, frame_memory
+from utils.memo import query_cache
+from utils.snapshot import EMPTY_SNAPSHOT, build_snapshot, snapshot_from_store, compute_aggregates
+from utils.shared_store import MappedProfiles
+from utils.datasets import DEFAULT_DATASET, DatasetRegistry, valid_name
+from utils.analysis import BASE_COLUMNS, TIME_COLUMNS, TrafficAnalyzer, write_plotly_bundle
+from utils.ingest import ingest_stream
+from utils.netflow import IPUserTable, ingest_flow_stream, COLLECTOR_PORTS
+from utils.sqlite_store import SQLiteTrafficStore, SQLiteTrafficAnalyzer
+from utils.anomaly import ANOMALY_THRESHOLD
+from utils.pyramid import LEVEL_WIDTHS, DEFAULT_MAX_POINTS
+from utils.quantiles import DIMENSIONS, DEFAULT_QUANTILES, quantile_label
+from utils.heatmap import VIEWS, METRICS, ORDERS, column_labels, encode_matrix
+from utils.enrichment import GROUP_BY, IPRangeTable
+from utils.classifier import AppClassifier, classification_summary
+from utils.export import (EXPORT_FORMATS, iter_raw_chunks, iter_record_chunks, iter_profile_records,
+                          stream_chunks, stream_jsonl_records, parquet_available)
 
 app = Flask(__name__)
 
-# 配置
-UPLOAD_FOLDER = Path(__file__).parent / 'data'
+# 配置（TRAFFIC_DATA_DIR 可将数据目录指向别处，如压测时使用临时目录）
+UPLOAD_FOLDER = Path(os.environ.get('TRAFFIC_DATA_DIR', Path(__file__).parent / 'data'))
 ALLOWED_EXTENSIONS = {'csv'}
-MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB
+COMPRESSED_EXTENSIONS = {'gz', 'zst'}
+MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB（表单上传；大文件请使用 /api/upload 流式接口）
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
+# 运行模式：local 为单进程开发模式；shared 为多 worker 共享预计算数据（gunicorn）
+SERVE_MODE = os.environ.get('TRAFFIC_SERVE_MODE', 'local')
+
+# 可选存储后端：sqlite 时同步维护 data/traffic.db，用于索引 SQL 查询和即席分析
+STORAGE_BACKEND = os.environ.get('TRAFFIC_STORAGE_BACKEND', 'memory')
+
+# NetFlow / IPFIX 导入时的 IP -> 用户映射表（CSV：network,user）
+IP_USER_TABLE = Path(os.environ.get('TRAFFIC_IP_USER_TABLE', UPLOAD_FOLDER / 'ip_users.csv'))
+
+# 上传的 pcap 中只解码发往这些 UDP 端口的报文（逗号分隔），其他 UDP 流量不视为 NetFlow / IPFIX
+NETFLOW_PORTS = {int(p) for p in os.environ.get('TRAFFIC_NETFLOW_PORTS', '').split(',') if p} or COLLECTOR_PORTS
+
+# 目的地址补充信息的 IP 地址段表（CSV：start,end,asn,org,country），文件不存在时不做补充
+IP_RANGE_TABLE = Path(os.environ.get('TRAFFIC_IP_RANGES', UPLOAD_FOLDER / 'ip_ranges.csv'))
+
+# 未标注应用类别的记录按规则表推断类别（CSV：type,value,protocol,category），文件不存在时使用内置端口规则
+APP_RULES = Path(os.environ.get('TRAFFIC_APP_RULES', UPLOAD_FOLDER / 'app_rules.csv'))
+
+# 导入时按记录哈希丢弃重复记录（TRAFFIC_DEDUP=0 关闭），重复上传同一文件不会写入数据
+DEDUP = os.environ.get('TRAFFIC_DEDUP', '1') != '0'
+
 # 确保上传文件夹存在
 UPLOAD_FOLDER.mkdir(exist_ok=True)
 
-# 全局分析器
-analyzer = None
-user_profile_analyzer = None
-charts_html = {}
-user_profiles = {}
+# 本地提供与 plotly 版本一致的 plotly.js（不依赖 CDN）
+PLOTLY_JS = write_plotly_bundle(app.static_folder)
+
+# 已加载数据集的内存预算（MB），超出时按 LRU 换出，之后从列式缓存按需重新挂载
+MEMORY_BUDGET_MB = int(os.environ.get('TRAFFIC_MEMORY_BUDGET_MB', '2048'))
+
+# 命名数据集注册表：默认数据集为 data/traffic（共享存储 data/shared），
+# 其他数据集位于 data/datasets/<name>/
+registry = DatasetRegistry(UPLOAD_FOLDER, MEMORY_BUDGET_MB * 1024 * 1024, base_columns=BASE_COLUMNS + TIME_COLUMNS,
+                           dedup=DEDUP)
+
+# SQLite 存储后端（仅 sqlite 后端，只同步默认数据集）
+sqlite_store = SQLiteTrafficStore(UPLOAD_FOLDER / 'traffic.db') if STORAGE_BACKEND == 'sqlite' else None
+
+# 串行化重新加载与上传落盘，避免并发上传互相覆盖分区（可重入：按需加载时会调用 load_analyzer）
+_reload_lock = threading.RLock()
+
+
+# 已加载的表文件：路径 -> (文件修改时间, 表对象)
+_table_cache = {}
+
+# 内置应用类别规则
+DEFAULT_APP_CLASSIFIER = AppClassifier.default()
+
+
+def load_cached_table(path, loader):
+    """按文件修改时间缓存加载的表文件（文件更新后重新加载），文件不存在或加载失败时返回 None"""
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return None
+    cached = _table_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        try:
+            cached = _table_cache[path] = (mtime, loader(path))
+        except Exception as e:
+            print(f"加载表文件失败（{path}）: {e}")
+            return None
+    return cached[1]
+
+
+def ip_range_table():
+    """IP 地址段表，未配置时返回 None"""
+    return load_cached_table(IP_RANGE_TABLE, IPRangeTable.from_csv)
+
+
+def app_classifier():
+    """应用类别规则（未配置规则表时为内置规则）"""
+    return load_cached_table(APP_RULES, AppClassifier.from_csv) or DEFAULT_APP_CLASSIFIER
+
+
+def shared_store_for(name):
+    """shared 模式下数据集的共享存储，local 模式返回 None"""
+    return registry.store(name) if SERVE_MODE == 'shared' else None
+
+
+def dataset_name(name=None):
+    """请求的数据集名称（dataset 查询参数，缺省为默认数据集；名称不合法时返回 None）
+
+    只读取查询参数：访问 request.form 会消耗流式上传接口的请求体。
+    """
+    name = name or request.args.get('dataset') or DEFAULT_DATASET
+    return name if valid_name(name) else None
+
+
+def current_snapshot(name=DEFAULT_DATASET):
+    """获取数据集当前发布的快照（请求内只取一次，保证视图一致）；未常驻时按需加载"""
+    snapshot = registry.get(name)
+    if snapshot is None:
+        snapshot = ensure_loaded(name)
+    return snapshot
+
+
+def request_snapshot():
+    """当前请求 dataset 参数对应的快照"""
+    name = dataset_name()
+    return current_snapshot(name) if name else EMPTY_SNAPSHOT
+
+
+def publish_snapshot(name, snapshot):
+    """以单次引用赋值原子地发布数据集的新快照"""
+    df = snapshot.analyzer.df if snapshot.analyzer else None
+    # DataFrame 内存占用每个快照只估计一次，LRU 预算和指标共用
+    frame_bytes = frame_memory(df) if df is not None else 0
+    registry.put(name, snapshot, frame_bytes=frame_bytes)
+    # 丢弃已不常驻的数据版本的查询缓存
+    query_cache.retain(*registry.data_versions())
+    record_dataset(df, users=len(snapshot.user_profiles), dataset=name, memory_bytes=frame_bytes)
 
 
 def allowed_file(filename):
     """检查文件是否允许"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    name = filename.lower()
+    if '.' in name and name.rsplit('.', 1)[1] in COMPRESSED_EXTENSIONS:
+        # 压缩文件按内层扩展名判断，如 traffic.csv.gz
+        name = name.rsplit('.', 1)[0]
+    return '.' in name and name.rsplit('.', 1)[1] in ALLOWED_EXTENSIONS
 
 
-def load_analyzer(csv_file=None):
-    """加载分析器，并生成所有图表和用户画像"""
-    global analyzer, user_profile_analyzer, charts_html, user_profiles
-    
-    if csv_file is None:
-        # 尝试加载默认的 traffic.csv
-        csv_path = UPLOAD_FOLDER / 'traffic.csv'
-    else:
-        csv_path = csv_file
-    
-    if not csv_path.exists():
+def save_profiles_atomic(snapshot, profiles_path):
+    """先写临时文件再替换，读者不会读到写了一半的 JSON"""
+    tmp_path = profiles_path.with_name(profiles_path.name + '.tmp')
+    if snapshot.user_profile_analyzer.save_profiles(str(tmp_path)):
+        os.replace(tmp_path, profiles_path)
+
+
+def load_dataset_frame(name=DEFAULT_DATASET):
+    """读取数据集的全部分区数据；默认数据集首次运行时将旧的 traffic.csv 迁移为分区"""
+    dataset = registry.dataset(name)
+    if dataset.is_empty():
+        legacy_path = UPLOAD_FOLDER / 'traffic.csv'
+        if name != DEFAULT_DATASET or not legacy_path.exists():
+            return None
+        dataset.add_csv(legacy_path)
+    return dataset.read()
+
+
+def is_fresh(name, snapshot):
+    """快照是否与分区数据集一致（shared 模式下需为共享存储的当前版本）"""
+    store = shared_store_for(name)
+    return snapshot.loaded and (store is None or snapshot.store_version == store.current_name())
+
+
+def current_frame(name=DEFAULT_DATASET):
+    """返回与分区数据集一致的当前全量数据（优先复用内存中的快照，避免重新读取）"""
+    snapshot = registry.get(name)
+    if snapshot is not None and is_fresh(name, snapshot):
+        df = snapshot.analyzer.df
+        return df[[c for c in df.columns if c in BASE_COLUMNS or c in TIME_COLUMNS]]
+    return load_dataset_frame(name)
+
+
+def load_analyzer(ingest=None, name=DEFAULT_DATASET, report=None):
+    """加载数据集的分析器，并生成所有图表和用户画像
+
+    ingest 为可选的新数据写入函数：接收分区追加器，写入新数据并返回新增的 DataFrame。
+    新数据与现有数据合并后在旁路完整构建快照；只有构建成功才提交分区并一次性发布，
+    任一步骤失败时分区数据和当前快照都保持不变。新数据全部为重复记录时不做任何修改，视为成功。
+    report 为 Counter 时累加 added / duplicates 计数。
+    """
+    with _reload_lock:
+        dataset = registry.dataset(name)
+        shared_store = shared_store_for(name)
+        appender = dataset.appender()
+        try:
+            store_lock = shared_store.lock() if shared_store is not None else nullcontext()
+            with store_lock:
+                with timed_stage('load_analyzer'):
+                    previous = None
+                    new_df = None
+                    if ingest is not None:
+                        resident = registry.get(name)
+                        if resident is not None and is_fresh(name, resident):
+                            # 新快照可在当前快照的派生索引基础上增量更新
+                            previous = resident
+                        base_df = current_frame(name)
+                        new_df = ingest(appender)
+                        if report is not None:
+                            report.update({'added': appender.rows, 'duplicates': appender.duplicates})
+                        if new_df is None or len(new_df) == 0:
+                            appender.abort()
+                            # 全部为已导入的记录：数据集无变化，保留当前快照
+                            return appender.duplicates > 0 and registry.exists(name)
+                        df = new_df if base_df is None else pd.concat([base_df, new_df], ignore_index=True)
+                    else:
+                        df = load_dataset_frame(name)
+                        if df is None:
+                            return False
+                    
+                    snapshot = build_snapshot(df, source=str(dataset.root), previous=previous, new_df=new_df,
+                                              ip_ranges=ip_range_table())
+                    if sqlite_store is not None and name == DEFAULT_DATASET:
+                        sync_sqlite_store(df, new_df)
+                    appender.commit()
+                    
+                    # 保存用户画像到 JSON
+                    save_profiles_atomic(snapshot, registry.profiles_path(name))
+                
+                if shared_store is not None:
+                    # 发布到共享存储后丢弃本进程构建的数据，改为只读挂载
+                    version = shared_store.publish(snapshot)
+            
+            if shared_store is not None:
+                snapshot = snapshot_from_store(shared_store, version)
+            
+            publish_snapshot(name, snapshot)
+            return True
+        except Exception as e:
+            appender.abort()
+            print(f"分析器加载失败（阶段: {getattr(e, 'failed_stage', 'load_analyzer')}）: {e}")
+            return False
+
+
+def sync_sqlite_store(df, new_df=None):
+    """同步 SQLite 后端：有新增数据时追加，否则在行数不一致时全量重建"""
+    if new_df is not None and sqlite_store.row_count() == len(df) - len(new_df):
+        sqlite_store.append_frame(new_df)
+    elif sqlite_store.row_count() != len(df):
+        sqlite_store.replace_frame(df)
+
+
+def attach_cached_snapshot(name, version=None):
+    """只读挂载数据集列式缓存（shared 模式下即共享存储）的指定版本，默认为当前版本
+
+    local 模式下缓存可能落后于分区数据（如其他进程导入了新数据），行数不一致时不使用。
+    """
+    store = registry.store(name)
+    version = version or store.current_name()
+    if version is None:
         return False
-    
-    try:
-        # 加载流量分析器
-        analyzer = TrafficAnalyzer(str(csv_path))
-        charts_html = generate_all_charts(analyzer)
-        
-        # 加载用户画像分析器
-        user_profile_analyzer = UserProfileAnalyzer(str(csv_path))
-        user_profiles = user_profile_analyzer.analyze_all_users()
-        
-        # 保存用户画像到 JSON
-        profiles_path = UPLOAD_FOLDER / 'user_profiles.json'
-        user_profile_analyzer.save_profiles(str(profiles_path))
-        
-        return True
-    except Exception as e:
-        print(f"分析器加载失败: {e}")
+    with _reload_lock:
+        resident = registry.get(name)
+        if resident is not None and resident.store_version == version:
+            return True
+        try:
+            snapshot = snapshot_from_store(store, version)
+            if SERVE_MODE != 'shared' and len(snapshot.analyzer.df) != registry.dataset(name).total_rows():
+                return False
+            publish_snapshot(name, snapshot)
+            registry.record_reload(name)
+            return True
+        except Exception as e:
+            print(f"挂载数据集缓存失败（{name}/{version}）: {e}")
+            return False
+
+
+def ensure_loaded(name):
+    """数据集未常驻时加载：优先从列式缓存挂载，否则从分区数据构建；数据集不存在时返回空快照"""
+    if name != DEFAULT_DATASET and not registry.exists(name):
+        return EMPTY_SNAPSHOT
+    with _reload_lock:
+        snapshot = registry.get(name)
+        if snapshot is None and (attach_cached_snapshot(name) or init_dataset(name)):
+            snapshot = registry.get(name)
+    return snapshot or EMPTY_SNAPSHOT
+
+
+def init_dataset(name):
+    """从分区数据构建数据集快照；shared 模式下只由一个进程构建，其余进程挂载"""
+    store = shared_store_for(name)
+    if store is not None:
+        with store.lock():
+            # 取得锁后再次检查，避免多个进程重复构建
+            built = store.current_name() is not None
+        if built:
+            return attach_cached_snapshot(name)
+    if name == DEFAULT_DATASET and registry.dataset(name).is_empty() and not (UPLOAD_FOLDER / 'traffic.csv').exists():
         return False
+    return load_analyzer(name=name)
+
+
+def init_serving():
+    """按运行模式初始化默认数据集（其他数据集在首次访问时加载）"""
+    return ensure_loaded(DEFAULT_DATASET).loaded
+
+
+@app.before_request
+def start_request_timer():
+    """记录请求开始时间"""
+    g.request_start = time.perf_counter()
+
+
+@app.before_request
+def sync_shared_snapshot():
+    """shared 模式下检查其他 worker 是否发布了所请求数据集的新版本"""
+    name = dataset_name()
+    if SERVE_MODE != 'shared' or name is None:
+        return
+    resident = registry.get(name)
+    if resident is None:
+        return
+    version = registry.watcher(name).poll(resident.store_version)
+    if version:
+        attach_cached_snapshot(name, version)
+
+
+@app.after_request
+def record_request_metrics(response):
+    """记录每个端点的请求延迟"""
+    start = g.pop('request_start', None)
+    if start is not None:
+        record_request(request.endpoint or 'unmatched', request.method,
+                       response.status_code, time.perf_counter() - start)
+    return response
 
 
 @app.route('/')
 def index():
     """首页 - 展示基本信息和上传表单"""
-    total_traffic = {}
-    if analyzer:
-        total_traffic = analyzer.get_total_traffic()
+    snapshot = request_snapshot()
+    total_traffic = snapshot.aggregates.get('total_traffic', {})
     
-    return render_template('index.html', total_traffic=total_traffic)
+    return render_template('index.html', total_traffic=total_traffic, dataset=dataset_name() or DEFAULT_DATASET,
+                           datasets=registry.names())
 
 
 @app.route('/dashboard')
 def dashboard():
     """展示所有图表"""
-    if not analyzer:
+    snapshot = request_snapshot()
+    if not snapshot.loaded:
         return redirect(url_for('index'))
     
-    total_traffic = analyzer.get_total_traffic()
-    user_ranking = analyzer.get_user_traffic_ranking(top_n=10)
-    app_category = analyzer.get_app_category_traffic()
-    active_hours = analyzer.get_active_hours()
+    aggregates = snapshot.aggregates
+    quantiles = snapshot.indexes.get('quantiles')
+    enrichment = snapshot.indexes.get('enrichment')
     
     return render_template('dashboard.html',
-                          charts_html=charts_html,
-                          total_traffic=total_traffic,
-                          user_ranking=user_ranking,
-                          app_category=app_category,
-                          active_hours=active_hours)
+                          charts_html=snapshot.charts_html,
+                          total_traffic=aggregates['total_traffic'],
+                          user_ranking=aggregates['user_ranking_top10'],
+                          app_category=aggregates['app_category'],
+                          active_hours=aggregates['active_hours'],
+                          category_quantiles=quantiles.summary('category') if quantiles else [],
+                          dst_orgs=enrichment.summary('org', 10) if enrichment else [],
+                          dataset=dataset_name() or DEFAULT_DATASET)
 
 
 @app.route('/upload', methods=['POST'])
@@ -106,42 +396,105 @@ def upload():
     if not allowed_file(file.filename):
         return redirect(url_for('index'))
     
-    try:
-        # 保存文件
-        filename = secure_filename('traffic.csv')  # 始终用 traffic.csv
-        filepath = UPLOAD_FOLDER / filename
-        file.save(str(filepath))
-        
-        # 重新加载分析器
-        if load_analyzer(filepath):
-            return redirect(url_for('dashboard'))
-        else:
-            return redirect(url_for('index'))
-    except Exception as e:
-        print(f"文件上传失败: {e}")
+    name = dataset_name(request.form.get('dataset'))
+    if name is None:
         return redirect(url_for('index'))
+    
+    # 边读边解压、分块解析，直接追加到分区数据集（不落地临时文件）
+    ingest = partial(ingest_stream, file.stream, filename=file.filename,
+                     content_encoding=request.headers.get('Content-Encoding'), classify=app_classifier().apply)
+    if load_analyzer(ingest, name=name):
+        return redirect(url_for('dashboard', dataset=name))
+    return redirect(url_for('index', dataset=name))
+
+
+@app.route('/api/upload', methods=['POST', 'PUT'])
+def api_upload():
+    """流式上传接口 - 请求体为 CSV（可 gzip / zstd 压缩），不受 MAX_CONTENT_LENGTH 限制
+
+    压缩格式由 Content-Encoding 头、filename 参数扩展名或数据魔数判断；
+    format=netflow 时请求体为 NetFlow v5 / IPFIX 抓包（pcap 或原始报文）；
+    dataset 参数指定写入的数据集（不存在时创建）。
+    未标注应用类别的记录按规则表推断，响应中的 classification 给出已分类和未命中的记录数及占比；
+    ingest 给出实际写入的记录数和因重复而丢弃的记录数。
+    """
+    name = dataset_name()
+    if name is None:
+        return jsonify({'error': '无效的数据集名称'}), 400
+    
+    # 直接读取 WSGI 输入流，绕过表单解析和全局大小限制
+    stream = get_input_stream(request.environ, safe_fallback=False, max_content_length=None)
+    report = Counter()
+    ingest_report = Counter()
+    classify = partial(app_classifier().apply, report=report)
+    if request.args.get('format') == 'netflow':
+        user_table = IPUserTable.from_csv(IP_USER_TABLE) if IP_USER_TABLE.exists() else None
+        ingest = partial(ingest_flow_stream, stream, user_table=user_table, classify=classify, ports=NETFLOW_PORTS)
+    else:
+        ingest = partial(ingest_stream, stream, filename=request.args.get('filename'),
+                         content_encoding=request.headers.get('Content-Encoding'), classify=classify)
+    if not load_analyzer(ingest, name=name, report=ingest_report):
+        return jsonify({'error': '数据解析或分析失败'}), 400
+    
+    snapshot = current_snapshot(name)
+    return jsonify({
+        'dataset': name,
+        'version': snapshot.version,
+        'total_traffic': snapshot.aggregates['total_traffic'],
+        'classification': classification_summary(report),
+        'ingest': {'added': ingest_report['added'], 'duplicates': ingest_report['duplicates']},
+    })
 
 
 @app.route('/api/stats')
 def api_stats():
     """API 接口 - 返回统计数据"""
-    if not analyzer:
-        return jsonify({})
+    name = dataset_name()
+    start = request.args.get('start')
+    end = request.args.get('end')
+    if start or end:
+        if not registry.exists(name):
+            return jsonify({})
+        try:
+            if sqlite_store is not None and name == DEFAULT_DATASET:
+                # SQLite 后端：范围条件走 ts 索引
+                range_analyzer = SQLiteTrafficAnalyzer(sqlite_store, start, end)
+                if range_analyzer.get_total_traffic()['total_packets'] == 0:
+                    return jsonify({})
+            else:
+                # 时间范围查询：只读取相交的日期分区
+                df = registry.dataset(name).read(start, end)
+                if df is None or len(df) == 0:
+                    return jsonify({})
+                range_analyzer = TrafficAnalyzer.from_dataframe(df)
+        except ValueError:
+            return jsonify({'error': '无效的时间范围'}), 400
+        aggregates = compute_aggregates(range_analyzer)
+    else:
+        snapshot = request_snapshot()
+        if not snapshot.loaded:
+            return jsonify({})
+        aggregates = snapshot.aggregates
     
     return jsonify({
-        'total_traffic': analyzer.get_total_traffic(),
-        'user_ranking': analyzer.get_user_traffic_ranking(),
-        'app_category': analyzer.get_app_category_traffic(),
-        'active_hours': analyzer.get_active_hours()
+        'total_traffic': aggregates['total_traffic'],
+        'user_ranking': aggregates['user_ranking'],
+        'app_category': aggregates['app_category'],
+        'active_hours': aggregates['active_hours']
     })
 
 
 @app.route('/api/user_profiles')
 def api_user_profiles():
     """API 接口 - 返回用户画像数据"""
+    user_profiles = request_snapshot().user_profiles
+    if isinstance(user_profiles, MappedProfiles):
+        # 共享存储中已是序列化好的 JSON，直接返回
+        return Response(user_profiles.raw_json(), mimetype='application/json')
+    
     if not user_profiles:
         # 尝试从保存的文件加载
-        profiles_path = UPLOAD_FOLDER / 'user_profiles.json'
+        profiles_path = registry.profiles_path(dataset_name() or DEFAULT_DATASET)
         if profiles_path.exists():
             try:
                 with open(profiles_path, 'r', encoding='utf-8') as f:
@@ -152,6 +505,333 @@ def api_user_profiles():
     return jsonify(user_profiles)
 
 
+@app.route('/api/users/<user_id>/similar')
+def api_similar_users(user_id):
+    """API 接口 - 返回画像最相似的 k 个用户（余弦相似度）
+
+    参数：k（默认 10，最大 100）；approx=1/0 强制使用/不使用近似索引（仅在已构建时有效）
+    """
+    index = request_snapshot().indexes.get('similarity')
+    if index is None:
+        return jsonify({'error': '暂无数据'}), 404
+
+    k = max(1, min(request.args.get('k', 10, type=int), 100))
+    approx = request.args.get('approx')
+    approximate = None if approx is None else approx not in ('0', 'false')
+    similar = index.most_similar(user_id, k=k, approximate=approximate)
+    if similar is None:
+        return jsonify({'error': f'未知用户: {user_id}'}), 404
+
+    return jsonify({
+        'user': user_id,
+        'approximate': index.has_ivf and approximate is not False,
+        'similar': [{'user': u, 'score': round(score, 4)} for u, score in similar],
+    })
+
+
+@app.route('/api/trend')
+def api_trend():
+    """API 接口 - 多分辨率流量趋势（字节数、记录数、活跃用户数）
+
+    参数：start / end（时间）、resolution（所需分辨率秒数）或 max_points（默认 500），
+    也可用 level（minute / 5min / hour / day）直接指定层级
+    """
+    pyramid = request_snapshot().indexes.get('trend')
+    if pyramid is None:
+        return jsonify({'error': '暂无数据'}), 404
+    
+    level = request.args.get('level')
+    if level is not None and level not in LEVEL_WIDTHS:
+        return jsonify({'error': f'未知的层级: {level}'}), 400
+    max_points = max(1, min(request.args.get('max_points', DEFAULT_MAX_POINTS, type=int), 5000))
+    resolution = request.args.get('resolution', type=int)
+    if resolution is not None and resolution < 1:
+        return jsonify({'error': 'resolution 须为正整数（秒）'}), 400
+    try:
+        level, points = pyramid.trend(start=request.args.get('start'),
+                                      end=request.args.get('end'),
+                                      resolution=resolution,
+                                      max_points=max_points,
+                                      level=level)
+    except ValueError:
+        return jsonify({'error': '无效的时间范围'}), 400
+    return jsonify({'level': level, 'width': LEVEL_WIDTHS[level], 'points': points})
+
+
+@app.route('/api/quantiles')
+def api_quantiles():
+    """API 接口 - 记录大小（bytes）分位数
+
+    参数：dimension（category / user / hour，默认 category）、q（逗号分隔，默认 0.5,0.95,0.99）、
+    group（可重复，只返回指定分组）、limit（默认 100，按最大的分位数降序截取）
+    """
+    sketches = request_snapshot().indexes.get('quantiles')
+    if sketches is None:
+        return jsonify({'error': '暂无数据'}), 404
+    
+    dimension = request.args.get('dimension', 'category')
+    if dimension not in DIMENSIONS:
+        return jsonify({'error': f'未知的维度: {dimension}'}), 400
+    try:
+        quantiles = [float(q) for q in request.args.get('q', '').split(',') if q] or list(DEFAULT_QUANTILES)
+    except ValueError:
+        return jsonify({'error': '无效的分位数'}), 400
+    if any(not 0 <= q <= 1 for q in quantiles):
+        return jsonify({'error': '分位数须在 0 到 1 之间'}), 400
+    
+    groups = request.args.getlist('group') or None
+    limit = max(1, min(request.args.get('limit', 100, type=int), 10000))
+    summary = sketches.summary(dimension, quantiles, groups)
+    if dimension == 'user':
+        # 用户维度按最大的分位数降序，便于发现大块传输
+        label = quantile_label(max(quantiles))
+        summary.sort(key=lambda item: -item[label])
+    return jsonify({'dimension': dimension, 'quantiles': quantiles, 'groups': summary[:limit]})
+
+
+@app.route('/api/heatmap')
+def api_heatmap():
+    """API 接口 - 用户活跃度热力图矩阵
+
+    参数：view（hour / weekday_hour，默认 hour）、metric（bytes / records）、
+    order（bytes / cluster / user）、normalize（1 时按用户行归一化）、offset、limit（默认 2000）。
+    矩阵 z 为 base64 编码的 float32 类型数组（行为用户，列为时段），可直接传给 plotly.js；
+    提供的 plotly.js 不支持类型数组时为嵌套列表。
+    """
+    heatmap = request_snapshot().indexes.get('heatmap')
+    if heatmap is None:
+        return jsonify({'error': '暂无数据'}), 404
+    
+    view = request.args.get('view', 'hour')
+    metric = request.args.get('metric', 'bytes')
+    order = request.args.get('order', 'bytes')
+    if view not in VIEWS or metric not in METRICS or order not in ORDERS:
+        return jsonify({'error': f'参数须为 view={"/".join(VIEWS)}、metric={"/".join(METRICS)}、'
+                                 f'order={"/".join(ORDERS)}'}), 400
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = max(1, min(request.args.get('limit', 2000, type=int), 20000))
+    normalize = request.args.get('normalize') in ('1', 'true')
+    
+    users, matrix, clusters = heatmap.query(view, metric, order, normalize, offset, limit)
+    return jsonify({
+        'view': view,
+        'metric': metric,
+        'order': order,
+        'normalized': normalize,
+        'total_users': len(heatmap),
+        'offset': offset,
+        'users': users,
+        'clusters': clusters.tolist(),
+        'columns': column_labels(view),
+        'z': encode_matrix(matrix),
+    })
+
+
+@app.route('/api/enrichment')
+def api_enrichment():
+    """API 接口 - 按目的组织 / ASN / 国家汇总的流量
+
+    参数：by（org / asn / country，默认 org）、limit（默认 20）。需配置 IP 地址段表。
+    """
+    enrichment = request_snapshot().indexes.get('enrichment')
+    if enrichment is None:
+        return jsonify({'error': '暂无数据或未配置 IP 地址段表'}), 404
+    
+    by = request.args.get('by', 'org')
+    if by not in GROUP_BY:
+        return jsonify({'error': f'未知的汇总维度: {by}'}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), 10000))
+    return jsonify({'by': by, **enrichment.coverage(), 'groups': enrichment.summary(by, limit)})
+
+
+@app.route('/api/tags')
+def api_tags():
+    """API 接口 - 返回各标签的用户数"""
+    index = request_snapshot().indexes.get('tags')
+    if index is None:
+        return jsonify({'error': '暂无数据'}), 404
+    return jsonify({'total_users': len(index.users), 'tags': index.counts()})
+
+
+@app.route('/api/tags/<tag>/users')
+def api_tag_users(tag):
+    """API 接口 - 分页返回带有指定标签的用户
+
+    参数：and（可重复或逗号分隔，要求同时带有的其他标签）、page（从 1 开始）、per_page（默认 100，最大 1000）
+    """
+    index = request_snapshot().indexes.get('tags')
+    if index is None:
+        return jsonify({'error': '暂无数据'}), 404
+    
+    tags = [tag] + [t for value in request.args.getlist('and') for t in value.split(',') if t]
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(request.args.get('per_page', 100, type=int), 1000))
+    total, users = index.users_with(tags, offset=(page - 1) * per_page, limit=per_page)
+    return jsonify({
+        'tags': tags,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'users': users,
+    })
+
+
+@app.route('/api/anomalies')
+def api_anomalies():
+    """API 接口 - 返回相对用户自身历史基线的异常日流量
+
+    参数：user、start / end（日期）、threshold（稳健 z 分数阈值，默认 3.5）、limit（默认 100）
+    """
+    index = request_snapshot().indexes.get('anomalies')
+    if index is None:
+        return jsonify({'error': '暂无数据'}), 404
+    
+    threshold = request.args.get('threshold', ANOMALY_THRESHOLD, type=float)
+    if not math.isfinite(threshold) or threshold <= 0:
+        return jsonify({'error': 'threshold 须为正数'}), 400
+    limit = max(1, min(request.args.get('limit', 100, type=int), 10000))
+    try:
+        anomalies = index.anomalies(user=request.args.get('user'),
+                                    start=request.args.get('start'),
+                                    end=request.args.get('end'),
+                                    threshold=threshold, limit=limit)
+    except ValueError:
+        return jsonify({'error': '无效的时间范围'}), 400
+    return jsonify({'threshold': threshold, 'anomalies': anomalies})
+
+
+@app.route('/api/datasets')
+def api_datasets():
+    """API 接口 - 列出数据集及其常驻状态和估计内存占用"""
+    return jsonify({
+        'memory_budget_bytes': registry.memory_budget,
+        'resident_bytes': registry.resident_bytes(),
+        'datasets': registry.status(),
+    })
+
+
+@app.route('/api/query', methods=['POST'])
+def api_query():
+    """只读参数化 SQL 查询（需启用 sqlite 存储后端）
+
+    请求体：{"sql": "SELECT ... WHERE \"user\" = ?", "params": ["student_001"], "limit": 1000}
+    """
+    if sqlite_store is None:
+        return jsonify({'error': '未启用 SQLite 存储后端（TRAFFIC_STORAGE_BACKEND=sqlite）'}), 404
+    
+    payload = request.get_json(silent=True) or {}
+    sql = payload.get('sql')
+    if not isinstance(sql, str) or not sql.strip():
+        return jsonify({'error': '缺少 sql 参数'}), 400
+    params = payload.get('params') or []
+    if not isinstance(params, (list, dict)):
+        return jsonify({'error': 'params 必须为数组或对象'}), 400
+    
+    try:
+        result = sqlite_store.query(sql, params, limit=payload.get('limit', 1000))
+    except (sqlite3.Error, sqlite3.Warning, ValueError, TypeError) as e:
+        return jsonify({'error': f'查询失败: {e}'}), 400
+    return jsonify(result)
+
+
+def _export_response(body, fmt, name):
+    """构造分块传输的导出响应"""
+    extension = 'jsonl' if fmt == 'jsonl' else fmt
+    return Response(body, mimetype=EXPORT_FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename={name}.{extension}',
+    })
+
+
+def _export_format():
+    """解析并校验导出格式参数，返回 (格式, 错误响应)"""
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        return None, (jsonify({'error': f'不支持的导出格式: {fmt}'}), 400)
+    if fmt == 'parquet' and not parquet_available():
+        return None, (jsonify({'error': 'Parquet 导出需要安装 pyarrow'}), 400)
+    return fmt, None
+
+
+@app.route('/api/export/raw')
+def api_export_raw():
+    """流式导出原始记录，支持 start / end / user / app_category / protocol 筛选"""
+    fmt, error = _export_format()
+    if error:
+        return error
+    
+    snapshot = request_snapshot()
+    if not snapshot.loaded:
+        return jsonify({'error': '暂无数据'}), 404
+    
+    # enrich=1 时附加目的地址的 ASN / 组织 / 国家列（需配置 IP 地址段表）
+    enrichment = snapshot.indexes.get('enrichment')
+    extra = enrichment.record_columns() if enrichment is not None and request.args.get('enrich') == '1' else None
+    try:
+        chunks = iter_raw_chunks(snapshot.analyzer.df,
+                                 start=request.args.get('start'),
+                                 end=request.args.get('end'),
+                                 user=request.args.get('user'),
+                                 app_category=request.args.get('app_category'),
+                                 protocol=request.args.get('protocol'),
+                                 extra=extra)
+        # 预先取出第一块，参数错误在返回响应前即可报告
+        first = next(chunks, None)
+    except ValueError:
+        return jsonify({'error': '无效的时间范围'}), 400
+    
+    def all_chunks():
+        if first is not None:
+            yield first
+            yield from chunks
+    
+    return _export_response(stream_chunks(all_chunks(), fmt), fmt, 'traffic_raw')
+
+
+@app.route('/api/export/<aggregate>')
+def api_export_aggregate(aggregate):
+    """流式导出聚合结果：user_ranking / hourly_stats / app_category / profiles"""
+    fmt, error = _export_format()
+    if error:
+        return error
+    
+    snapshot = request_snapshot()
+    if not snapshot.loaded:
+        return jsonify({'error': '暂无数据'}), 404
+    
+    if aggregate == 'profiles':
+        if fmt == 'jsonl':
+            body = stream_jsonl_records(iter_profile_records(snapshot.user_profiles))
+        else:
+            body = stream_chunks(iter_record_chunks(iter_profile_records(snapshot.user_profiles, nested=False)), fmt)
+        return _export_response(body, fmt, 'user_profiles')
+    
+    if aggregate == 'user_ranking':
+        top_n = request.args.get('top_n', type=int)
+        if top_n is not None and top_n < 1:
+            return jsonify({'error': 'top_n 须为正整数'}), 400
+        records = snapshot.analyzer.get_user_traffic_ranking(top_n=top_n)
+    elif aggregate == 'hourly_stats':
+        records = snapshot.aggregates['active_hours']
+    elif aggregate == 'app_category':
+        records = snapshot.aggregates['app_category']
+    else:
+        return jsonify({'error': f'未知的聚合类型: {aggregate}'}), 404
+    
+    return _export_response(stream_chunks(iter_record_chunks(records), fmt), fmt, aggregate)
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 指标导出"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.context_processor
+def inject_plotly_js():
+    """模板中可用的本地 plotly.js 路径"""
+    return {'plotly_js': PLOTLY_JS}
+
+
 @app.template_filter('format_bytes')
 def format_bytes(bytes_val):
     """格式化字节数"""
@@ -173,7 +853,7 @@ def request_entity_too_large(error):
 
 if __name__ == '__main__':
     # 启动时加载默认分析器
-    load_analyzer()
+    init_serving()
     
     # 启动 Flask 应用
     app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,29 @@
+"""gunicorn 生产部署配置
+
+用法：
+    gunicorn -c gunicorn.conf.py app:app
+
+master 进程启动时构建一次共享数据（列式 .npy、聚合、图表、画像），
+各 worker 以只读内存映射方式挂载；任一 worker 处理上传后发布新版本，
+其他 worker 在下一次请求时自动切换。
+"""
+import os
+
+os.environ.setdefault('TRAFFIC_SERVE_MODE', 'shared')
+
+bind = os.environ.get('TRAFFIC_BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('TRAFFIC_WORKERS', '4'))
+threads = int(os.environ.get('TRAFFIC_THREADS', '4'))
+timeout = 300
+
+
+def on_starting(server):
+    """master 进程中构建共享数据（fork 前完成，worker 不再重复构建）"""
+    import app
+    app.init_serving()
+
+
+def post_worker_init(worker):
+    """worker 启动后挂载共享数据的当前版本"""
+    import app
+    app.init_serving()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+校园网流量分析系统 - 本地压测工具
+
+对每个指定规模生成合成数据集，在临时数据目录上启动应用，按配置的请求比例并发访问各接口
+（可同时定期上传新数据），输出每个接口的吞吐量和 p50/p95/p99 延迟，结果写为 JSON 报告。
+
+用法：
+    python loadtest.py --sizes 10000,100000 --concurrency 8 --duration 30
+    python loadtest.py --mix /api/stats=5,/api/user_profiles=1 --upload-interval 5
+    python loadtest.py --server gunicorn --output new.json --compare old.json
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+ROOT = Path(__file__).resolve().parent
+
+# 默认请求比例（路径=权重）
+DEFAULT_MIX = '/dashboard=1,/api/stats=4,/api/user_profiles=2'
+
+# 合成数据的应用类别、协议和目的端口
+CATEGORIES = ['Video Streaming', 'Game', 'Social Media', 'Chat', 'Education', 'Web Browse', 'DNS']
+PROTOCOLS = ['TCP', 'UDP']
+DST_PORTS = [53, 80, 443, 443, 443, 22, 8080, 3389]
+
+# 等待应用启动（含首次构建快照）的最长秒数
+STARTUP_TIMEOUT = 600
+
+# 报告中的分位数
+PERCENTILES = (50, 95, 99)
+
+
+def synthetic_traffic(rows, users, days=7, start='2025-12-01', seed=0):
+    """生成合成流量记录（BASE_COLUMNS 格式，timestamp 为字符串）"""
+    rng = np.random.default_rng(seed)
+    user_ids = rng.integers(0, users, rows)
+    # 每个用户有自己的高峰时段，使画像和聚类有区分度
+    peak = (user_ids * 7) % 24
+    hours = (peak + rng.normal(0, 3, rows).round().astype(np.int64)) % 24
+    seconds = rng.integers(0, days, rows) * 86400 + hours * 3600 + rng.integers(0, 3600, rows)
+    timestamps = pd.Timestamp(start) + pd.to_timedelta(np.sort(seconds), unit='s')
+    return pd.DataFrame({
+        'timestamp': timestamps.strftime('%Y-%m-%d %H:%M:%S'),
+        'src_ip': [f'10.{u // 65536 % 256}.{u // 256 % 256}.{u % 256}' for u in user_ids],
+        'dst_ip': [f'142.250.{d // 256}.{d % 256}' for d in rng.integers(0, 2048, rows)],
+        'src_port': rng.integers(1024, 65535, rows),
+        'dst_port': rng.choice(DST_PORTS, rows),
+        'protocol': rng.choice(PROTOCOLS, rows),
+        'bytes': rng.lognormal(9, 2, rows).astype(np.int64) + 40,
+        'app_category': rng.choice(CATEGORIES, rows),
+        'user': [f'user_{u:06d}' for u in user_ids],
+    })
+
+
+def parse_mix(text):
+    """'/a=1,/b=2' -> {'/a': 1.0, '/b': 2.0}"""
+    mix = {}
+    for item in text.split(','):
+        path, _, weight = item.strip().partition('=')
+        if path:
+            mix[path if path.startswith('/') else '/' + path] = float(weight or 1)
+    return mix
+
+
+def free_port():
+    """取一个空闲的本地端口"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(data_dir, port, server='flask', workers=4):
+    """在指定数据目录上启动应用子进程"""
+    env = dict(os.environ, TRAFFIC_DATA_DIR=str(data_dir))
+    if server == 'gunicorn':
+        env.update(TRAFFIC_BIND=f'127.0.0.1:{port}', TRAFFIC_WORKERS=str(workers))
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app']
+    else:
+        command = [sys.executable, '-c',
+                   'import app; app.init_serving(); '
+                   f'app.app.run(host="127.0.0.1", port={port}, threaded=True)']
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(base_url, process, timeout=STARTUP_TIMEOUT):
+    """轮询 /api/stats 直到应用就绪，返回等待的秒数"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f'应用进程已退出（返回码 {process.returncode}）')
+        try:
+            with urllib.request.urlopen(base_url + '/api/stats', timeout=5) as response:
+                if response.status == 200:
+                    return time.perf_counter() - started
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f'应用在 {timeout} 秒内未就绪')
+
+
+def timed_request(url, data=None, timeout=300):
+    """发送一次请求，返回 (耗时秒数, 状态码, 响应字节数)；连接失败时状态码为 0"""
+    request = urllib.request.Request(url, data=data, method='POST' if data is not None else 'GET')
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            size = len(response.read())
+            status = response.status
+    except urllib.error.HTTPError as e:
+        size, status = 0, e.code
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        size, status = 0, 0
+    return time.perf_counter() - started, status, size
+
+
+def summarize(samples, elapsed):
+    """[(耗时, 状态码, 字节数)] -> 吞吐量和延迟分位数（毫秒）"""
+    latencies = np.array([s[0] for s in samples]) * 1000
+    errors = sum(1 for s in samples if not 200 <= s[1] < 400)
+    result = {
+        'requests': len(samples),
+        'errors': errors,
+        'throughput': round(len(samples) / elapsed, 2) if elapsed > 0 else 0.0,
+        'mean_ms': round(float(latencies.mean()), 2) if len(samples) else None,
+        'max_ms': round(float(latencies.max()), 2) if len(samples) else None,
+        'bytes': int(sum(s[2] for s in samples)),
+    }
+    for p in PERCENTILES:
+        result[f'p{p}_ms'] = round(float(np.percentile(latencies, p)), 2) if len(samples) else None
+    return result
+
+
+def run_load(base_url, mix, concurrency, duration, upload_interval=None, upload_rows=0,
+             users=1000, start_day=None, seed=0):
+    """按请求比例并发压测 duration 秒，返回 {接口: 统计}（含 'total'）"""
+    samples = {path: [] for path in mix}
+    samples['/api/upload'] = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    paths, weights = list(mix), list(mix.values())
+
+    def reader(worker):
+        rng = random.Random(seed * 1000 + worker)
+        while time.perf_counter() < deadline:
+            path = rng.choices(paths, weights)[0]
+            sample = timed_request(base_url + path)
+            with lock:
+                samples[path].append(sample)
+
+    def uploader():
+        # 每次上传新一天的数据，走增量更新路径
+        day = start_day
+        while time.perf_counter() + upload_interval < deadline:
+            time.sleep(upload_interval)
+            day += pd.Timedelta(days=1)
+            buffer = io.StringIO()
+            synthetic_traffic(upload_rows, users, days=1, start=day, seed=seed + day.day).to_csv(buffer, index=False)
+            sample = timed_request(base_url + '/api/upload?filename=loadtest.csv', data=buffer.getvalue().encode())
+            with lock:
+                samples['/api/upload'].append(sample)
+
+    threads = [threading.Thread(target=reader, args=(i,), daemon=True) for i in range(concurrency)]
+    if upload_interval and upload_rows:
+        threads.append(threading.Thread(target=uploader, daemon=True))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = {path: summarize(values, elapsed) for path, values in samples.items() if values}
+    report['total'] = summarize([s for values in samples.values() for s in values], elapsed)
+    return report
+
+
+def run_size(rows, args, mix):
+    """单个数据规模：生成数据、启动应用、预热、压测，返回该规模的报告"""
+    data_dir = Path(tempfile.mkdtemp(prefix='traffic-loadtest-'))
+    days = args.days
+    synthetic_traffic(rows, args.users, days=days, seed=args.seed).to_csv(data_dir / 'traffic.csv', index=False)
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    process = start_server(data_dir, port, args.server, args.workers)
+    try:
+        startup = wait_ready(base_url, process)
+        print(f"  规模 {rows} 行：应用就绪用时 {startup:.1f} 秒")
+        for path in mix:
+            timed_request(base_url + path)  # 预热
+        endpoints = run_load(base_url, mix, args.concurrency, args.duration, args.upload_interval,
+                             args.upload_rows, args.users, pd.Timestamp('2025-12-01') + pd.Timedelta(days=days - 1),
+                             args.seed)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if not args.keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return {'rows': rows, 'users': args.users, 'startup_seconds': round(startup, 2), 'endpoints': endpoints}
+
+
+def git_revision():
+    """当前代码版本（非 git 仓库时为 None）"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report, baseline=None):
+    """打印各规模、各接口的结果；给出基线报告时附上 p95 变化"""
+    previous = {run['rows']: run['endpoints'] for run in (baseline or {}).get('runs', [])}
+    for run in report['runs']:
+        print(f"\n规模 {run['rows']} 行 / {run['users']} 用户（启动 {run['startup_seconds']} 秒）")
+        print(f"  {'接口':<24}{'请求':>8}{'错误':>6}{'吞吐/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for path, stats in run['endpoints'].items():
+            line = (f"  {path:<24}{stats['requests']:>8}{stats['errors']:>6}{stats['throughput']:>10}"
+                    f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+            old = previous.get(run['rows'], {}).get(path)
+            if old and old.get('p95_ms'):
+                line += f"   p95 {stats['p95_ms'] / old['p95_ms'] - 1:+.0%}"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地压测：各接口吞吐量与延迟分位数')
+    parser.add_argument('--sizes', default='10000,100000', help='数据规模（行数，逗号分隔）')
+    parser.add_argument('--users', type=int, default=1000, help='合成数据的用户数')
+    parser.add_argument('--days', type=int, default=7, help='合成数据覆盖的天数')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='请求比例，如 /api/stats=4,/dashboard=1')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发客户端数')
+    parser.add_argument('--duration', type=float, default=30, help='每个规模的压测秒数')
+    parser.add_argument('--upload-interval', type=float, default=0, help='压测期间每隔多少秒上传一次（0 为不上传）')
+    parser.add_argument('--upload-rows', type=int, default=10000, help='每次上传的行数')
+    parser.add_argument('--server', choices=['flask', 'gunicorn'], default='flask', help='应用服务器')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker 数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--output', default='loadtest_report.json', help='JSON 报告路径')
+    parser.add_argument('--compare', help='用于对比的基线报告')
+    parser.add_argument('--keep', action='store_true', help='保留临时数据目录')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    report = {
+        'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'revision': git_revision(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'keep')},
+        'runs': [],
+    }
+    for rows in [int(size) for size in args.sizes.split(',') if size.strip()]:
+        report['runs'].append(run_size(rows, args, mix))
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f"\n报告已保存至: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.analysis import add_time_columns, parse_timestamps  # noqa: E402
+
+
+def _parsed(values):
+    return add_time_columns(pd.DataFrame({'timestamp': parse_timestamps(pd.Series(values))}))
+
+
+def test_fixed_format():
+    df = _parsed(['2025-12-01 08:00:15', '2025-12-02 23:59:59'])
+    assert df['timestamp'].dtype == 'datetime64[ns]'
+    assert list(df['hour']) == [8, 23]
+
+
+def test_tz_offset_keeps_local_time():
+    df = _parsed(['2025-12-01 08:00:00+08:00', '2025-12-01 00:30:00+08:00'])
+    assert list(df['timestamp']) == [pd.Timestamp('2025-12-01 08:00:00'), pd.Timestamp('2025-12-01 00:30:00')]
+    assert list(df['hour']) == [8, 0]
+    assert df['day'].nunique() == 1
+
+
+def test_sub_second_precision():
+    df = _parsed(['2025-12-01 08:00:00.250', '2025-12-01 08:00:01'])
+    assert df['timestamp'].iloc[0] == pd.Timestamp('2025-12-01 08:00:00.250')
+    assert df['timestamp'].iloc[1] == pd.Timestamp('2025-12-01 08:00:01')
@@ -0,0 +1,48 @@
+import importlib
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.classifier import AppClassifier  # noqa: E402
+
+
+# 部分采集器输出的 CSV 没有 app_category 列
+CSV_WITHOUT_CATEGORY = """timestamp,src_ip,dst_ip,src_port,dst_port,protocol,bytes,user
+2025-12-01 08:00:15,192.168.1.100,8.8.8.8,52341,53,UDP,256,student_001
+2025-12-01 08:00:32,192.168.1.101,142.251.41.14,52456,443,TCP,4096,student_002
+2025-12-01 08:01:05,192.168.1.102,13.226.123.45,52789,9999,TCP,2048,student_003
+"""
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """使用临时数据目录的应用测试客户端"""
+    monkeypatch.setenv('TRAFFIC_DATA_DIR', str(tmp_path))
+    sys.modules.pop('app', None)
+    app_module = importlib.import_module('app')
+    yield app_module.app.test_client()
+    sys.modules.pop('app', None)
+
+
+def test_apply_without_category_column():
+    df = pd.DataFrame({
+        'dst_ip': ['8.8.8.8', '1.1.1.1'],
+        'src_port': [52341, 52342],
+        'dst_port': [53, 9999],
+        'protocol': ['UDP', 'TCP'],
+    })
+    AppClassifier.default().apply(df)
+    assert list(df['app_category']) == ['DNS', 'Unknown']
+
+
+def test_upload_csv_without_category_column(client):
+    response = client.post('/api/upload?filename=flows.csv', data=CSV_WITHOUT_CATEGORY.encode('utf-8'))
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['classification']['unlabeled'] == 3
+    assert body['classification']['classified'] == 2
+    assert body['ingest'] == {'added': 3, 'duplicates': 0}
@@ -0,0 +1,22 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.metrics import frame_memory  # noqa: E402
+
+
+def test_frame_memory_counts_object_strings():
+    rng = np.random.default_rng(0)
+    n = 200_000
+    df = pd.DataFrame({
+        'src_ip': pd.Series([f'10.{i % 256}.{i // 256 % 256}.{i % 97}' for i in range(n)], dtype=object),
+        'user': pd.Series([f'student_{i:06d}' for i in rng.integers(0, 5000, n)], dtype=object),
+        'bytes': rng.integers(0, 1 << 20, n),
+    })
+    deep = df.memory_usage(deep=True).sum()
+    assert deep > 2 * df.memory_usage(deep=False).sum()
+    assert 0.8 < frame_memory(df) / deep < 1.25
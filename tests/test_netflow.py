@@ -0,0 +1,46 @@
+import struct
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.netflow import V5_HEADER, V5_RECORD, FlowDecoder, decode_flows  # noqa: E402
+
+
+def _v5_datagram(n_records=2):
+    header = np.zeros(1, dtype=V5_HEADER)
+    header['version'], header['count'], header['unix_secs'] = 5, n_records, 1764576000
+    records = np.zeros(n_records, dtype=V5_RECORD)
+    records['srcaddr'], records['dstaddr'] = 0x0A000001, 0x08080808
+    records['dstport'], records['prot'], records['octets'] = 53, 17, 256
+    return header.tobytes() + records.tobytes()
+
+
+def _pcap(packets):
+    """原始 IP 链路层（linktype 101）的 pcap：[(UDP 目的端口, 载荷), ...]"""
+    out = struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, 101)
+    for dst_port, payload in packets:
+        udp = struct.pack('>HHHH', 40000, dst_port, 8 + len(payload), 0) + payload
+        ip = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0,
+                         bytes([10, 0, 0, 1]), bytes([10, 0, 0, 2])) + udp
+        out += struct.pack('<IIII', 0, 0, len(ip), len(ip)) + ip
+    return out
+
+
+def test_truncated_v5_datagram_is_skipped():
+    decoder = FlowDecoder()
+    decoder.feed(_v5_datagram()[:10])
+    decoder.feed(_v5_datagram()[:V5_HEADER.itemsize + 10])
+    assert decoder.skipped == 2
+    assert decoder.pending() == 0
+
+
+def test_pcap_only_decodes_collector_ports():
+    # DNS 报文的事务 ID 恰好为 5，不应被当作 NetFlow v5 解码
+    dns = struct.pack('>HHHHHH', 5, 0x0100, 1, 0, 0, 0) + b'\x07example\x03com\x00\x00\x01\x00\x01'
+    data = _pcap([(2055, _v5_datagram()), (53, dns), (53, _v5_datagram())])
+    flows = decode_flows(data)
+    assert len(flows['ts_ms']) == 2
+    assert len(decode_flows(data, ports=None)['ts_ms']) == 4
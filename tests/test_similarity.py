@@ -0,0 +1,22 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.similarity import SimilarityIndex  # noqa: E402
+
+
+def _profile(game, video, hour):
+    return {
+        'category_pct': {'game': game, 'video': video},
+        'active_hours': {str(hour): {'bytes': 100}},
+        'protocol_ratio': {'TCP': 1.0},
+    }
+
+
+def test_numeric_user_ids():
+    profiles = {1: _profile(0.9, 0.1, 8), 2: _profile(0.8, 0.2, 8), 3: _profile(0.0, 1.0, 22)}
+    index = SimilarityIndex.from_profiles(profiles)
+    assert '1' in index
+    similar = index.most_similar('1', k=2)
+    assert [user for user, _ in similar] == ['2', '3']
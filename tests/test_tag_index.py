@@ -0,0 +1,14 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.tag_index import TagIndex  # noqa: E402
+
+
+def test_numeric_user_ids():
+    profiles = {10: {'tags': ['夜猫子', '游戏玩家']}, 2: {'tags': ['游戏玩家']}, 3: {'tags': []}}
+    index = TagIndex.from_profiles(profiles)
+    assert index.users == ['10', '2', '3']
+    assert index.users_with(['游戏玩家']) == (2, ['10', '2'])
+    assert index.users_with(['游戏玩家', '夜猫子']) == (1, ['10'])
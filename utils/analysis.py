@@ -1,30 +1,147 @@
+import numpy as np
 import pandas as pd
+import plotly
 import plotly.graph_objects as go
 import plotly.express as px
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
 from pathlib import Path
+import os
+
+from utils.metrics import timed_stage
+from utils.memo import memoized
+
+
+# CSV 原始列
+BASE_COLUMNS = ['timestamp', 'src_ip', 'dst_ip', 'src_port', 'dst_port',
+                'protocol', 'bytes', 'app_category', 'user']
+
+
+# 派生的紧凑时间列：hour 为 0-23 (int8)，day 为自 1970-01-01 起的天数 (int32)
+TIME_COLUMNS = ['hour', 'day']
+
+# CSV 时间戳的固定格式
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+NS_PER_SECOND = 1_000_000_000
+
+# 单条折线点数超过该值时改用 WebGL（Scattergl）渲染，SVG 在数万点以上明显卡顿
+WEBGL_POINT_THRESHOLD = 20000
+
+# 本地 plotly.js 文件（相对于 static 目录），文件名带 plotly 版本（requirements.txt 中固定），
+# 升级或降级后不会沿用旧安装写出的文件
+PLOTLY_BUNDLE = f'js/plotly-{plotly.__version__}.min.js'
+
+# plotly.js 2.28 起可解码 base64 类型数组（{dtype, bdata}），更早的版本只接受 JSON 数字列表
+PLOTLY_TYPED_ARRAYS = tuple(int(p) for p in get_plotlyjs_version().split('.')[:2]) >= (2, 28)
+
+
+def _epoch_unit(values):
+    """根据数值量级判断整数 epoch 时间戳的单位"""
+    max_abs = np.abs(values).max() if len(values) else 0
+    if max_abs < 1e11:
+        return 's'
+    if max_abs < 1e14:
+        return 'ms'
+    if max_abs < 1e17:
+        return 'us'
+    return 'ns'
+
+
+def parse_timestamps(values):
+    """向量化解析时间戳列
+
+    - 整数列按 epoch 时间戳（UTC，秒/毫秒/微秒/纳秒按量级自动识别）解析
+    - 字符串列按固定的 TIMESTAMP_FORMAT 解析，不逐值推断格式
+    - 不符合固定格式（小数秒、时区偏移等）时才退回 pandas 的逐值格式推断；带时区偏移的时间戳取其
+      本地时间（与 .dt.hour 的结果一致），同一列中偏移不一致时统一换算为 UTC
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    if pd.api.types.is_integer_dtype(values):
+        return pd.to_datetime(values, unit=_epoch_unit(values.to_numpy()))
+    try:
+        parsed = pd.to_datetime(values, format=TIMESTAMP_FORMAT)
+    except ValueError:
+        try:
+            parsed = pd.to_datetime(values, format='mixed')
+        except ValueError:
+            parsed = None
+        if parsed is None or not pd.api.types.is_datetime64_any_dtype(parsed):
+            # 时区偏移不一致（pandas 2 返回 object 列，pandas 3 抛出 ValueError）
+            parsed = pd.to_datetime(values, format='mixed', utc=True)
+        if parsed.dt.tz is not None:
+            parsed = parsed.dt.tz_localize(None)
+    return parsed.astype('datetime64[ns]')
+
+
+def add_time_columns(df):
+    """从 timestamp 派生紧凑整数列 hour / day（整数运算，不生成 Python date 对象）"""
+    seconds = df['timestamp'].to_numpy(dtype='datetime64[ns]').view('int64') // NS_PER_SECOND
+    df['hour'] = ((seconds // 3600) % 24).astype(np.int8)
+    df['day'] = (seconds // 86400).astype(np.int32)
+    return df
+
+
+def ensure_time_columns(df):
+    """缺少时间列时才派生（用于已带 hour / day 的列式缓存）"""
+    if all(col in df.columns for col in TIME_COLUMNS):
+        return df
+    return add_time_columns(df)
+
+
+def day_to_str(days):
+    """将 day 整数（自 1970-01-01 起的天数）格式化为 YYYY-MM-DD 字符串数组"""
+    return np.datetime_as_string(np.asarray(days, dtype='int64').astype('datetime64[D]'))
+
+
+def prepare_traffic_frame(df):
+    """解析时间戳并派生时间列（原地修改并返回）"""
+    with timed_stage('to_datetime', rows=len(df)):
+        df['timestamp'] = parse_timestamps(df['timestamp'])
+        add_time_columns(df)
+    return df
+
+
+def load_traffic_csv(csv_path):
+    """读取流量 CSV 并完成时间列准备"""
+    with timed_stage('csv_parse') as t:
+        df = pd.read_csv(csv_path)
+        t.set_rows(len(df))
+    return prepare_traffic_frame(df)
 
 
 class TrafficAnalyzer:
-    """校园网流量分析类"""
+    """校园网流量分析类
+
+    data_version 不为 None 时（已发布快照中的分析器），查询方法的结果按版本和参数缓存。
+    """
     
     def __init__(self, csv_path):
         """初始化分析器，加载 CSV 文件"""
         self.csv_path = csv_path
         self.df = None
+        self.data_version = None
         self.load_data()
     
+    @classmethod
+    def from_dataframe(cls, df, data_version=None):
+        """基于已准备好的 DataFrame 创建分析器（不读取文件）"""
+        analyzer = cls.__new__(cls)
+        analyzer.csv_path = None
+        analyzer.df = df
+        analyzer.data_version = data_version
+        return analyzer
+    
     def load_data(self):
         """加载 CSV 文件"""
         try:
-            self.df = pd.read_csv(self.csv_path)
-            self.df['timestamp'] = pd.to_datetime(self.df['timestamp'])
-            self.df['hour'] = self.df['timestamp'].dt.hour
-            self.df['date'] = self.df['timestamp'].dt.date
+            self.df = load_traffic_csv(self.csv_path)
             return True
         except Exception as e:
             print(f"数据加载失败: {e}")
             return False
     
+    @memoized
     def get_total_traffic(self):
         """获取总流量统计"""
         if self.df is None or len(self.df) == 0:
@@ -37,22 +154,27 @@ class TrafficAnalyzer:
             "unique_ips": self.df['src_ip'].nunique() + self.df['dst_ip'].nunique()
         }
     
+    @memoized
     def get_user_traffic_ranking(self, top_n=10):
-        """获取用户流量排名"""
+        """获取用户流量排名（top_n 为 None 时返回全部用户）"""
         if self.df is None or len(self.df) == 0:
             return []
         
-        user_traffic = self.df.groupby('user')['bytes'].sum().sort_values(ascending=False).head(top_n)
+        user_traffic = self.df.groupby('user', observed=True)['bytes'].sum().sort_values(ascending=False)
+        if top_n is not None:
+            user_traffic = user_traffic.head(top_n)
         return [{"user": user, "bytes": int(bytes_val)} for user, bytes_val in user_traffic.items()]
     
+    @memoized
     def get_app_category_traffic(self):
         """获取应用类别流量分布"""
         if self.df is None or len(self.df) == 0:
             return []
         
-        app_traffic = self.df.groupby('app_category')['bytes'].sum().sort_values(ascending=False)
+        app_traffic = self.df.groupby('app_category', observed=True)['bytes'].sum().sort_values(ascending=False)
         return [{"category": cat, "bytes": int(bytes_val)} for cat, bytes_val in app_traffic.items()]
     
+    @memoized
     def get_traffic_trend(self, unit='hour'):
         """获取流量趋势
         
@@ -65,13 +187,14 @@ class TrafficAnalyzer:
         if unit == 'hour':
             trend = self.df.set_index('timestamp').resample('h')['bytes'].sum()
         else:
-            trend = self.df.set_index('timestamp').resample('5T')['bytes'].sum()
+            trend = self.df.set_index('timestamp').resample('5min')['bytes'].sum()
         
         result = []
         for timestamp, bytes_val in trend.items():
             result.append({"time": str(timestamp), "bytes": int(bytes_val)})
         return result
     
+    @memoized
     def get_active_hours(self):
         """获取活跃时段分析（按小时的用户活跃度）"""
         if self.df is None or len(self.df) == 0:
@@ -89,6 +212,7 @@ class TrafficAnalyzer:
         
         return hourly_stats.to_dict('records')
     
+    @memoized
     def get_user_app_distribution(self, user_id):
         """获取指定用户的应用类别占比"""
         if self.df is None or len(self.df) == 0:
@@ -98,25 +222,54 @@ class TrafficAnalyzer:
         if len(user_data) == 0:
             return []
         
-        app_dist = user_data.groupby('app_category')['bytes'].sum().sort_values(ascending=False)
+        app_dist = user_data.groupby('app_category', observed=True)['bytes'].sum().sort_values(ascending=False)
         return [{"category": cat, "bytes": int(bytes_val)} for cat, bytes_val in app_dist.items()]
 
 
+def write_plotly_bundle(static_dir):
+    """将安装的 plotly 自带的 plotly.js 写入 static 目录（已存在时跳过），返回相对路径
+
+    页面从本地加载与 plotly 版本一致的 plotly.js，不依赖 CDN；其他版本留下的文件一并删除。
+    """
+    path = Path(static_dir) / PLOTLY_BUNDLE
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(get_plotlyjs(), encoding='utf-8')
+        os.replace(tmp_path, path)
+    for stale in path.parent.glob('plotly-*.min.js'):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+    return PLOTLY_BUNDLE
+
+
+def scatter_trace(n_points, **kwargs):
+    """折线轨迹：点数超过 WEBGL_POINT_THRESHOLD 时使用 Scattergl"""
+    if n_points > WEBGL_POINT_THRESHOLD:
+        return go.Scattergl(**kwargs)
+    return go.Scatter(**kwargs)
+
+
 def generate_traffic_trend_chart(analyzer):
-    """生成流量趋势折线图（HTML）"""
+    """生成流量趋势折线图（HTML）
+
+    x、y 以 numpy 数组传入（plotly 6 起序列化为 base64 类型数组而非 JSON 数字列表）；
+    时间以毫秒时间戳表示，配合 date 类型坐标轴显示。
+    """
     trend_data = analyzer.get_traffic_trend('hour')
     
     if not trend_data:
         return "<p>暂无数据</p>"
     
-    times = [item['time'] for item in trend_data]
-    bytes_vals = [item['bytes'] / (1024**2) for item in trend_data]  # 转换为 MB
+    times = np.array([item['time'] for item in trend_data], dtype='datetime64[ms]').astype(np.int64).astype(np.float64)
+    bytes_vals = np.fromiter((item['bytes'] for item in trend_data), dtype=np.float64, count=len(trend_data)) / (1024**2)  # 转换为 MB
     
     fig = go.Figure(data=[
-        go.Scatter(
+        scatter_trace(
+            len(times),
             x=times,
             y=bytes_vals,
-            mode='lines+markers',
+            mode='lines+markers' if len(times) <= WEBGL_POINT_THRESHOLD else 'lines',
             name='流量 (MB)',
             line=dict(color='#1f77b4', width=2),
             marker=dict(size=6)
@@ -126,6 +279,7 @@ def generate_traffic_trend_chart(analyzer):
     fig.update_layout(
         title='流量趋势分析',
         xaxis_title='时间',
+        xaxis_type='date',
         yaxis_title='流量 (MB)',
         hovermode='x unified',
         template='plotly_white',
@@ -143,7 +297,7 @@ def generate_app_category_pie_chart(analyzer):
         return "<p>暂无数据</p>"
     
     categories = [item['category'] for item in app_data]
-    bytes_vals = [item['bytes'] / (1024**2) for item in app_data]  # 转换为 MB
+    bytes_vals = np.array([item['bytes'] for item in app_data], dtype=np.float64) / (1024**2)  # 转换为 MB
     
     fig = go.Figure(data=[go.Pie(
         labels=categories,
@@ -167,7 +321,7 @@ def generate_user_ranking_chart(analyzer):
         return "<p>暂无数据</p>"
     
     users = [item['user'] for item in user_data]
-    bytes_vals = [item['bytes'] / (1024**2) for item in user_data]  # 转换为 MB
+    bytes_vals = np.array([item['bytes'] for item in user_data], dtype=np.float64) / (1024**2)  # 转换为 MB
     
     fig = go.Figure(data=[
         go.Bar(
@@ -199,8 +353,8 @@ def generate_active_hours_chart(analyzer):
         return "<p>暂无数据</p>"
     
     hours = [item['hour'] for item in active_data]
-    active_users = [item['active_users'] for item in active_data]
-    traffic = [item['total_bytes'] / (1024**2) for item in active_data]  # 转换为 MB
+    active_users = np.array([item['active_users'] for item in active_data], dtype=np.int32)
+    traffic = np.array([item['total_bytes'] for item in active_data], dtype=np.float64) / (1024**2)  # 转换为 MB
     
     fig = go.Figure()
     
@@ -252,9 +406,15 @@ def generate_active_hours_chart(analyzer):
 
 def generate_all_charts(analyzer):
     """生成所有图表"""
-    return {
-        'traffic_trend': generate_traffic_trend_chart(analyzer),
-        'app_category': generate_app_category_pie_chart(analyzer),
-        'user_ranking': generate_user_ranking_chart(analyzer),
-        'active_hours': generate_active_hours_chart(analyzer)
+    chart_builders = {
+        'traffic_trend': generate_traffic_trend_chart,
+        'app_category': generate_app_category_pie_chart,
+        'user_ranking': generate_user_ranking_chart,
+        'active_hours': generate_active_hours_chart
     }
+    
+    charts = {}
+    for name, builder in chart_builders.items():
+        with timed_stage(f'chart_{name}'):
+            charts[name] = builder(analyzer)
+    return charts
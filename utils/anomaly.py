@@ -0,0 +1,188 @@
+import json
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.analysis import day_to_str
+from utils.metrics import timed_stage
+
+
+# 滚动基线窗口（天）
+BASELINE_WINDOW = 14
+
+# 计算得分所需的最少历史天数
+MIN_HISTORY = 3
+
+# 稳健 z 分数的异常阈值（Iglewicz-Hoaglin 建议值）
+ANOMALY_THRESHOLD = 3.5
+
+# 离散度下限：基线中位数的比例及绝对字节数，避免历史流量恒定时得分失真
+MIN_SCALE_RATIO = 0.1
+MIN_SCALE_BYTES = 1024.0 * 1024
+
+
+def _user_day_bytes(df, users, first_day, n_days):
+    """按 (用户, 日) 汇总流量，users 为用户 -> 行号的映射
+
+    返回 (矩阵, 各记录行号, 各记录列号)。
+    """
+    rows = df['user'].astype(str).map(users).to_numpy(dtype=np.int64)
+    cols = df['day'].to_numpy(dtype=np.int64) - first_day
+    matrix = np.bincount(rows * n_days + cols, weights=df['bytes'].to_numpy(dtype=np.float64),
+                         minlength=len(users) * n_days).reshape(len(users), n_days)
+    return matrix, rows, cols
+
+
+def _first_active(first_active, rows, cols):
+    """按记录更新每个用户的首次出现列号"""
+    np.minimum.at(first_active, rows, cols)
+    return first_active
+
+
+def robust_scores(matrix, first_active, start_col=0, window=BASELINE_WINDOW):
+    """计算 [start_col, n_days) 各列的稳健 z 分数
+
+    对全部用户同时计算：每一天与该用户之前 window 天（从首次活跃日算起）的中位数比较，
+    以 MAD（为 0 时用平均绝对偏差）衡量离散度。历史不足 MIN_HISTORY 天的单元格得分为 NaN。
+    """
+    n_users, n_days = matrix.shape
+    cols = np.arange(n_days)
+    # 首次活跃之前的天视为缺失，之后未活跃的天计为 0
+    history = np.where(cols[None, :] >= first_active[:, None], matrix, np.nan)
+    scores = np.full((n_users, max(n_days - start_col, 0)), np.nan, dtype=np.float32)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for col in range(start_col, n_days):
+            past = history[:, max(0, col - window):col]
+            if past.shape[1] < MIN_HISTORY:
+                continue
+            median = np.nanmedian(past, axis=1)
+            deviation = np.abs(past - median[:, None])
+            mad = np.nanmedian(deviation, axis=1)
+            # MAD 为 0（过半历史天数相同，如多为 0）时退化为平均绝对偏差
+            scale = np.where(mad > 0, 1.4826 * mad, 1.2533 * np.nanmean(deviation, axis=1))
+            scale = np.maximum(scale, np.maximum(MIN_SCALE_RATIO * median, MIN_SCALE_BYTES))
+            score = (matrix[:, col] - median) / scale
+            enough = np.sum(~np.isnan(past), axis=1) >= MIN_HISTORY
+            score[~enough | (col < first_active)] = np.nan
+            scores[:, col - start_col] = score
+    return scores
+
+
+class AnomalyIndex:
+    """用户 × 日流量矩阵及每个单元格相对该用户滚动基线的稳健 z 分数
+
+    新数据到达时，updated() 只扩展矩阵并重算受影响日期及之后的得分，无需全量重建。
+    """
+
+    def __init__(self, users, first_day, matrix, first_active, scores, rows=0):
+        self.users = list(users)
+        self.first_day = int(first_day)
+        self.matrix = matrix
+        self.first_active = first_active
+        self.scores = scores
+        self.rows = int(rows)
+        self._positions = {user: i for i, user in enumerate(self.users)}
+
+    @classmethod
+    def from_frame(cls, df):
+        """从含 day 列的 DataFrame 构建"""
+        with timed_stage('anomaly_index', rows=len(df)):
+            users = {u: i for i, u in enumerate(sorted(df['user'].astype(str).unique()))}
+            days = df['day'].to_numpy(dtype=np.int64)
+            first_day = int(days.min())
+            n_days = int(days.max()) - first_day + 1
+            matrix, rows, cols = _user_day_bytes(df, users, first_day, n_days)
+            first_active = _first_active(np.full(len(users), n_days, dtype=np.int64), rows, cols)
+            return cls(list(users), first_day, matrix, first_active,
+                       robust_scores(matrix, first_active), rows=len(df))
+
+    def updated(self, new_df):
+        """合并新增数据，返回新的索引（自身保持不变，可被旧快照继续使用）"""
+        with timed_stage('anomaly_index', rows=len(new_df)):
+            positions = dict(self._positions)
+            new_users = sorted(set(new_df['user'].astype(str).unique()) - positions.keys())
+            users = self.users + new_users
+            positions.update({u: len(self.users) + i for i, u in enumerate(new_users)})
+
+            new_days = new_df['day'].to_numpy(dtype=np.int64)
+            first_day = min(self.first_day, int(new_days.min()))
+            last_day = max(self.first_day + self.matrix.shape[1] - 1, int(new_days.max()))
+            n_days = last_day - first_day + 1
+            offset = self.first_day - first_day
+
+            matrix, rows, cols = _user_day_bytes(new_df, positions, first_day, n_days)
+            matrix[:len(self.users), offset:offset + self.matrix.shape[1]] += self.matrix
+
+            first_active = np.full(len(users), n_days, dtype=np.int64)
+            first_active[:len(self.users)] = np.asarray(self.first_active) + offset
+            first_active = _first_active(first_active, rows, cols)
+
+            # 只重算最早受影响日期及之后的得分；新数据早于原有首日时全部重算
+            start_col = min(int(cols.min()), self.scores.shape[1]) if offset == 0 else 0
+            scores = np.full((len(users), n_days), np.nan, dtype=np.float32)
+            scores[:len(self.users), :start_col] = self.scores[:, :start_col]
+            scores[:, start_col:] = robust_scores(matrix, first_active, start_col)
+            return AnomalyIndex(users, first_day, matrix, first_active, scores,
+                                rows=self.rows + len(new_df))
+
+    def anomalies(self, user=None, start=None, end=None, threshold=ANOMALY_THRESHOLD, limit=100):
+        """列出得分绝对值不低于阈值的 (用户, 日期)，按得分绝对值降序"""
+        scores = np.asarray(self.scores)
+        row_slice = slice(None)
+        if user is not None:
+            row = self._positions.get(user)
+            if row is None:
+                return []
+            row_slice = slice(row, row + 1)
+
+        lo = 0 if start is None else max(0, self._day_col(start))
+        hi = scores.shape[1] if end is None else min(scores.shape[1], self._day_col(end) + 1)
+        window = np.abs(scores[row_slice, lo:hi])
+        with np.errstate(invalid='ignore'):
+            rows, cols = np.nonzero(window >= threshold)
+        order = np.argsort(-window[rows, cols], kind='stable')[:limit]
+        row_base = 0 if user is None else row_slice.start
+
+        result = []
+        dates = day_to_str(np.arange(lo, hi) + self.first_day)
+        for i in order:
+            r, c = rows[i] + row_base, cols[i] + lo
+            result.append({
+                'user': self.users[r],
+                'date': str(dates[cols[i]]),
+                'bytes': int(self.matrix[r, c]),
+                'score': round(float(scores[r, c]), 2),
+                'direction': 'spike' if scores[r, c] > 0 else 'drop',
+            })
+        return result
+
+    def _day_col(self, value):
+        """将日期字符串转为矩阵列号"""
+        day = pd.Timestamp(value).normalize().value // (86400 * 10 ** 9)
+        return int(day) - self.first_day
+
+    def save(self, directory):
+        """保存为 .npy 文件（供共享存储以内存映射方式挂载）"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / 'matrix.npy', self.matrix)
+        np.save(directory / 'first_active.npy', np.asarray(self.first_active))
+        np.save(directory / 'scores.npy', self.scores)
+        with open(directory / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump({'users': self.users, 'first_day': self.first_day, 'rows': self.rows}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """从 save() 的输出加载"""
+        directory = Path(directory)
+        with open(directory / 'meta.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(meta['users'], meta['first_day'],
+                   np.load(directory / 'matrix.npy', mmap_mode=mmap_mode),
+                   np.load(directory / 'first_active.npy', mmap_mode=mmap_mode),
+                   np.load(directory / 'scores.npy', mmap_mode=mmap_mode),
+                   rows=meta['rows'])
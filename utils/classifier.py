@@ -0,0 +1,190 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from utils.metrics import timed_stage, registry as metrics_registry
+from utils.enrichment import parse_ipv4
+from utils.netflow import UNLABELED_CATEGORY, IPUserTable
+
+
+# 视为未标注的应用类别（不区分大小写，另含缺失值）
+UNLABELED_VALUES = {UNLABELED_CATEGORY.lower(), ''}
+
+# 规则表的列：type 为 ip（value 为地址或 CIDR 网段）或 port（value 为端口或 lo-hi 端口范围），
+# protocol 为空表示任意协议
+RULE_COLUMNS = ['type', 'value', 'protocol', 'category']
+
+# 内置规则（未配置规则表时使用），类别名与画像的标准化类别关键词一致
+DEFAULT_RULES = [
+    ('port', '53', '', 'DNS'),
+    ('port', '853', 'TCP', 'DNS'),
+    ('port', '80', 'TCP', 'Web Browse'),
+    ('port', '8080', 'TCP', 'Web Browse'),
+    ('port', '443', 'TCP', 'Web Browse'),
+    ('port', '443', 'UDP', 'Web Browse'),
+    ('port', '554', '', 'Video Streaming'),
+    ('port', '1935', 'TCP', 'Video Streaming'),
+    ('port', '5222-5223', 'TCP', 'Chat'),
+    ('port', '3478-3481', 'UDP', 'Chat'),
+    ('port', '3074', '', 'Game'),
+    ('port', '3659', '', 'Game'),
+    ('port', '25565', 'TCP', 'Game'),
+    ('port', '27015-27030', '', 'Game'),
+]
+
+N_PORTS = 65536
+
+metrics_registry.describe('app_classifier_records_total', 'counter', '应用类别分类的记录数（按结果）')
+
+
+def _port_range(value):
+    """'443' 或 '27015-27030' -> (lo, hi)"""
+    lo, _, hi = str(value).strip().partition('-')
+    lo = int(lo)
+    hi = int(hi) if hi else lo
+    if not 0 <= lo <= hi < N_PORTS:
+        raise ValueError(f'无效的端口: {value}')
+    return lo, hi
+
+
+class AppClassifier:
+    """按规则表为未标注的记录推断应用类别
+
+    优先级：目的地址网段（最长前缀优先）> 目的端口 + 协议 > 目的端口 > 源端口 + 协议 > 源端口
+    （源端口用于响应方向的流量）。端口规则展开为 (协议, 端口) -> 类别编号的查找表，每条记录只需一次
+    数组下标访问；网段规则复用 IPUserTable 的区间展开，对去重后的目的地址做一次 searchsorted。
+    同一层级中范围更小的端口规则优先。
+    """
+
+    def __init__(self, categories, protocols, port_table, ip_table=None):
+        self.categories = list(categories)
+        self.protocols = list(protocols)
+        self.port_table = port_table
+        self.ip_table = ip_table
+        self._category_codes = {name: i for i, name in enumerate(self.categories)}
+
+    @classmethod
+    def from_rules(cls, rules):
+        """从 [(type, value, protocol, category), ...] 构建"""
+        rules = [(str(t).strip().lower(), str(v).strip(), str(p or '').strip().upper(), str(c).strip())
+                 for t, v, p, c in rules]
+        categories = list(dict.fromkeys(c for _, _, _, c in rules))
+        codes = {name: i for i, name in enumerate(categories)}
+        port_rules = [r for r in rules if r[0] == 'port']
+        protocols = sorted({p for _, _, p, _ in port_rules if p})
+
+        # 第 0 行为任意协议，其后每个协议一行；协议行先继承任意协议的规则，再由协议规则覆盖
+        port_table = np.full((len(protocols) + 1, N_PORTS), -1, dtype=np.int16)
+        ranges = sorted(((_port_range(v), p, c) for _, v, p, c in port_rules),
+                        key=lambda r: -(r[0][1] - r[0][0]))
+        for (lo, hi), protocol, category in ranges:
+            if not protocol:
+                port_table[0, lo:hi + 1] = codes[category]
+        port_table[1:] = port_table[0]
+        for (lo, hi), protocol, category in ranges:
+            if protocol:
+                port_table[protocols.index(protocol) + 1, lo:hi + 1] = codes[category]
+
+        ip_rules = [(v, c) for t, v, _, c in rules if t == 'ip']
+        ip_table = IPUserTable.from_records(ip_rules) if ip_rules else None
+        return cls(categories, protocols, port_table, ip_table)
+
+    @classmethod
+    def from_csv(cls, path):
+        """从规则表 CSV（type,value,protocol,category）加载"""
+        table = pd.read_csv(path, dtype=str, keep_default_na=False, usecols=RULE_COLUMNS)
+        return cls.from_rules(table[RULE_COLUMNS].itertuples(index=False))
+
+    @classmethod
+    def default(cls):
+        """内置规则"""
+        return cls.from_rules(DEFAULT_RULES)
+
+    def _port_codes(self, ports, protocol_rows):
+        """端口 -> 类别编号（-1 为未命中），端口缺失或越界时视为未命中"""
+        ports = np.asarray(ports)
+        if not np.issubdtype(ports.dtype, np.integer):
+            ports = pd.to_numeric(pd.Series(ports), errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+        valid = (ports >= 0) & (ports < N_PORTS)
+        codes = self.port_table[protocol_rows, np.where(valid, ports, 0)]
+        return np.where(valid, codes, -1)
+
+    def _ip_codes(self, dst_ip):
+        """目的地址 -> 类别编号（-1 为未命中），按去重后的地址查找"""
+        addr_codes, uniques = pd.factorize(dst_ip)
+        addresses, valid = parse_ipv4(np.asarray(uniques, dtype=object))
+        names = self.ip_table.resolve(addresses)
+        per_address = np.array([self._category_codes.get(n, -1) if ok else -1 for n, ok in zip(names, valid)]
+                               + [-1], dtype=np.int64)
+        return per_address[addr_codes]
+
+    def classify(self, df):
+        """各记录按规则推断的类别编号（-1 为未命中），不考虑记录原有的类别"""
+        protocol_codes, protocol_names = pd.factorize(df['protocol'])
+        # 协议 -> 查找表的行（规则中未出现的协议只用任意协议行）
+        rows = np.array([self.protocols.index(str(p).upper()) + 1 if str(p).upper() in self.protocols else 0
+                         for p in protocol_names] + [0], dtype=np.int64)
+        protocol_rows = rows[protocol_codes]
+
+        codes = np.full(len(df), -1, dtype=np.int64)
+        if self.ip_table is not None and len(self.ip_table):
+            codes = self._ip_codes(df['dst_ip'])
+        for column in ('dst_port', 'src_port'):
+            missing = codes < 0
+            if not missing.any():
+                break
+            codes[missing] = self._port_codes(df[column].to_numpy()[missing], protocol_rows[missing])
+        return codes
+
+    def apply(self, df, report=None):
+        """为 app_category 未标注的记录填入推断的类别（原地修改并返回），未命中的记为 Unknown
+
+        原有类别按去重值判断是否未标注，结果由类别编号一次 take 生成，不逐条处理字符串。
+        数据中没有 app_category 列时（部分采集器不输出该列）视为全部未标注。
+        report 为 Counter 时累加 records / unlabeled / classified 计数。
+        """
+        if 'app_category' not in df.columns:
+            df['app_category'] = pd.Series(pd.NA, index=df.index, dtype=object)
+        with timed_stage('app_classify', rows=len(df)):
+            labels = df['app_category']
+            label_codes, label_names = pd.factorize(labels)
+            # 末尾对应缺失值（factorize 编号 -1）
+            unlabeled_names = np.array([str(name).strip().lower() in UNLABELED_VALUES for name in label_names]
+                                       + [True])
+            unlabeled = unlabeled_names[label_codes]
+            n_unlabeled = int(unlabeled.sum())
+            classified = 0
+            if n_unlabeled:
+                subset = df if n_unlabeled == len(df) else \
+                    df.loc[unlabeled, ['dst_ip', 'dst_port', 'src_port', 'protocol']]
+                codes = self.classify(subset)
+                classified = int((codes >= 0).sum())
+                # 新的类别编号：原有类别、规则类别、Unknown 依次排列
+                names = [str(name) for name in label_names] + self.categories + [UNLABELED_CATEGORY]
+                result = label_codes.astype(np.int64)
+                result[unlabeled] = np.where(codes >= 0, codes + len(label_names), len(names) - 1)
+                if isinstance(labels.dtype, pd.StringDtype):
+                    df['app_category'] = pd.array(names, dtype=labels.dtype).take(result)
+                else:
+                    df['app_category'] = np.array(names, dtype=object)[result]
+
+        metrics_registry.inc('app_classifier_records_total', classified, result='classified')
+        metrics_registry.inc('app_classifier_records_total', n_unlabeled - classified, result='unmatched')
+        metrics_registry.inc('app_classifier_records_total', len(df) - n_unlabeled, result='labeled')
+        if report is not None:
+            report.update({'records': len(df), 'unlabeled': n_unlabeled, 'classified': classified})
+        return df
+
+
+def classification_summary(report):
+    """分类计数 -> 已分类 / 未命中占比（相对未标注记录）"""
+    report = Counter(report)
+    unlabeled = report['unlabeled']
+    return {
+        'records': report['records'],
+        'unlabeled': unlabeled,
+        'classified': report['classified'],
+        'unmatched': unlabeled - report['classified'],
+        'classified_share': round(report['classified'] / unlabeled, 4) if unlabeled else None,
+    }
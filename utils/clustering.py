@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+from utils.metrics import timed_stage
+from utils.similarity import minibatch_kmeans
+
+
+# 默认行为聚类数
+DEFAULT_CLUSTERS = 8
+
+# 规律度阈值：不低于该值标记为规律用户，否则为波动用户（至少 2 个活跃日）
+REGULARITY_THRESHOLD = 0.7
+
+
+def category_index(name, categories):
+    """单个原始应用类别的标准化类别编号（按 categories 顺序首个匹配，未匹配为 len(categories)）"""
+    lowered = str(name).lower()
+    for j, keywords in enumerate(categories.values()):
+        if any(keyword in lowered for keyword in keywords):
+            return j
+    return len(categories)
+
+
+def category_codes(app_category, categories):
+    """将原始应用类别映射为标准化类别编号（按 categories 顺序首个匹配，未匹配为 others）
+
+    categories 为 {标准类别: [关键词, ...]}，others 的编号为 len(categories)。
+    只对去重后的类别做字符串匹配，再按编码展开到每条记录。
+    """
+    codes, uniques = pd.factorize(app_category.astype(str), use_na_sentinel=False)
+    mapping = np.array([category_index(name, categories) for name in uniques], dtype=np.int16)
+    return mapping[codes] if len(mapping) else np.zeros(len(codes), dtype=np.int16)
+
+
+def _shares(matrix):
+    """按行归一化为占比"""
+    totals = matrix.sum(axis=1, keepdims=True)
+    totals[totals == 0] = 1.0
+    return matrix / totals
+
+
+def day_profile_sums(user_codes, n_users, days, hours, weights):
+    """各用户每个活跃日的 24 小时流量分布（单位向量）之和，返回 (unit_sum, active_days)
+
+    两者都可以按天直接相加合并，规律度由 regularity_scores 从合并后的结果求出。
+    """
+    user_codes = np.asarray(user_codes, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    hours = np.asarray(hours, dtype=np.int64)
+    if len(days) == 0:
+        return np.zeros((n_users, 24)), np.zeros(n_users, dtype=np.int64)
+
+    # (用户, 日, 小时) 级别的流量，只对实际出现的组合计算
+    day_index = days - days.min()
+    n_days = int(day_index.max()) + 1
+    keys, inverse = np.unique((user_codes * n_days + day_index) * 24 + hours, return_inverse=True)
+    cell_bytes = np.bincount(inverse, weights=weights)
+    user_days, day_inverse = np.unique(keys // 24, return_inverse=True)
+    day_norm = np.sqrt(np.bincount(day_inverse, weights=cell_bytes ** 2))
+    unit = np.divide(cell_bytes, day_norm[day_inverse], out=np.zeros_like(cell_bytes),
+                     where=day_norm[day_inverse] > 0)
+
+    day_users = user_days // n_days
+    cell_users = day_users[day_inverse]
+    unit_sum = np.bincount(cell_users * 24 + keys % 24, weights=unit,
+                           minlength=n_users * 24).reshape(n_users, 24)
+    active_days = np.bincount(day_users, minlength=n_users)
+    return unit_sum, active_days
+
+
+def regularity_scores(unit_sum, active_days):
+    """规律度：各活跃日小时分布与其平均方向的平均余弦相似度（0~1），即单位向量和的模长除以天数"""
+    return np.linalg.norm(unit_sum, axis=1) / np.maximum(active_days, 1)
+
+
+def behavior_features(hour_bytes, category_bytes):
+    """由每用户的小时流量和标准化类别流量构建聚类特征
+
+    特征为 24 小时流量占比 + 标准化类别占比 + 标准化后的 log 流量规模。
+    """
+    volume = np.log1p(hour_bytes.sum(axis=1))
+    volume = (volume - volume.mean()) / (volume.std() or 1.0)
+    features = np.hstack([_shares(hour_bytes), _shares(category_bytes), volume[:, None] * 0.25])
+    return features.astype(np.float32)
+
+
+def cluster_users(users, hour_bytes, category_bytes, unit_sum, active_days, categories,
+                  n_clusters=DEFAULT_CLUSTERS):
+    """对全部用户做批量行为聚类，返回 {用户: {'cluster', 'cluster_label', 'regularity', 'active_days'}}
+
+    输入均为按 users 顺序排列的矩阵（见 utils/profile_state.py 的 ProfileState.matrices）。
+    """
+    if len(users) == 0:
+        return {}
+    with timed_stage('user_clustering', rows=len(users)):
+        features = behavior_features(np.asarray(hour_bytes, dtype=np.float64),
+                                     np.asarray(category_bytes, dtype=np.float64))
+        centroids, labels = minibatch_kmeans(features, n_clusters)
+        names = list(categories) + ['others']
+        cluster_labels = [_describe_centroid(c, names) for c in centroids]
+        regularity = regularity_scores(unit_sum, active_days)
+
+    return {
+        user: {
+            'cluster': int(label),
+            'cluster_label': cluster_labels[label],
+            'regularity': round(float(score), 4),
+            'active_days': int(days),
+        }
+        for user, label, score, days in zip(users, labels, regularity, active_days)
+    }
+
+
+def _describe_centroid(centroid, category_names):
+    """用主要类别和高峰时段描述一个聚类中心，例如 'video@21h'"""
+    peak_hour = int(np.argmax(centroid[:24]))
+    category = category_names[int(np.argmax(centroid[24:24 + len(category_names)]))]
+    return f'{category}@{peak_hour:02d}h'
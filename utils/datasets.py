@@ -0,0 +1,168 @@
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from utils.metrics import frame_memory, registry as metrics_registry
+from utils.partition import PartitionedDataset, MANIFEST_FILE
+from utils.shared_store import SharedStore, SharedStoreWatcher
+
+
+# 默认数据集名称（沿用 data/traffic 和 data/shared 目录）
+DEFAULT_DATASET = 'default'
+
+# 数据集名称：字母、数字、下划线和连字符
+DATASET_NAME = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# 画像内存占用的粗略估计（每个用户）
+PROFILE_BYTES_ESTIMATE = 2048
+
+metrics_registry.describe('dataset_registry_resident_bytes', 'gauge', '常驻数据集的估计内存占用（字节）')
+metrics_registry.describe('dataset_registry_evictions_total', 'counter', '因内存预算被换出的数据集次数')
+metrics_registry.describe('dataset_registry_reloads_total', 'counter', '从列式缓存重新挂载数据集的次数')
+
+
+def valid_name(name):
+    """数据集名称是否合法"""
+    return isinstance(name, str) and bool(DATASET_NAME.match(name))
+
+
+def snapshot_memory(snapshot, frame_bytes=None):
+    """快照的估计内存占用：DataFrame 占用 + 图表 HTML + 按用户数估计的画像
+
+    frame_bytes 为调用方已估计的 DataFrame 占用（缺省时按 frame_memory 估计）。
+    """
+    if snapshot.analyzer is None:
+        return 0
+    size = frame_memory(snapshot.analyzer.df) if frame_bytes is None else int(frame_bytes)
+    size += sum(len(html) for html in snapshot.charts_html.values())
+    return size + PROFILE_BYTES_ESTIMATE * len(snapshot.user_profiles)
+
+
+class DatasetRegistry:
+    """命名数据集注册表
+
+    每个数据集有自己的分区目录和列式缓存（SharedStore 版本目录）。已加载的快照保存在按估计内存
+    占用计算的 LRU 中，总量超过预算时换出最久未用的数据集：换出前若快照尚未写入缓存则先写入，
+    之后按需从缓存只读挂载，无需重新解析和分析。
+
+    目录布局：
+        data/traffic、data/shared                    默认数据集
+        data/datasets/<name>/traffic、.../shared      命名数据集
+    """
+
+    def __init__(self, data_root, memory_budget, base_columns=None, dedup=True):
+        self.data_root = Path(data_root)
+        self.dedup = dedup
+        self.datasets_root = self.data_root / 'datasets'
+        self.memory_budget = int(memory_budget)
+        self.base_columns = base_columns
+        self._snapshots = OrderedDict()
+        self._sizes = {}
+        self._datasets = {}
+        self._stores = {}
+        self._watchers = {}
+        self._lock = threading.Lock()
+
+    def _root(self, name):
+        return self.data_root if name == DEFAULT_DATASET else self.datasets_root / name
+
+    def dataset(self, name):
+        """数据集的分区存储（首次访问时创建目录）"""
+        if name not in self._datasets:
+            self._datasets[name] = PartitionedDataset(self._root(name) / 'traffic', dedup=self.dedup)
+        return self._datasets[name]
+
+    def store(self, name):
+        """数据集的列式缓存（shared 模式下即多 worker 共享存储）"""
+        if name not in self._stores:
+            self._stores[name] = SharedStore(self._root(name) / 'shared', base_columns=self.base_columns)
+        return self._stores[name]
+
+    def watcher(self, name):
+        """数据集共享存储的版本检查器"""
+        if name not in self._watchers:
+            self._watchers[name] = SharedStoreWatcher(self.store(name))
+        return self._watchers[name]
+
+    def profiles_path(self, name):
+        """数据集画像 JSON 的保存路径"""
+        return self._root(name) / 'user_profiles.json'
+
+    def exists(self, name):
+        """数据集是否有已提交的分区"""
+        if not valid_name(name):
+            return False
+        return (self._root(name) / 'traffic' / MANIFEST_FILE).exists() and not self.dataset(name).is_empty()
+
+    def names(self):
+        """全部数据集名称（默认数据集在前）"""
+        named = sorted(p.name for p in self.datasets_root.glob('*')
+                       if valid_name(p.name) and (p / 'traffic' / MANIFEST_FILE).exists()) \
+            if self.datasets_root.exists() else []
+        return [DEFAULT_DATASET] + [n for n in named if n != DEFAULT_DATASET]
+
+    def get(self, name):
+        """已加载的快照（并标记为最近使用），未加载时返回 None"""
+        with self._lock:
+            snapshot = self._snapshots.get(name)
+            if snapshot is not None:
+                self._snapshots.move_to_end(name)
+            return snapshot
+
+    def put(self, name, snapshot, frame_bytes=None):
+        """登记新快照，超出内存预算时换出最久未用的其他数据集"""
+        size = snapshot_memory(snapshot, frame_bytes)
+        with self._lock:
+            self._snapshots[name] = snapshot
+            self._snapshots.move_to_end(name)
+            self._sizes[name] = size
+            victims = []
+            while self.resident_bytes() > self.memory_budget and len(self._snapshots) > 1:
+                victim, evicted = next(iter(self._snapshots.items()))
+                del self._snapshots[victim]
+                del self._sizes[victim]
+                victims.append((victim, evicted))
+            metrics_registry.set_gauge('dataset_registry_resident_bytes', self.resident_bytes())
+        for victim, evicted in victims:
+            self._write_cache(victim, evicted)
+            metrics_registry.inc('dataset_registry_evictions_total', dataset=victim)
+            print(f"数据集 {victim} 已按内存预算换出")
+
+    def _write_cache(self, name, snapshot):
+        """换出前将尚未缓存的快照写入列式缓存"""
+        if snapshot.store_version or snapshot.analyzer is None:
+            return
+        store = self.store(name)
+        try:
+            with store.lock():
+                store.publish(snapshot)
+        except Exception as e:
+            print(f"写入数据集缓存失败（{name}）: {e}")
+
+    def record_reload(self, name):
+        """记录一次从列式缓存重新挂载"""
+        metrics_registry.inc('dataset_registry_reloads_total', dataset=name)
+
+    def resident_bytes(self):
+        """常驻快照的估计内存占用之和"""
+        return sum(self._sizes.values())
+
+    def data_versions(self):
+        """常驻快照的数据版本（用于保留对应的查询缓存）"""
+        with self._lock:
+            return [s.analyzer.data_version for s in self._snapshots.values() if s.analyzer is not None]
+
+    def status(self):
+        """各数据集的状态：是否常驻、估计内存占用、行数"""
+        with self._lock:
+            resident = dict(self._sizes)
+        return [
+            {
+                'name': name,
+                'resident': name in resident,
+                'memory_bytes': resident.get(name, 0),
+                'rows': self.dataset(name).total_rows(),
+            }
+            for name in self.names()
+        ]
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+from utils.analysis import NS_PER_SECOND
+
+
+# 标识一条记录的列：时间戳（秒）、五元组和字节数
+RECORD_KEY_COLUMNS = ['timestamp', 'src_ip', 'dst_ip', 'src_port', 'dst_port', 'protocol', 'bytes']
+
+# 逐列合并哈希时的乘数（FNV-1a 64 位质数）
+_HASH_PRIME = np.uint64(0x100000001B3)
+
+
+def _column_hash(values):
+    """单列的 uint64 哈希；字符串列只对去重后的值求哈希再按编号展开"""
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        numbers = pd.to_numeric(values, errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+        return pd.util.hash_array(numbers)
+    codes, uniques = pd.factorize(values)
+    hashes = pd.util.hash_array(np.array([str(v) for v in uniques], dtype=object))
+    # 末尾对应缺失值（factorize 编号 -1）
+    return np.append(hashes, np.uint64(0))[codes]
+
+
+def record_hashes(df):
+    """每条记录的 64 位哈希（整批向量化计算）
+
+    时间戳按秒取整（与分区文件中的精度一致），列的 dtype 不影响结果，
+    因此从分区文件读回的数据与新上传的数据可直接比较。
+    """
+    seconds = df['timestamp'].to_numpy(dtype='datetime64[ns]').view('int64') // NS_PER_SECOND
+    hashes = pd.util.hash_array(seconds)
+    for column in RECORD_KEY_COLUMNS[1:]:
+        hashes = (hashes ^ _column_hash(df[column])) * _HASH_PRIME
+    return hashes
+
+
+def first_occurrences(hashes):
+    """数组内首次出现的位置（有序），用于去掉同一批数据中的重复记录"""
+    order = np.argsort(hashes, kind='stable')
+    ordered = hashes[order]
+    first = np.ones(len(ordered), dtype=bool)
+    first[1:] = ordered[1:] != ordered[:-1]
+    return np.sort(order[first])
+
+
+class HashSet:
+    """有序 uint64 数组构成的哈希集合
+
+    新加入的哈希作为一层有序数组追加，相邻两层大小接近时合并（类似 LSM 树），
+    层数保持在对数级别；成员检查对每层做一次 searchsorted。
+    """
+
+    def __init__(self, hashes=None):
+        self.levels = []
+        if hashes is not None and len(hashes):
+            self.levels.append(np.asarray(hashes, dtype=np.uint64))
+
+    def __len__(self):
+        return sum(len(level) for level in self.levels)
+
+    def contains(self, hashes):
+        """各哈希是否已在集合中"""
+        found = np.zeros(len(hashes), dtype=bool)
+        for level in self.levels:
+            pos = np.searchsorted(level, hashes)
+            found |= level[np.minimum(pos, len(level) - 1)] == hashes
+        return found
+
+    def add(self, hashes):
+        """加入一批（集合中尚不存在且互不重复的）哈希"""
+        if len(hashes) == 0:
+            return
+        self.levels.append(np.sort(hashes))
+        while len(self.levels) > 1 and len(self.levels[-1]) * 2 >= len(self.levels[-2]):
+            merged = np.concatenate([self.levels.pop(), self.levels.pop()])
+            merged.sort()
+            self.levels.append(merged)
+
+    def to_array(self):
+        """合并为单个有序数组"""
+        if not self.levels:
+            return np.zeros(0, dtype=np.uint64)
+        merged = np.concatenate(self.levels)
+        merged.sort()
+        return merged
@@ -0,0 +1,246 @@
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.metrics import timed_stage
+
+
+# 地址段表的列
+RANGE_COLUMNS = ['start', 'end', 'asn', 'org', 'country']
+
+# 汇总维度
+GROUP_BY = ('org', 'asn', 'country')
+
+UNKNOWN = 'Unknown'
+
+
+def parse_ipv4(values):
+    """点分十进制或整数字符串数组 -> (int64 地址数组, 是否合法)，整批字符串运算，无逐个解析"""
+    values = pd.Series(values)
+    if pd.api.types.is_integer_dtype(values.dtype):
+        addresses = values.to_numpy(dtype=np.int64)
+        return addresses, (addresses >= 0) & (addresses <= 0xFFFFFFFF)
+    text = values.astype(str)
+    # 不含点号的按整数解析
+    digits = text.str.fullmatch(r'\d{1,10}').to_numpy(dtype=bool)
+    integers = pd.to_numeric(text.where(digits, '-1')).to_numpy(dtype=np.int64)
+    addresses = np.where(digits, integers, -1)
+    parts = text.str.split('.', n=3, expand=True)
+    if parts.shape[1] == 4:
+        octets = np.column_stack([pd.to_numeric(parts[i], errors='coerce').to_numpy(dtype=np.float64)
+                                  for i in range(4)])
+        dotted = ~np.isnan(octets).any(axis=1) & (octets >= 0).all(axis=1) & (octets <= 255).all(axis=1)
+        octets = np.where(dotted[:, None], octets, 0).astype(np.int64)
+        addresses = np.where(dotted, (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3],
+                             addresses)
+    valid = (addresses >= 0) & (addresses <= 0xFFFFFFFF)
+    return np.where(valid, addresses, 0), valid
+
+
+class IPRangeTable:
+    """IP 地址段表（ASN / 组织 / 国家）
+
+    表文件为 CSV（start,end,asn,org,country），start / end 可为点分十进制或整数，各地址段互不重叠。
+    地址段按起始地址排序后存为 uint32 数组，组织和国家编码为整数，查找对整批地址做一次 searchsorted。
+    """
+
+    def __init__(self, starts, ends, asns, org_codes, orgs, country_codes, countries):
+        self.starts = starts
+        self.ends = ends
+        self.asns = asns
+        self.org_codes = org_codes
+        self.orgs = list(orgs)
+        self.country_codes = country_codes
+        self.countries = list(countries)
+        self.signature = hashlib.sha1(b''.join(
+            np.ascontiguousarray(a).tobytes() for a in (starts, ends, asns, org_codes, country_codes)
+        ) + json.dumps([self.orgs, self.countries], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def from_frame(cls, table):
+        """从 DataFrame（RANGE_COLUMNS）构建，跳过地址不合法的行"""
+        starts, start_ok = parse_ipv4(table['start'])
+        ends, end_ok = parse_ipv4(table['end'])
+        keep = start_ok & end_ok & (starts <= ends)
+        table = table[keep]
+        order = np.argsort(starts[keep], kind='stable')
+        table = table.iloc[order]
+        org_codes, orgs = pd.factorize(table['org'].fillna(UNKNOWN).astype(str))
+        country_codes, countries = pd.factorize(table['country'].fillna(UNKNOWN).astype(str))
+        asns = pd.to_numeric(table['asn'].astype(str).str.upper().str.removeprefix('AS'), errors='coerce')
+        return cls(starts[keep][order].astype(np.uint32), ends[keep][order].astype(np.uint32),
+                   asns.fillna(0).to_numpy(dtype=np.int64),
+                   org_codes.astype(np.int32), orgs, country_codes.astype(np.int32), countries)
+
+    @classmethod
+    def from_csv(cls, path):
+        """从 CSV 文件加载"""
+        return cls.from_frame(pd.read_csv(path, dtype=str, usecols=RANGE_COLUMNS))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def lookup(self, addresses, valid=None):
+        """int64 地址数组 -> 地址段下标数组（未命中为 -1）"""
+        addresses = np.asarray(addresses, dtype=np.int64)
+        if len(self.starts) == 0:
+            return np.full(len(addresses), -1, dtype=np.int32)
+        idx = np.searchsorted(self.starts, addresses, side='right') - 1
+        hit = (idx >= 0) & (addresses <= self.ends[np.maximum(idx, 0)])
+        if valid is not None:
+            hit &= valid
+        return np.where(hit, idx, -1).astype(np.int32)
+
+
+class EnrichmentIndex:
+    """按目的地址补充的 ASN / 组织 / 国家信息
+
+    每条记录的目的地址只按去重后的地址解析和查找一次，结果保存为与记录对齐的地址段下标列
+    （int32，未命中为 -1），并按地址段汇总字节数和记录数。保存在快照中，挂载时无需重新解析；
+    上传新数据时只为新增记录查找后追加，地址段表变化时整体重建。
+    """
+
+    def __init__(self, signature, record_range, range_bytes, range_records, asns, org_codes, orgs,
+                 country_codes, countries, unmatched_bytes=0, unmatched_records=0):
+        self.signature = signature
+        self.record_range = record_range
+        self.range_bytes = range_bytes
+        self.range_records = range_records
+        self.asns = asns
+        self.org_codes = org_codes
+        self.orgs = list(orgs)
+        self.country_codes = country_codes
+        self.countries = list(countries)
+        self.unmatched_bytes = int(unmatched_bytes)
+        self.unmatched_records = int(unmatched_records)
+
+    @property
+    def rows(self):
+        return len(self.record_range)
+
+    @staticmethod
+    def _ranges(df, table):
+        """记录 -> 地址段下标（按去重后的目的地址查找）"""
+        codes, uniques = pd.factorize(df['dst_ip'])
+        addresses, valid = parse_ipv4(np.asarray(uniques, dtype=object))
+        # 末尾追加 -1，供缺失地址（factorize 编号 -1）取用
+        per_address = np.append(table.lookup(addresses, valid), np.int32(-1))
+        return per_address[codes]
+
+    @classmethod
+    def _summed(cls, record_range, bytes_vals, n_ranges):
+        """按地址段汇总字节数和记录数，返回 (range_bytes, range_records, 未命中字节数, 未命中记录数)"""
+        hit = record_range >= 0
+        range_bytes = np.bincount(record_range[hit], weights=bytes_vals[hit], minlength=n_ranges)
+        range_records = np.bincount(record_range[hit], minlength=n_ranges)
+        return (range_bytes.astype(np.int64), range_records.astype(np.int64),
+                int(bytes_vals[~hit].sum()), int((~hit).sum()))
+
+    @classmethod
+    def from_frame(cls, df, table):
+        """为全部记录查找地址段"""
+        with timed_stage('ip_enrichment', rows=len(df)):
+            record_range = cls._ranges(df, table)
+            summed = cls._summed(record_range, df['bytes'].to_numpy(dtype=np.float64), len(table))
+        return cls(table.signature, record_range, *summed[:2], table.asns, table.org_codes, table.orgs,
+                   table.country_codes, table.countries, *summed[2:])
+
+    def updated(self, new_df, table):
+        """追加新增记录的查找结果，返回新对象（地址段表须未变化）"""
+        added = EnrichmentIndex.from_frame(new_df, table)
+        return EnrichmentIndex(
+            self.signature,
+            np.concatenate([np.asarray(self.record_range), added.record_range]),
+            np.asarray(self.range_bytes) + added.range_bytes,
+            np.asarray(self.range_records) + added.range_records,
+            self.asns, self.org_codes, self.orgs, self.country_codes, self.countries,
+            self.unmatched_bytes + added.unmatched_bytes,
+            self.unmatched_records + added.unmatched_records,
+        )
+
+    def record_columns(self):
+        """与记录对齐的补充列：dst_asn（未命中为 0）、dst_org、dst_country（未命中为 Unknown）"""
+        record_range = np.asarray(self.record_range)
+        hit = record_range >= 0
+        safe = np.where(hit, record_range, 0)
+
+        def categorical(codes, names):
+            categories = pd.Index(list(names) + [UNKNOWN]).unique()
+            unknown = categories.get_loc(UNKNOWN)
+            if len(codes) == 0:
+                return pd.Categorical.from_codes(np.full(len(hit), unknown), categories=categories)
+            return pd.Categorical.from_codes(np.where(hit, np.asarray(codes)[safe], unknown), categories=categories)
+
+        asns = np.asarray(self.asns)
+        return pd.DataFrame({
+            'dst_asn': np.where(hit, asns[safe], 0) if len(asns) else np.zeros(len(hit), dtype=np.int64),
+            'dst_org': categorical(self.org_codes, self.orgs),
+            'dst_country': categorical(self.country_codes, self.countries),
+        })
+
+    def summary(self, by='org', limit=20):
+        """按组织 / ASN / 国家汇总的流量（按字节数降序），附未命中记录的合计"""
+        if by == 'asn':
+            keys, groups = pd.factorize(np.asarray(self.asns))
+        elif by == 'org':
+            keys, groups = np.asarray(self.org_codes), self.orgs
+        else:
+            keys, groups = np.asarray(self.country_codes), self.countries
+        group_bytes = np.bincount(keys, weights=np.asarray(self.range_bytes), minlength=len(groups))
+        group_records = np.bincount(keys, weights=np.asarray(self.range_records), minlength=len(groups))
+        if by == 'org' or by == 'country':
+            names = list(groups)
+        else:
+            names = [int(g) for g in groups]
+        order = np.argsort(-group_bytes, kind='stable')
+        order = order[group_records[order] > 0][:limit]
+        total_bytes = float(np.asarray(self.range_bytes).sum()) + self.unmatched_bytes
+        return [
+            {
+                by: names[i],
+                'bytes': int(group_bytes[i]),
+                'records': int(group_records[i]),
+                'share': round(float(group_bytes[i]) / total_bytes, 4) if total_bytes else 0.0,
+            }
+            for i in order
+        ]
+
+    def coverage(self):
+        """命中地址段的记录数和未命中的记录数、字节数"""
+        return {
+            'matched_records': self.rows - self.unmatched_records,
+            'unmatched_records': self.unmatched_records,
+            'unmatched_bytes': self.unmatched_bytes,
+        }
+
+    def save(self, directory):
+        """保存为 .npy 文件（供共享存储以内存映射方式挂载）"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in ('record_range', 'range_bytes', 'range_records', 'asns', 'org_codes', 'country_codes'):
+            np.save(directory / f'{name}.npy', np.asarray(getattr(self, name)))
+        with open(directory / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump({
+                'signature': self.signature,
+                'orgs': self.orgs,
+                'countries': self.countries,
+                'unmatched_bytes': self.unmatched_bytes,
+                'unmatched_records': self.unmatched_records,
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """从 save() 的输出加载"""
+        directory = Path(directory)
+        with open(directory / 'meta.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+
+        def array(name):
+            return np.load(directory / f'{name}.npy', mmap_mode=mmap_mode)
+
+        return cls(meta['signature'], array('record_range'), array('range_bytes'), array('range_records'),
+                   array('asns'), array('org_codes'), meta['orgs'], array('country_codes'), meta['countries'],
+                   meta['unmatched_bytes'], meta['unmatched_records'])
@@ -0,0 +1,192 @@
+import json
+
+import pandas as pd
+
+from utils.analysis import BASE_COLUMNS, TIMESTAMP_FORMAT
+from utils.partition import _to_timestamp
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet 导出为可选功能
+    pa = None
+    pq = None
+
+
+# 每个输出块的行数
+EXPORT_CHUNK_ROWS = 50_000
+
+# 支持的导出格式及对应的 MIME 类型
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class _ChunkSink:
+    """供 ParquetWriter 写入的内存缓冲，每写完一个行组即可取出已生成的字节"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        """取出并清空已缓冲的字节"""
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_raw_chunks(df, start=None, end=None, user=None, app_category=None,
+                    protocol=None, chunk_rows=EXPORT_CHUNK_ROWS, extra=None):
+    """按块筛选原始记录，不在内存中构建完整的筛选结果
+
+    extra 为与 df 逐行对齐的附加列（如 IP 地址段补充信息），按块拼接在原始列之后。
+    时间范围与分区查询一致：只给出日期的 end 包含当天全部记录。没有匹配的记录时产出一个空块，
+    使导出文件仍带有表头。
+    """
+    if df is None:
+        return
+    start = _to_timestamp(start)
+    end = _to_timestamp(end, end_of_day=True)
+    columns = [c for c in BASE_COLUMNS if c in df.columns]
+    if extra is not None:
+        columns += list(extra.columns)
+
+    def rows(offset, stop):
+        chunk = df.iloc[offset:stop]
+        if extra is not None:
+            chunk = pd.concat([chunk, extra.iloc[offset:stop].set_axis(chunk.index)], axis=1)
+        return chunk
+
+    matched = False
+    for offset in range(0, len(df), chunk_rows):
+        chunk = rows(offset, offset + chunk_rows)
+        mask = pd.Series(True, index=chunk.index)
+        if start is not None:
+            mask &= chunk['timestamp'] >= start
+        if end is not None:
+            mask &= chunk['timestamp'] <= end
+        if user:
+            mask &= chunk['user'] == user
+        if app_category:
+            mask &= chunk['app_category'] == app_category
+        if protocol:
+            mask &= chunk['protocol'] == protocol
+        chunk = chunk.loc[mask, columns]
+        if len(chunk):
+            matched = True
+            yield chunk
+    if not matched:
+        yield rows(0, 0)[columns]
+
+
+def iter_record_chunks(records, chunk_rows=EXPORT_CHUNK_ROWS):
+    """将字典记录序列按块转为 DataFrame"""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= chunk_rows:
+            yield pd.DataFrame.from_records(batch)
+            batch = []
+    if batch:
+        yield pd.DataFrame.from_records(batch)
+
+
+def iter_profile_records(user_profiles, nested=True):
+    """逐个用户产出画像记录；nested=False 时嵌套字段序列化为 JSON 字符串（用于 CSV / Parquet）"""
+    for user_id in user_profiles:
+        profile = user_profiles[user_id]
+        if nested:
+            yield {'user': user_id, **profile}
+        else:
+            yield {'user': user_id, **{
+                key: json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+                for key, value in profile.items()
+            }}
+
+
+def _format_for_text(chunk):
+    """文本格式输出前将时间戳格式化为字符串"""
+    if 'timestamp' in chunk.columns and pd.api.types.is_datetime64_any_dtype(chunk['timestamp']):
+        chunk = chunk.copy()
+        chunk['timestamp'] = chunk['timestamp'].dt.strftime(TIMESTAMP_FORMAT)
+    return chunk
+
+
+def stream_csv(chunks):
+    """逐块产出 CSV 文本"""
+    header = True
+    for chunk in chunks:
+        yield _format_for_text(chunk).to_csv(index=False, header=header)
+        header = False
+
+
+def stream_jsonl(chunks):
+    """逐块产出 JSON Lines 文本"""
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        text = _format_for_text(chunk).to_json(orient='records', lines=True, force_ascii=False)
+        if text and not text.endswith('\n'):
+            text += '\n'
+        yield text
+
+
+def stream_jsonl_records(records):
+    """逐条产出 JSON Lines（保留嵌套结构）"""
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def stream_parquet(chunks):
+    """逐块写 Parquet 行组并产出已生成的字节"""
+    if pq is None:
+        raise RuntimeError('Parquet 导出需要安装 pyarrow')
+    sink = _ChunkSink()
+    writer = None
+    schema = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+        if writer is None:
+            schema = table.schema
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_table(table)
+        data = sink.drain()
+        if data:
+            yield data
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+def stream_chunks(chunks, fmt):
+    """按格式选择输出生成器"""
+    if fmt == 'csv':
+        return stream_csv(chunks)
+    if fmt == 'jsonl':
+        return stream_jsonl(chunks)
+    if fmt == 'parquet':
+        return stream_parquet(chunks)
+    raise ValueError(f'不支持的导出格式: {fmt}')
+
+
+def parquet_available():
+    """是否可以导出 Parquet"""
+    return pq is not None
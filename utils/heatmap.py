@@ -0,0 +1,157 @@
+import base64
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.analysis import PLOTLY_TYPED_ARRAYS
+from utils.metrics import timed_stage
+from utils.similarity import profile_items
+
+
+# 星期 × 小时单元数（按 星期 * 24 + 小时 编号，星期一为 0）
+WEEK_HOURS = 7 * 24
+
+WEEKDAY_NAMES = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+
+# 视图：user × hour 或 user × weekday × hour（展开为 168 列）
+VIEWS = ('hour', 'weekday_hour')
+
+METRICS = ('bytes', 'records')
+
+# 用户排序方式：总流量降序、按行为聚类分组（组内总流量降序）、用户 ID
+ORDERS = ('bytes', 'cluster', 'user')
+
+
+def weekdays(days):
+    """自 1970-01-01（星期四）起的天数 -> 星期（星期一为 0）"""
+    return (np.asarray(days, dtype=np.int64) + 3) % 7
+
+
+def column_labels(view):
+    """视图各列的标签"""
+    if view == 'hour':
+        return [f'{h:02d}:00' for h in range(24)]
+    return [f'{WEEKDAY_NAMES[d]} {h:02d}:00' for d in range(7) for h in range(24)]
+
+
+def encode_matrix(matrix, typed_arrays=PLOTLY_TYPED_ARRAYS):
+    """二维数组编码为 plotly.js 可直接使用的 base64 类型数组（float32）
+
+    typed_arrays 为 False 时（提供的 plotly.js 早于 2.28，不能解码 bdata）返回嵌套列表。
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if not typed_arrays:
+        return matrix.tolist()
+    return {
+        'dtype': 'f4',
+        'bdata': base64.b64encode(matrix.tobytes()).decode('ascii'),
+        'shape': ', '.join(str(n) for n in matrix.shape),
+    }
+
+
+class ActivityHeatmap:
+    """用户 × 星期 × 小时 流量矩阵
+
+    对全部记录做一次 bincount（用户编号 * 168 + 星期 * 24 + 小时）得到稠密矩阵，
+    user × hour 视图由 7 个星期切片相加得到。上传新数据时只为新增记录构建矩阵后按用户对齐相加。
+    """
+
+    def __init__(self, users, week_bytes, week_records, clusters=None, rows=0):
+        self.users = list(users)
+        self.week_bytes = week_bytes
+        self.week_records = week_records
+        self.clusters = clusters if clusters is not None else np.full(len(self.users), -1, dtype=np.int32)
+        self.rows = int(rows)
+
+    @classmethod
+    def from_frame(cls, df):
+        """从 DataFrame 构建（需包含 hour、day 列）"""
+        with timed_stage('activity_heatmap', rows=len(df)):
+            codes, uniques = pd.factorize(df['user'], sort=True)
+            users = [str(u) for u in uniques]
+            cells = weekdays(df['day'].to_numpy()) * 24 + df['hour'].to_numpy().astype(np.int64)
+            keys = codes.astype(np.int64) * WEEK_HOURS + cells
+            size = len(users) * WEEK_HOURS
+            week_bytes = np.bincount(keys, weights=df['bytes'].to_numpy(), minlength=size)
+            week_records = np.bincount(keys, minlength=size)
+        return cls(users,
+                   week_bytes.astype(np.int64).reshape(len(users), WEEK_HOURS),
+                   week_records.astype(np.int64).reshape(len(users), WEEK_HOURS),
+                   rows=len(df))
+
+    def updated(self, new_df):
+        """与新增数据的矩阵按用户对齐相加，返回新对象"""
+        added = ActivityHeatmap.from_frame(new_df)
+        users = sorted(set(self.users) | set(added.users))
+        sorted_users = np.array(users)
+        week_bytes = np.zeros((len(users), WEEK_HOURS), dtype=np.int64)
+        week_records = np.zeros((len(users), WEEK_HOURS), dtype=np.int64)
+        for part in (self, added):
+            if not part.users:
+                continue
+            pos = np.searchsorted(sorted_users, np.array(part.users))
+            week_bytes[pos] += part.week_bytes
+            week_records[pos] += part.week_records
+        return ActivityHeatmap(users, week_bytes, week_records, rows=self.rows + added.rows)
+
+    def with_clusters(self, user_profiles):
+        """附加用户画像中的行为聚类编号（用于按聚类排序），返回新对象（用户 ID 与其他索引一样按字符串匹配）"""
+        by_user = {user_id: profile.get('cluster', -1) for user_id, profile in profile_items(user_profiles)}
+        clusters = np.array([by_user.get(user, -1) for user in self.users], dtype=np.int32)
+        return ActivityHeatmap(self.users, self.week_bytes, self.week_records, clusters, self.rows)
+
+    def __len__(self):
+        return len(self.users)
+
+    def matrix(self, view='hour', metric='bytes'):
+        """完整矩阵：hour 视图为 (用户数, 24)，weekday_hour 视图为 (用户数, 168)"""
+        week = np.asarray(self.week_bytes if metric == 'bytes' else self.week_records)
+        if view == 'hour':
+            return week.reshape(len(self.users), 7, 24).sum(axis=1)
+        return week
+
+    def order(self, order='bytes'):
+        """按排序方式返回用户下标"""
+        if order == 'user':
+            return np.argsort(np.array(self.users), kind='stable')
+        totals = np.asarray(self.week_bytes).sum(axis=1)
+        if order == 'cluster':
+            # 先按聚类编号，聚类内按总流量降序（lexsort 以最后一个键为主键）
+            return np.lexsort((-totals, np.asarray(self.clusters)))
+        return np.argsort(-totals, kind='stable')
+
+    def query(self, view='hour', metric='bytes', order='bytes', normalize=False, offset=0, limit=2000):
+        """排序、分页后的子矩阵，返回 (用户列表, 子矩阵, 聚类编号)
+
+        normalize 为 True 时每行除以该用户的合计，便于比较不同流量规模用户的作息。
+        """
+        rows = self.order(order)[offset:offset + limit]
+        matrix = self.matrix(view, metric)[rows].astype(np.float64)
+        if normalize:
+            totals = matrix.sum(axis=1, keepdims=True)
+            matrix = np.divide(matrix, totals, out=np.zeros_like(matrix), where=totals > 0)
+        return [self.users[i] for i in rows], matrix, np.asarray(self.clusters)[rows]
+
+    def save(self, directory):
+        """保存为 .npy 文件（供共享存储以内存映射方式挂载）"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / 'week_bytes.npy', self.week_bytes)
+        np.save(directory / 'week_records.npy', self.week_records)
+        np.save(directory / 'clusters.npy', self.clusters)
+        with open(directory / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump({'users': self.users, 'rows': self.rows}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """从 save() 的输出加载"""
+        directory = Path(directory)
+        with open(directory / 'meta.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(meta['users'],
+                   np.load(directory / 'week_bytes.npy', mmap_mode=mmap_mode),
+                   np.load(directory / 'week_records.npy', mmap_mode=mmap_mode),
+                   np.load(directory / 'clusters.npy', mmap_mode=mmap_mode),
+                   rows=meta['rows'])
@@ -0,0 +1,108 @@
+import gzip
+import io
+
+import pandas as pd
+
+from utils.analysis import prepare_traffic_frame
+from utils.metrics import timed_stage
+
+try:
+    import zstandard
+except ImportError:  # zstd 为可选依赖，未安装时只支持 gzip 和未压缩 CSV
+    zstandard = None
+
+
+# 每个解析块的行数
+CHUNK_ROWS = 200_000
+
+# 压缩格式魔数
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class _PrefixedStream(io.RawIOBase):
+    """在原始流前拼接已读出的前缀字节（用于嗅探魔数后继续读取）"""
+
+    def __init__(self, prefix, stream):
+        self._prefix = prefix
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefix:
+            n = min(len(buffer), len(self._prefix))
+            buffer[:n] = self._prefix[:n]
+            self._prefix = self._prefix[n:]
+            return n
+        data = self._stream.read(len(buffer))
+        if not data:
+            return 0
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def detect_compression(filename=None, content_encoding=None, head=b''):
+    """根据 Content-Encoding、文件扩展名或魔数判断压缩格式：'gzip' / 'zstd' / None"""
+    encoding = (content_encoding or '').lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return 'gzip'
+    if encoding in ('zstd', 'zstandard'):
+        return 'zstd'
+
+    name = (filename or '').lower()
+    if name.endswith('.gz'):
+        return 'gzip'
+    if name.endswith('.zst') or name.endswith('.zstd'):
+        return 'zstd'
+
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if head.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+
+def open_decompressed(stream, filename=None, content_encoding=None):
+    """将（可能压缩的）二进制流包装为边读边解压的流"""
+    head = stream.read(4)
+    raw = io.BufferedReader(_PrefixedStream(head, stream), buffer_size=1024 * 1024)
+    compression = detect_compression(filename, content_encoding, head)
+
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('上传的是 zstd 压缩文件，但未安装 zstandard 库')
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    return raw
+
+
+def iter_traffic_chunks(stream, filename=None, content_encoding=None, chunk_rows=CHUNK_ROWS, classify=None):
+    """边传输边解压、分块解析 CSV，逐块产出已准备好时间列的 DataFrame
+
+    classify 为可选的应用类别推断函数（如 AppClassifier.apply），在写入分区前为未标注的记录补全类别。
+    """
+    source = open_decompressed(stream, filename, content_encoding)
+    reader = pd.read_csv(source, chunksize=chunk_rows)
+    for chunk in reader:
+        chunk = prepare_traffic_frame(chunk)
+        yield classify(chunk) if classify is not None else chunk
+
+
+def ingest_stream(stream, appender, filename=None, content_encoding=None, chunk_rows=CHUNK_ROWS, classify=None):
+    """将上传流分块写入分区追加器，返回全部新增数据（单次读取，不落地临时文件）
+
+    追加器启用去重时只返回实际写入的记录，重复导入同一文件返回 None。
+    """
+    chunks = []
+    with timed_stage('ingest_stream') as t:
+        for chunk in iter_traffic_chunks(stream, filename, content_encoding, chunk_rows, classify):
+            chunk = appender.append(chunk)
+            if chunk is not None and len(chunk):
+                chunks.append(chunk)
+        t.set_rows(sum(len(c) for c in chunks))
+    if not chunks:
+        return None
+    return pd.concat(chunks, ignore_index=True)
@@ -0,0 +1,85 @@
+import functools
+import inspect
+import threading
+from collections import OrderedDict
+
+from utils.metrics import registry
+
+
+# 缓存条目上限
+DEFAULT_MAXSIZE = 256
+
+registry.describe('analyzer_cache_hits_total', 'counter', '分析器查询缓存命中次数')
+registry.describe('analyzer_cache_misses_total', 'counter', '分析器查询缓存未命中次数')
+registry.describe('analyzer_cache_entries', 'gauge', '分析器查询缓存当前条目数')
+
+
+class VersionedLRUCache:
+    """以 (数据版本, 方法, 参数) 为键的线程安全 LRU 缓存
+
+    数据只在发布新快照时变化，因此键中带上数据版本即可保证不会读到旧结果；
+    发布后调用 retain() 丢弃已不常驻的版本的条目。
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute, method=''):
+        """命中则返回缓存结果，否则计算并写入（计算在锁外进行）"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                registry.inc('analyzer_cache_hits_total', method=method)
+                return self._entries[key]
+        registry.inc('analyzer_cache_misses_total', method=method)
+
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            registry.set_gauge('analyzer_cache_entries', len(self._entries))
+        return value
+
+    def retain(self, *versions):
+        """只保留指定数据版本的条目"""
+        keep = set(versions)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] not in keep]:
+                del self._entries[key]
+            registry.set_gauge('analyzer_cache_entries', len(self._entries))
+
+    def clear(self):
+        """清空缓存"""
+        self.retain()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# 全局查询缓存
+query_cache = VersionedLRUCache()
+
+
+def memoized(method):
+    """分析器查询方法的缓存装饰器
+
+    以实例的 data_version 加参数为键（参数按签名补全默认值，f() 与 f(top_n=10) 共用同一条目）；
+    data_version 为 None 的实例（如临时的时间范围分析器）不缓存。
+    返回的结果在多个请求间共享，调用方不应修改。
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        version = getattr(self, 'data_version', None)
+        if version is None:
+            return method(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        key = (version, method.__name__, tuple(bound.arguments.items())[1:])
+        return query_cache.get_or_compute(key, lambda: method(self, *args, **kwargs), method.__name__)
+    return wrapper
@@ -0,0 +1,218 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+# frame_memory 估计 object 列字符串占用时抽样的值个数
+FRAME_MEMORY_SAMPLE_ROWS = 1000
+
+# 默认直方图分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labels):
+    """将标签元组格式化为 Prometheus 文本格式"""
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    """格式化指标数值"""
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """线程安全的指标注册表，支持计数器、仪表和直方图"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def describe(self, name, kind, help_text):
+        """登记指标类型和说明"""
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        """计数器累加"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """设置仪表当前值"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        """向直方图记录一次观测"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+                self._histograms[key] = hist
+            for i, bound in enumerate(hist['buckets']):
+                if value <= bound:
+                    hist['counts'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def get_counter(self, name, **labels):
+        """读取计数器当前值"""
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def render(self):
+        """导出 Prometheus 文本格式"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {k: {**v, 'counts': list(v['counts'])} for k, v in self._histograms.items()}
+
+        lines = []
+        emitted = set()
+
+        def header(name, default_kind):
+            if name in emitted:
+                return
+            emitted.add(name)
+            kind, help_text = self._meta.get(name, (default_kind, name))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, 'counter')
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, 'gauge')
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+        for (name, labels), hist in sorted(histograms.items()):
+            header(name, 'histogram')
+            for bound, count in zip(hist['buckets'], hist['counts']):
+                bucket_labels = labels + (('le', _format_value(float(bound))),)
+                lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {count}')
+            inf_labels = labels + (('le', '+Inf'),)
+            lines.append(f'{name}_bucket{_format_labels(inf_labels)} {hist["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(hist["sum"])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {hist["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# 全局注册表
+registry = MetricsRegistry()
+
+registry.describe('traffic_stage_duration_seconds', 'histogram', '数据处理各阶段耗时（秒）')
+registry.describe('traffic_stage_last_duration_seconds', 'gauge', '数据处理各阶段最近一次耗时（秒）')
+registry.describe('traffic_stage_rows', 'gauge', '数据处理各阶段最近一次处理的行数')
+registry.describe('traffic_stage_failures_total', 'counter', '数据处理各阶段失败次数')
+registry.describe('http_request_duration_seconds', 'histogram', 'HTTP 请求延迟（秒）')
+registry.describe('http_requests_total', 'counter', 'HTTP 请求总数')
+registry.describe('dataset_rows', 'gauge', '当前数据集记录数')
+registry.describe('dataset_memory_bytes', 'gauge', '当前数据集的估计内存占用（字节，字符串对象按抽样估计）')
+registry.describe('dataset_users', 'gauge', '当前数据集用户数')
+
+
+class StageTimer:
+    """单个阶段的计时上下文，可在阶段内登记处理行数"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.rows = None
+        self.duration = None
+
+    def set_rows(self, rows):
+        """登记本阶段处理的行数"""
+        self.rows = int(rows)
+
+
+@contextmanager
+def timed_stage(stage, rows=None):
+    """记录一个处理阶段的耗时、行数和失败次数
+
+    用法：
+        with timed_stage('csv_parse') as t:
+            df = pd.read_csv(path)
+            t.set_rows(len(df))
+    """
+    timer = StageTimer(stage)
+    if rows is not None:
+        timer.set_rows(rows)
+    start = time.perf_counter()
+    try:
+        yield timer
+    except Exception as e:
+        registry.inc('traffic_stage_failures_total', stage=stage)
+        # 记录最内层失败阶段，便于调用方输出
+        if not hasattr(e, 'failed_stage'):
+            try:
+                e.failed_stage = stage
+            except AttributeError:
+                pass
+        raise
+    finally:
+        timer.duration = time.perf_counter() - start
+        registry.observe('traffic_stage_duration_seconds', timer.duration, stage=stage)
+        registry.set_gauge('traffic_stage_last_duration_seconds', timer.duration, stage=stage)
+        if timer.rows is not None:
+            registry.set_gauge('traffic_stage_rows', timer.rows, stage=stage)
+
+
+def record_request(endpoint, method, status, duration):
+    """记录一次 HTTP 请求"""
+    registry.observe('http_request_duration_seconds', duration, endpoint=endpoint, method=method)
+    registry.inc('http_requests_total', endpoint=endpoint, method=method, status=status)
+
+
+def frame_memory(df, sample_rows=FRAME_MEMORY_SAMPLE_ROWS):
+    """DataFrame 的估计内存占用：各列浅层占用 + 字符串对象的估计占用
+
+    object 列（pandas 2 的字符串列）按等间隔抽取的至多 sample_rows 个值估计平均对象大小再按行数放大，
+    分类列加上类别值的实际占用；不逐个扫描全部字符串对象，开销与行数无关。
+    """
+    size = int(df.memory_usage(deep=False).sum())
+    for column in df.columns:
+        values = df[column]
+        if str(values.dtype) == 'category':
+            categories = values.cat.categories
+            size += int(categories.memory_usage(deep=True) - categories.memory_usage(deep=False))
+        elif values.dtype == object and len(values):
+            sample = values.iloc[::max(1, len(values) // sample_rows)]
+            payload = sample.memory_usage(deep=True, index=False) - sample.memory_usage(deep=False, index=False)
+            size += int(payload * len(values) / len(sample))
+    return size
+
+
+def record_dataset(df, users=None, dataset='default', memory_bytes=None):
+    """更新数据集规模仪表（按数据集名称打标签）；memory_bytes 为已估计的内存占用（缺省时按 frame_memory 估计）"""
+    if df is None:
+        registry.set_gauge('dataset_rows', 0, dataset=dataset)
+        registry.set_gauge('dataset_memory_bytes', 0, dataset=dataset)
+        registry.set_gauge('dataset_users', 0, dataset=dataset)
+        return
+    registry.set_gauge('dataset_rows', len(df), dataset=dataset)
+    if memory_bytes is None:
+        memory_bytes = frame_memory(df)
+    registry.set_gauge('dataset_memory_bytes', int(memory_bytes), dataset=dataset)
+    if users is None and 'user' in df.columns:
+        users = df['user'].nunique()
+    registry.set_gauge('dataset_users', int(users or 0), dataset=dataset)
+
+
+def render_metrics():
+    """导出全局注册表的 Prometheus 文本"""
+    return registry.render()
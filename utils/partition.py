@@ -0,0 +1,295 @@
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.analysis import BASE_COLUMNS, NS_PER_SECOND, day_to_str, prepare_traffic_frame
+from utils.dedup import HashSet, record_hashes, first_occurrences
+from utils.metrics import timed_stage, registry as metrics_registry
+
+
+# 分区清单文件名
+MANIFEST_FILE = '_manifest.json'
+
+# 清单中时间戳的写出格式
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+metrics_registry.describe('ingest_duplicate_records_total', 'counter', '导入时因与已有记录重复而丢弃的记录数')
+
+
+def _to_timestamp(value, end_of_day=False):
+    """将字符串 / datetime 转为 pandas Timestamp，None 保持不变
+
+    end_of_day 为 True 且只给出日期（YYYY-MM-DD）时，取当天最后一刻，
+    使 end='2025-12-01' 包含当天全部记录。
+    """
+    if value is None or value == '':
+        return None
+    ts = pd.Timestamp(value)
+    if end_of_day and isinstance(value, str) and len(value.strip()) == 10:
+        ts = ts + pd.Timedelta(days=1) - pd.Timedelta(1, unit='ns')
+    return ts
+
+
+class PartitionedDataset:
+    """按日期分区的流量数据集
+
+    目录布局：
+        data/traffic/_manifest.json
+        data/traffic/date=2025-12-01/part-<id>.csv
+        data/traffic/date=2025-12-02/part-<id>.csv
+
+    分区文件中的 timestamp 以整数 epoch 秒写出，读回时走整数解析路径，无需解析字符串。
+
+    清单记录每个分区的文件列表、最小/最大时间戳和行数。新增数据只写入涉及日期的
+    分区并更新这些分区的清单条目；范围查询根据清单只读取相交的分区。
+
+    dedup 为 True 时每个分区另存一份记录哈希的有序数组（_hashes-<id>.npy，由清单引用），
+    追加时丢弃与分区内已有记录或同批记录重复的行，重复导入同一文件不会写入任何数据。
+    """
+
+    def __init__(self, root, dedup=True):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.root / MANIFEST_FILE
+        self.dedup = dedup
+
+    def load_manifest(self):
+        """读取分区清单"""
+        if not self.manifest_path.exists():
+            return {'partitions': {}}
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest):
+        """原子地写出分区清单"""
+        tmp_path = self.manifest_path.with_name(MANIFEST_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def is_empty(self):
+        """数据集中是否没有任何分区"""
+        return not self.load_manifest()['partitions']
+
+    def total_rows(self):
+        """数据集总行数（来自清单，无需读取数据）"""
+        return sum(p['rows'] for p in self.load_manifest()['partitions'].values())
+
+    def appender(self):
+        """创建一个分区追加器，用于分块写入后一次性提交清单"""
+        return PartitionAppender(self)
+
+    def add_frame(self, df):
+        """将已解析时间戳的 DataFrame 按日期追加到对应分区，返回涉及的日期列表"""
+        if df is None or len(df) == 0:
+            return []
+        appender = self.appender()
+        try:
+            appender.append(df)
+        except Exception:
+            appender.abort()
+            raise
+        return appender.commit()
+
+    def add_csv(self, csv_path):
+        """读取 CSV 并追加到分区，返回涉及的日期列表"""
+        with timed_stage('csv_parse') as t:
+            df = pd.read_csv(csv_path)
+            t.set_rows(len(df))
+        return self.add_frame(prepare_traffic_frame(df))
+
+    def select_files(self, start=None, end=None):
+        """根据清单选出与 [start, end] 时间范围相交的分区文件"""
+        start = _to_timestamp(start)
+        end = _to_timestamp(end, end_of_day=True)
+        files = []
+        for day, entry in sorted(self.load_manifest()['partitions'].items()):
+            for info in entry['files']:
+                if start is not None and pd.Timestamp(info['max_ts']) < start:
+                    continue
+                if end is not None and pd.Timestamp(info['min_ts']) > end:
+                    continue
+                files.append(self.root / f'date={day}' / info['name'])
+        return files
+
+    def _read_files(self, files):
+        """读取并合并分区文件"""
+        with timed_stage('partition_read') as t:
+            df = pd.concat([pd.read_csv(path) for path in files], ignore_index=True)
+            t.set_rows(len(df))
+        return prepare_traffic_frame(df)
+
+    def load_hashes(self, day, manifest=None):
+        """分区已有记录的哈希（有序去重）；旧分区没有哈希文件时读取分区数据计算"""
+        manifest = manifest if manifest is not None else self.load_manifest()
+        entry = manifest['partitions'].get(day)
+        if entry is None:
+            return np.zeros(0, dtype=np.uint64)
+        path = self.root / f'date={day}' / entry.get('hashes', '')
+        if entry.get('hashes') and path.exists():
+            return np.load(path)
+        df = self._read_files([self.root / f'date={day}' / info['name'] for info in entry['files']])
+        with timed_stage('dedup_bootstrap', rows=len(df)):
+            hashes = np.sort(record_hashes(df))
+            return hashes[np.concatenate([[True], hashes[1:] != hashes[:-1]])] if len(hashes) else hashes
+
+    def read(self, start=None, end=None):
+        """读取 [start, end] 范围内的数据，只解析相交的分区文件"""
+        files = self.select_files(start, end)
+        if not files:
+            return None
+
+        df = self._read_files(files)
+
+        start = _to_timestamp(start)
+        end = _to_timestamp(end, end_of_day=True)
+        if start is not None or end is not None:
+            mask = pd.Series(True, index=df.index)
+            if start is not None:
+                mask &= df['timestamp'] >= start
+            if end is not None:
+                mask &= df['timestamp'] <= end
+            df = df[mask].reset_index(drop=True)
+        return df
+
+
+class PartitionAppender:
+    """分块追加写入分区
+
+    每个涉及的日期只打开一个新的分区文件，各数据块依次追加写入；
+    commit() 时才将文件改名生效并更新清单，abort() 则丢弃所有已写内容。
+    数据集启用去重时，append() 先丢弃重复记录，duplicates 为累计丢弃的行数。
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.rows = 0
+        self.duplicates = 0
+        self._files = {}
+        self._hash_sets = {}
+        self._manifest = None
+
+    def _hash_set(self, day):
+        """日期分区的哈希集合（首次使用时从分区加载，之后包含本次已追加的记录）"""
+        if day not in self._hash_sets:
+            if self._manifest is None:
+                self._manifest = self.dataset.load_manifest()
+            self._hash_sets[day] = HashSet(self.dataset.load_hashes(day, self._manifest))
+        return self._hash_sets[day]
+
+    def _drop_duplicates(self, df):
+        """丢弃与同批记录或分区已有记录重复的行"""
+        with timed_stage('dedup', rows=len(df)):
+            hashes = record_hashes(df)
+            rows = first_occurrences(hashes)
+            hashes = hashes[rows]
+            days = df['day'].to_numpy()[rows]
+            keep = np.ones(len(rows), dtype=bool)
+            for day_num in np.unique(days):
+                in_day = np.flatnonzero(days == day_num)
+                seen = self._hash_set(str(day_to_str([day_num])[0]))
+                duplicate = seen.contains(hashes[in_day])
+                keep[in_day[duplicate]] = False
+                seen.add(hashes[in_day[~duplicate]])
+            rows = rows[keep]
+        dropped = len(df) - len(rows)
+        if dropped == 0:
+            return df
+        self.duplicates += dropped
+        metrics_registry.inc('ingest_duplicate_records_total', dropped)
+        return df.iloc[rows].reset_index(drop=True)
+
+    def append(self, df):
+        """追加一个已解析时间戳的数据块，返回实际写入的行（去重后）"""
+        if df is None or len(df) == 0:
+            return df
+        if self.dataset.dedup:
+            df = self._drop_duplicates(df)
+            if len(df) == 0:
+                return df
+        with timed_stage('partition_write', rows=len(df)):
+            for day_num, part in df.groupby('day', sort=True):
+                day = str(day_to_str([day_num])[0])
+                info = self._files.get(day)
+                if info is None:
+                    part_dir = self.dataset.root / f'date={day}'
+                    part_dir.mkdir(exist_ok=True)
+                    name = f'part-{int(time.time())}-{uuid.uuid4().hex[:8]}.csv'
+                    info = {'name': name, 'tmp_path': part_dir / (name + '.tmp'), 'rows': 0,
+                            'min_ts': None, 'max_ts': None}
+                    self._files[day] = info
+
+                out = part[[c for c in BASE_COLUMNS if c in part.columns]].copy()
+                out['timestamp'] = out['timestamp'].to_numpy(dtype='datetime64[ns]').view('int64') // NS_PER_SECOND
+                out.to_csv(info['tmp_path'], mode='a', index=False, header=info['rows'] == 0)
+
+                min_ts = part['timestamp'].min().strftime(TIMESTAMP_FORMAT)
+                max_ts = part['timestamp'].max().strftime(TIMESTAMP_FORMAT)
+                info['rows'] += len(part)
+                info['min_ts'] = min_ts if info['min_ts'] is None else min(info['min_ts'], min_ts)
+                info['max_ts'] = max_ts if info['max_ts'] is None else max(info['max_ts'], max_ts)
+        self.rows += len(df)
+        return df
+
+    def _write_hashes(self, day, entry):
+        """写出分区新的哈希文件并在清单条目中引用，返回被替换的旧文件名"""
+        previous = entry.pop('hashes', None)
+        if not self.dataset.dedup:
+            # 未去重时旧哈希文件已不完整，之后启用去重时重新计算
+            return previous
+        name = f'_hashes-{uuid.uuid4().hex[:8]}.npy'
+        path = self.dataset.root / f'date={day}' / name
+        tmp_path = path.with_name(name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self._hash_sets[day].to_array())
+        os.replace(tmp_path, path)
+        entry['hashes'] = name
+        return previous
+
+    def commit(self):
+        """使写入的分区文件生效并更新清单，返回涉及的日期列表"""
+        manifest = self.dataset.load_manifest()
+        partitions = manifest['partitions']
+        replaced_hashes = []
+        for day, info in sorted(self._files.items()):
+            part_dir = info['tmp_path'].parent
+            os.replace(info['tmp_path'], part_dir / info['name'])
+
+            entry = partitions.get(day)
+            if entry is None:
+                entry = {'files': [], 'rows': 0, 'min_ts': info['min_ts'], 'max_ts': info['max_ts']}
+                partitions[day] = entry
+            entry['files'].append({
+                'name': info['name'],
+                'rows': info['rows'],
+                'min_ts': info['min_ts'],
+                'max_ts': info['max_ts'],
+            })
+            entry['rows'] += info['rows']
+            entry['min_ts'] = min(entry['min_ts'], info['min_ts'])
+            entry['max_ts'] = max(entry['max_ts'], info['max_ts'])
+            replaced_hashes.append((day, self._write_hashes(day, entry)))
+
+        if self._files:
+            self.dataset._save_manifest(manifest)
+        # 清单切换后旧哈希文件不再被引用
+        for day, name in replaced_hashes:
+            if name:
+                (self.dataset.root / f'date={day}' / name).unlink(missing_ok=True)
+        touched = sorted(self._files)
+        self._files = {}
+        self._hash_sets = {}
+        return touched
+
+    def abort(self):
+        """丢弃尚未提交的分区文件"""
+        for info in self._files.values():
+            if info['tmp_path'].exists():
+                info['tmp_path'].unlink()
+        self._files = {}
+        self._hash_sets = {}
@@ -0,0 +1,201 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.analysis import day_to_str
+from utils.clustering import category_index, day_profile_sums
+from utils.metrics import timed_stage
+from utils.sessions import build_sessions, user_session_sums
+
+
+# 状态文件格式版本
+STATE_VERSION = 1
+
+# 画像中单独统计访问次数的特殊端口
+SUSPICIOUS_PORTS = [22, 3389, 3306, 8000, 8080, 5000]
+
+DNS_PORT = 53
+
+# 会话统计量：合并时 duration_max 取最大值，其余相加
+SESSION_FIELDS = ('sessions', 'duration_sum', 'duration_max', 'bytes_sum', 'records_sum')
+
+
+def _pair_sums(df, column):
+    """按 (用户, column) 汇总字节数，返回 {用户: {键: 字节数}}"""
+    result = {}
+    sums = df.groupby(['user', column], observed=True, sort=True)['bytes'].sum()
+    for (user, key), value in sums.items():
+        result.setdefault(user, {})[str(key)] = int(value)
+    return result
+
+
+def _merge_counts(a, b):
+    """两个 {键: 数值} 相加"""
+    merged = dict(a)
+    for key, value in b.items():
+        merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _merge_user(a, b):
+    """合并同一用户的两份原始状态（不修改输入）"""
+    return {
+        'total_bytes': a['total_bytes'] + b['total_bytes'],
+        'category_bytes': _merge_counts(a['category_bytes'], b['category_bytes']),
+        'hour_bytes': [x + y for x, y in zip(a['hour_bytes'], b['hour_bytes'])],
+        'hour_count': [x + y for x, y in zip(a['hour_count'], b['hour_count'])],
+        'protocol_bytes': _merge_counts(a['protocol_bytes'], b['protocol_bytes']),
+        'port_counts': [x + y for x, y in zip(a['port_counts'], b['port_counts'])],
+        'dns_queries': a['dns_queries'] + b['dns_queries'],
+        'dns_bytes': a['dns_bytes'] + b['dns_bytes'],
+        'daily_bytes': _merge_counts(a['daily_bytes'], b['daily_bytes']),
+        'day_profile_sum': [x + y for x, y in zip(a['day_profile_sum'], b['day_profile_sum'])],
+        'active_days': a['active_days'] + b['active_days'],
+        'sessions': {
+            field: (max if field == 'duration_max' else sum)((a['sessions'][field], b['sessions'][field]))
+            for field in SESSION_FIELDS
+        },
+    }
+
+
+class ProfileState:
+    """可合并的用户画像原始状态
+
+    每个用户保存按类别 / 小时 / 协议 / 端口 / 日的字节和、DNS 计数、各活跃日小时分布单位向量之和
+    以及会话统计量，这些量都可以直接相加合并。百分比、标签、规律度等画像字段均由状态派生，
+    新一天的数据只需构建自己的状态再与历史状态合并，代价与新数据量成正比。
+
+    合并假设新数据覆盖的是状态中尚未出现的日期（如每晚追加前一天）：同一天分两次合并时，
+    规律度和跨批次的会话会按两天 / 两个会话计算。
+    """
+
+    def __init__(self, users=None, rows=0, last_day=None):
+        self.users = users or {}
+        self.rows = int(rows)
+        self.last_day = last_day
+
+    @classmethod
+    def from_frame(cls, df):
+        """从 DataFrame（含 hour / day 列）构建全部用户的状态"""
+        if df is None or len(df) == 0:
+            return cls()
+        with timed_stage('profile_state', rows=len(df)):
+            user_codes, users = pd.factorize(df['user'], sort=True)
+            n = len(users)
+            weights = df['bytes'].to_numpy(dtype=np.float64)
+            hours = df['hour'].to_numpy(dtype=np.int64)
+            days = df['day'].to_numpy(dtype=np.int64)
+            ports = df['dst_port'].to_numpy()
+
+            total = np.bincount(user_codes, weights=weights, minlength=n)
+            hour_bytes = np.bincount(user_codes * 24 + hours, weights=weights, minlength=n * 24).reshape(n, 24)
+            hour_count = np.bincount(user_codes * 24 + hours, minlength=n * 24).reshape(n, 24)
+            port_counts = np.stack([np.bincount(user_codes[ports == port], minlength=n)
+                                    for port in SUSPICIOUS_PORTS], axis=1)
+            dns = ports == DNS_PORT
+            dns_queries = np.bincount(user_codes[dns], minlength=n)
+            dns_bytes = np.bincount(user_codes[dns], weights=weights[dns], minlength=n)
+            unit_sum, active_days = day_profile_sums(user_codes, n, days, hours, weights)
+
+            categories = _pair_sums(df, 'app_category')
+            protocols = _pair_sums(df, 'protocol')
+            daily = {}
+            day_sums = pd.Series(weights).groupby([user_codes, days], sort=True).sum()
+            day_labels = dict(zip(np.unique(days), day_to_str(np.unique(days))))
+            for (code, day), value in day_sums.items():
+                daily.setdefault(code, {})[str(day_labels[day])] = int(value)
+            sessions = user_session_sums(build_sessions(df)).reindex(users, fill_value=0)
+            session_values = {field: sessions[field].to_numpy() for field in SESSION_FIELDS}
+
+            state = {}
+            for i, user in enumerate(users):
+                state[user] = {
+                    'total_bytes': int(total[i]),
+                    'category_bytes': categories.get(user, {}),
+                    'hour_bytes': [int(v) for v in hour_bytes[i]],
+                    'hour_count': hour_count[i].tolist(),
+                    'protocol_bytes': protocols.get(user, {}),
+                    'port_counts': port_counts[i].tolist(),
+                    'dns_queries': int(dns_queries[i]),
+                    'dns_bytes': int(dns_bytes[i]),
+                    'daily_bytes': daily.get(i, {}),
+                    'day_profile_sum': unit_sum[i].tolist(),
+                    'active_days': int(active_days[i]),
+                    'sessions': {
+                        field: (float if field.startswith('duration') else int)(session_values[field][i])
+                        for field in SESSION_FIELDS
+                    },
+                }
+        return cls(state, rows=len(df), last_day=str(day_to_str(np.array([days.max()]))[0]))
+
+    def appendable(self, new_df):
+        """new_df 是否只包含状态中尚未出现的日期（此时合并结果与全量重算一致，仅跨零点的会话会被拆开）"""
+        if self.last_day is None:
+            return True
+        first_day = str(day_to_str(np.array([new_df['day'].min()]))[0])
+        return first_day > self.last_day
+
+    def merged(self, other):
+        """合并另一份状态，返回新对象（两者均保持不变，未变化的用户共享同一字典）"""
+        with timed_stage('profile_merge', rows=len(other.users)):
+            users = dict(self.users)
+            for user, state in other.users.items():
+                users[user] = _merge_user(users[user], state) if user in users else state
+        last_days = [d for d in (self.last_day, other.last_day) if d is not None]
+        return ProfileState(users, rows=self.rows + other.rows, last_day=max(last_days) if last_days else None)
+
+    def matrices(self, categories):
+        """按用户排序返回聚类所需的矩阵：(users, hour_bytes, category_bytes, unit_sum, active_days)
+
+        category_bytes 按 categories 首个匹配归入标准化类别，最后一列为 others。
+        """
+        users = sorted(self.users)
+        n_cats = len(categories) + 1
+        hour_bytes = np.zeros((len(users), 24))
+        category_bytes = np.zeros((len(users), n_cats))
+        unit_sum = np.zeros((len(users), 24))
+        active_days = np.zeros(len(users), dtype=np.int64)
+        mapping = {}
+        for i, user in enumerate(users):
+            state = self.users[user]
+            hour_bytes[i] = state['hour_bytes']
+            unit_sum[i] = state['day_profile_sum']
+            active_days[i] = state['active_days']
+            for name, value in state['category_bytes'].items():
+                if name not in mapping:
+                    mapping[name] = category_index(name, categories)
+                category_bytes[i, mapping[name]] += value
+        return users, hour_bytes, category_bytes, unit_sum, active_days
+
+    def save(self, path):
+        """保存为 JSON 文件（先写临时文件再原子替换）"""
+        try:
+            path = Path(path)
+            tmp_path = path.with_name(path.name + '.tmp')
+            with timed_stage('profile_state_save', rows=len(self.users)):
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'version': STATE_VERSION, 'rows': self.rows, 'last_day': self.last_day,
+                               'users': self.users}, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            print(f"画像状态已保存至: {path}")
+            return True
+        except Exception as e:
+            print(f"保存画像状态失败: {e}")
+            return False
+
+    @classmethod
+    def load(cls, path):
+        """从 save() 的输出加载；文件不存在或格式不符时返回 None"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != STATE_VERSION:
+                print(f"画像状态版本不符: {data.get('version')}")
+                return None
+            return cls(data['users'], rows=data['rows'], last_day=data['last_day'])
+        except Exception as e:
+            print(f"加载画像状态失败: {e}")
+            return None
@@ -0,0 +1,174 @@
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.analysis import NS_PER_SECOND
+from utils.metrics import timed_stage
+from utils.partition import _to_timestamp
+
+
+# 汇总层级：(名称, 时间桶宽度秒数)，由细到粗，宽度均整除一天
+LEVELS = [('minute', 60), ('5min', 300), ('hour', 3600), ('day', 86400)]
+LEVEL_WIDTHS = dict(LEVELS)
+
+# 未指定分辨率时单次返回的最大点数
+DEFAULT_MAX_POINTS = 500
+
+
+def _epoch_seconds(df):
+    """timestamp 列转为 epoch 秒"""
+    return df['timestamp'].to_numpy(dtype='datetime64[ns]').view('int64') // NS_PER_SECOND
+
+
+def _distinct(values):
+    """排序去重（比 np.unique 的哈希路径更快且结果有序）"""
+    values = np.sort(values)
+    if len(values) == 0:
+        return values
+    return values[np.concatenate([[True], values[1:] != values[:-1]])]
+
+
+def _build_levels(seconds, bytes_vals, users):
+    """计算各层级的稠密数组：{层级: (起点桶号, bytes, records, active_users)}
+
+    分钟层直接按记录汇总；更粗的层级由分钟层数组和去重后的 (分钟, 用户) 对再汇总，
+    不再逐条扫描原始记录。
+    """
+    codes, uniques = pd.factorize(users, use_na_sentinel=False)
+    n_users = max(len(uniques), 1)
+    minutes = seconds // 60
+    origin = int(minutes.min())
+    idx = minutes - origin
+    size = int(idx.max()) + 1
+    minute_bytes = np.bincount(idx, weights=bytes_vals, minlength=size)
+    minute_records = np.bincount(idx, minlength=size)
+    pairs = _distinct(idx * n_users + codes)
+    pair_minutes = pairs // n_users + origin
+    pair_users = pairs % n_users
+
+    levels = {}
+    minute_abs = np.arange(size, dtype=np.int64) + origin
+    for name, width in LEVELS:
+        step = width // 60
+        level_origin = origin // step
+        level_idx = minute_abs // step - level_origin
+        level_size = int(level_idx[-1]) + 1
+        pair_idx = _distinct((pair_minutes // step - level_origin) * n_users + pair_users) // n_users
+        levels[name] = (
+            level_origin,
+            np.round(np.bincount(level_idx, weights=minute_bytes, minlength=level_size)).astype(np.int64),
+            np.bincount(level_idx, weights=minute_records, minlength=level_size).astype(np.int64),
+            np.bincount(pair_idx, minlength=level_size).astype(np.int64),
+        )
+    return levels
+
+
+class TrendPyramid:
+    """多分辨率流量时间序列（分钟 / 5 分钟 / 小时 / 天）
+
+    每个层级保存从起点桶开始的稠密数组：字节数、记录数、活跃用户数。趋势查询按时间范围和
+    所需分辨率自动选择层级，缩放图表时无需重新扫描原始记录。
+    """
+
+    def __init__(self, levels, rows=0):
+        self.levels = levels
+        self.rows = int(rows)
+
+    @classmethod
+    def from_frame(cls, df):
+        """从 DataFrame 构建全部层级"""
+        with timed_stage('trend_pyramid', rows=len(df)):
+            levels = _build_levels(_epoch_seconds(df), df['bytes'].to_numpy(dtype=np.float64),
+                                   df['user'].to_numpy())
+        return cls(levels, rows=len(df))
+
+    def updated(self, df, new_df):
+        """合并新增数据，返回新的金字塔（自身保持不变）
+
+        活跃用户数不能简单相加，因此从新数据最早所在的那一天起，用全量数据中这一天及之后的
+        记录重算各层级的尾部，之前的桶直接沿用。
+        """
+        seconds = _epoch_seconds(df)
+        cutoff = int(_epoch_seconds(new_df).min()) // 86400 * 86400
+        with timed_stage('trend_pyramid', rows=len(new_df)):
+            mask = seconds >= cutoff
+            tail = _build_levels(seconds[mask], df['bytes'].to_numpy(dtype=np.float64)[mask],
+                                 df['user'].to_numpy()[mask])
+            levels = {}
+            for name, width in LEVELS:
+                old_origin, *old_arrays = self.levels[name]
+                tail_origin, *tail_arrays = tail[name]
+                keep = max(0, min(tail_origin - old_origin, len(old_arrays[0])))
+                if keep == 0:
+                    levels[name] = tail[name]
+                    continue
+                gap = tail_origin - old_origin - keep
+                levels[name] = (old_origin, *[
+                    np.concatenate([np.asarray(old[:keep]), np.zeros(gap, dtype=np.int64), new])
+                    for old, new in zip(old_arrays, tail_arrays)
+                ])
+        return TrendPyramid(levels, rows=self.rows + len(new_df))
+
+    def extent(self):
+        """数据覆盖的时间范围 (起始秒, 结束秒)"""
+        origin, values = self.levels['minute'][0], self.levels['minute'][1]
+        return origin * 60, (origin + len(values)) * 60
+
+    def pick_level(self, start, end, resolution=None, max_points=DEFAULT_MAX_POINTS):
+        """选择层级：给定分辨率（秒）时取宽度不超过它的最粗层级，否则取点数不超过 max_points 的最细层级"""
+        if resolution is not None:
+            fitting = [name for name, width in LEVELS if width <= resolution]
+            return fitting[-1] if fitting else LEVELS[0][0]
+        for name, width in LEVELS:
+            if math.ceil((end - start) / width) <= max_points:
+                return name
+        return LEVELS[-1][0]
+
+    def trend(self, start=None, end=None, resolution=None, max_points=DEFAULT_MAX_POINTS, level=None):
+        """返回 (层级, 数据点列表)；start / end 为时间字符串或 None（全部范围），只给出日期的 end 包含当天"""
+        data_start, data_end = self.extent()
+        start, end = _to_timestamp(start), _to_timestamp(end, end_of_day=True)
+        start_sec = data_start if start is None else int(start.value // NS_PER_SECOND)
+        end_sec = data_end if end is None else int(end.value // NS_PER_SECOND)
+        level = level or self.pick_level(start_sec, end_sec, resolution, max_points)
+        width = LEVEL_WIDTHS[level]
+
+        origin, bytes_vals, records, users = self.levels[level]
+        lo = max(0, start_sec // width - origin)
+        hi = min(len(bytes_vals), -(-end_sec // width) - origin)
+        if hi <= lo:
+            return level, []
+        times = np.datetime_as_string(((np.arange(lo, hi) + origin) * width).astype('datetime64[s]'))
+        points = [
+            {'time': str(t).replace('T', ' '), 'bytes': int(b), 'records': int(r), 'active_users': int(u)}
+            for t, b, r, u in zip(times, bytes_vals[lo:hi], records[lo:hi], users[lo:hi])
+        ]
+        return level, points
+
+    def save(self, directory):
+        """保存为 .npy 文件（供共享存储以内存映射方式挂载）"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        origins = {}
+        for name, (origin, *arrays) in self.levels.items():
+            origins[name] = int(origin)
+            for field, values in zip(('bytes', 'records', 'users'), arrays):
+                np.save(directory / f'{name}_{field}.npy', values)
+        with open(directory / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump({'origins': origins, 'rows': self.rows}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """从 save() 的输出加载"""
+        directory = Path(directory)
+        with open(directory / 'meta.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        levels = {
+            name: (origin, *[np.load(directory / f'{name}_{field}.npy', mmap_mode=mmap_mode)
+                             for field in ('bytes', 'records', 'users')])
+            for name, origin in meta['origins'].items()
+        }
+        return cls(levels, rows=meta['rows'])
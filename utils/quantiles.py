@@ -0,0 +1,206 @@
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.metrics import timed_stage
+
+
+# 相对误差上限：任一分位数估计值与真实值的相对误差不超过该值
+RELATIVE_ACCURACY = 0.01
+
+# 记录大小 <= 0 时使用的桶号（排在所有正数桶之前，估计值为 0）
+ZERO_KEY = -(2 ** 15)
+
+# 默认返回的分位数
+DEFAULT_QUANTILES = (0.5, 0.95, 0.99)
+
+# 分组维度 -> 取值列
+DIMENSIONS = {
+    'category': 'app_category',
+    'user': 'user',
+    'hour': 'hour',
+}
+
+
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+
+def _bucket_keys(values):
+    """值 -> 对数桶号：桶 i 覆盖 (gamma^(i-1), gamma^i]"""
+    values = np.asarray(values, dtype=np.float64)
+    keys = np.full(len(values), ZERO_KEY, dtype=np.int64)
+    positive = values > 0
+    keys[positive] = np.ceil(np.log(values[positive]) / _LOG_GAMMA)
+    return keys
+
+
+def _bucket_values(keys):
+    """桶号 -> 代表值（保证相对误差不超过 RELATIVE_ACCURACY）"""
+    keys = np.asarray(keys, dtype=np.int64)
+    values = 2 * np.power(_GAMMA, keys.astype(np.float64)) / (_GAMMA + 1)
+    values[keys == ZERO_KEY] = 0.0
+    return values
+
+
+class GroupedSketch:
+    """按分组的可合并分位数草图（DDSketch 式对数分桶，CSR 稀疏存储）
+
+    每个分组保存按桶号排序的 (桶号, 计数)；两个草图合并只需把计数相加，
+    分位数查询对全部分组同时在累计计数上二分查找。
+    """
+
+    def __init__(self, groups, keys, counts, offsets):
+        self.groups = list(groups)
+        self.keys = keys
+        self.counts = counts
+        self.offsets = offsets
+        self._positions = {group: i for i, group in enumerate(self.groups)}
+
+    @classmethod
+    def from_values(cls, groups, values, label=str):
+        """从分组列和数值列构建；label 将分组取值转为分组名（需保持排序一致）"""
+        codes, names = pd.factorize(groups, sort=True)
+        return cls._from_codes([label(n) for n in names], codes.astype(np.int64), _bucket_keys(values))
+
+    @classmethod
+    def _from_codes(cls, groups, codes, keys, counts=None):
+        """由 (分组编号, 桶号, 计数) 三元组聚合为 CSR；counts 为 None 表示每条计数为 1
+
+        分组编号和桶号合成一个 int64 键后只排序一次。
+        """
+        if len(codes) == 0:
+            return cls(groups, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64),
+                       np.zeros(len(groups) + 1, dtype=np.int64))
+        key_min = int(keys.min())
+        span = int(keys.max()) - key_min + 1
+        combined = codes * span + (keys - key_min)
+        if counts is None:
+            combined = np.sort(combined)
+        else:
+            order = np.argsort(combined, kind='stable')
+            combined, counts = combined[order], counts[order]
+
+        boundary = np.ones(len(combined), dtype=bool)
+        boundary[1:] = combined[1:] != combined[:-1]
+        starts = np.flatnonzero(boundary)
+        if counts is None:
+            merged_counts = np.diff(np.append(starts, len(combined)))
+        else:
+            merged_counts = np.add.reduceat(counts, starts)
+        unique = combined[starts]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(unique // span, minlength=len(groups)))])
+        return cls(groups, (unique % span + key_min).astype(np.int32), merged_counts.astype(np.int64),
+                   offsets.astype(np.int64))
+
+    def _triples(self, positions):
+        """展开为 (分组编号, 桶号, 计数)，分组编号经 positions 重新映射"""
+        sizes = np.diff(np.asarray(self.offsets))
+        codes = np.repeat(np.asarray(positions, dtype=np.int64), sizes)
+        return codes, np.asarray(self.keys, dtype=np.int64), np.asarray(self.counts)
+
+    def merged(self, other):
+        """合并两个草图，返回新草图"""
+        groups = sorted(set(self.groups) | set(other.groups))
+        positions = {group: i for i, group in enumerate(groups)}
+        parts = [sketch._triples([positions[g] for g in sketch.groups]) for sketch in (self, other)]
+        return GroupedSketch._from_codes(groups, *[np.concatenate(arrays) for arrays in zip(*parts)])
+
+    def summary(self, quantiles=DEFAULT_QUANTILES, groups=None):
+        """返回各分组的记录数和分位数 [{'group', 'count', 'p50', ...}]"""
+        offsets = np.asarray(self.offsets)
+        counts = np.asarray(self.counts)
+        cumulative = np.cumsum(counts)
+        bounds = np.concatenate([[0], cumulative])[offsets]
+        base, totals = bounds[:-1], np.diff(bounds)
+
+        selected = np.arange(len(self.groups)) if groups is None else np.array(
+            [self._positions[g] for g in groups if g in self._positions], dtype=np.int64)
+        result = [{'group': self.groups[i], 'count': int(totals[i])} for i in selected]
+        keys = np.asarray(self.keys)
+        for q in quantiles:
+            # 第 rank 条记录（从 1 开始）所在的桶
+            rank = np.floor(q * (totals[selected] - 1)) + 1
+            idx = np.searchsorted(cumulative, base[selected] + rank, side='left')
+            values = _bucket_values(keys[np.minimum(idx, len(keys) - 1)]) if len(keys) else np.zeros(len(selected))
+            label = quantile_label(q)
+            for item, value in zip(result, values):
+                item[label] = round(float(value), 1)
+        return result
+
+    def save(self, directory):
+        """保存为 .npy 文件"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / 'keys.npy', self.keys)
+        np.save(directory / 'counts.npy', self.counts)
+        np.save(directory / 'offsets.npy', self.offsets)
+        with open(directory / 'groups.json', 'w', encoding='utf-8') as f:
+            json.dump(self.groups, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """从 save() 的输出加载"""
+        directory = Path(directory)
+        with open(directory / 'groups.json', 'r', encoding='utf-8') as f:
+            groups = json.load(f)
+        return cls(groups, *[np.load(directory / f'{name}.npy', mmap_mode=mmap_mode)
+                             for name in ('keys', 'counts', 'offsets')])
+
+
+def quantile_label(q):
+    """分位数的字段名，如 0.95 -> 'p95'，0.999 -> 'p99.9'"""
+    return 'p' + f'{q * 100:g}'
+
+
+class RecordSizeSketches:
+    """按应用类别、用户、小时分组的记录大小（bytes）分位数草图
+
+    上传新数据时只为新增记录构建草图并与上一版本合并。
+    """
+
+    def __init__(self, sketches, rows=0):
+        self.sketches = sketches
+        self.rows = int(rows)
+
+    @classmethod
+    def from_frame(cls, df):
+        """从 DataFrame 构建全部维度的草图"""
+        with timed_stage('quantile_sketch', rows=len(df)):
+            values = df['bytes'].to_numpy()
+            sketches = {}
+            for dim, col in DIMENSIONS.items():
+                # 小时补零为 '08:00'，按字符串排序即按小时排序，与合并后的分组顺序一致
+                label = (lambda h: f'{int(h):02d}:00') if dim == 'hour' else str
+                sketches[dim] = GroupedSketch.from_values(df[col], values, label)
+        return cls(sketches, rows=len(df))
+
+    def updated(self, new_df):
+        """与新增数据的草图合并，返回新对象"""
+        added = RecordSizeSketches.from_frame(new_df)
+        return RecordSizeSketches({dim: self.sketches[dim].merged(added.sketches[dim]) for dim in DIMENSIONS},
+                                  rows=self.rows + added.rows)
+
+    def summary(self, dimension, quantiles=DEFAULT_QUANTILES, groups=None):
+        """指定维度各分组的分位数"""
+        return self.sketches[dimension].summary(quantiles, groups)
+
+    def save(self, directory):
+        """保存为 .npy 文件（供共享存储以内存映射方式挂载）"""
+        directory = Path(directory)
+        for dim, sketch in self.sketches.items():
+            sketch.save(directory / dim)
+        with open(directory / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump({'rows': self.rows}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """从 save() 的输出加载"""
+        directory = Path(directory)
+        with open(directory / 'meta.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls({dim: GroupedSketch.load(directory / dim, mmap_mode) for dim in DIMENSIONS},
+                   rows=meta['rows'])
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+from utils.analysis import NS_PER_SECOND
+from utils.metrics import timed_stage
+
+
+# 会话空闲超时（秒）：同一五元组相邻记录间隔超过该值即切分为新会话
+IDLE_TIMEOUT = 300
+
+# 五元组列
+FLOW_COLUMNS = ['src_ip', 'dst_ip', 'src_port', 'dst_port', 'protocol']
+
+
+def _flow_codes(df):
+    """将五元组编码为单个 int64（各列编码按混合进制组合，超出 int64 范围时退化为 groupby 分组编号）"""
+    codes = [pd.factorize(df[col], use_na_sentinel=False)[0].astype(np.int64) for col in FLOW_COLUMNS]
+    sizes = [int(c.max()) + 1 for c in codes]
+    if np.prod(np.array(sizes, dtype=np.float64)) < 2 ** 62:
+        flow = np.zeros(len(df), dtype=np.int64)
+        for code, size in zip(codes, sizes):
+            flow = flow * size + code
+        return flow
+    return df.groupby(FLOW_COLUMNS, sort=False, observed=True).ngroup().to_numpy(dtype=np.int64)
+
+
+def _sort_order(flow, ts):
+    """按 (五元组, 时间) 排序的下标；组合键可放入 int64 时只需一次整数排序"""
+    offset = ts - ts.min()
+    if not (offset % NS_PER_SECOND).any():
+        # 秒级时间戳按秒编码，组合键范围更小
+        offset //= NS_PER_SECOND
+    span = int(offset.max()) + 1
+    if (int(flow.max()) + 1) * span < 2 ** 62:
+        return np.argsort(flow * span + offset, kind='stable')
+    return np.lexsort((ts, flow))
+
+
+def build_sessions(df, idle_timeout=IDLE_TIMEOUT):
+    """按五元组和空闲超时重建会话（一次排序的向量化实现）
+
+    先按 (五元组, 时间) 排序一次，相邻记录五元组不同或间隔超过 idle_timeout 处即为会话边界，
+    再用 np.add.reduceat 按边界汇总。返回每个会话一行的 DataFrame：
+    五元组、user、start、end、duration（秒）、bytes、records。
+    """
+    columns = FLOW_COLUMNS + ['user', 'start', 'end', 'duration', 'bytes', 'records']
+    if df is None or len(df) == 0:
+        return pd.DataFrame(columns=columns)
+
+    with timed_stage('session_build', rows=len(df)):
+        flow = _flow_codes(df)
+        ts = df['timestamp'].to_numpy(dtype='datetime64[ns]').view('int64')
+        order = _sort_order(flow, ts)
+
+        sorted_ts = ts[order]
+        sorted_flow = flow[order]
+        boundary = np.ones(len(order), dtype=bool)
+        boundary[1:] = (sorted_flow[1:] != sorted_flow[:-1]) | (np.diff(sorted_ts) > idle_timeout * NS_PER_SECOND)
+        starts = np.flatnonzero(boundary)
+        ends = np.append(starts[1:], len(order)) - 1
+
+        first_rows = order[starts]
+        sessions = df.iloc[first_rows][FLOW_COLUMNS + ['user']].reset_index(drop=True)
+        sessions['start'] = sorted_ts[starts].view('datetime64[ns]')
+        sessions['end'] = sorted_ts[ends].view('datetime64[ns]')
+        sessions['duration'] = (sorted_ts[ends] - sorted_ts[starts]) / NS_PER_SECOND
+        sessions['bytes'] = np.add.reduceat(df['bytes'].to_numpy(dtype=np.int64)[order], starts)
+        sessions['records'] = ends - starts + 1
+    return sessions[columns]
+
+
+def user_session_sums(sessions):
+    """汇总每个用户的会话可合并统计量（会话数、时长和、最长时长、字节和、记录和），返回按用户索引的 DataFrame"""
+    grouped = sessions.groupby('user', observed=True)
+    return pd.DataFrame({
+        'sessions': grouped.size(),
+        'duration_sum': grouped['duration'].sum(),
+        'duration_max': grouped['duration'].max(),
+        'bytes_sum': grouped['bytes'].sum(),
+        'records_sum': grouped['records'].sum(),
+    })
@@ -0,0 +1,234 @@
+import json
+import mmap
+import os
+import shutil
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.metrics import timed_stage
+
+try:
+    import fcntl
+except ImportError:  # Windows 无 fcntl，退化为进程内无锁
+    fcntl = None
+
+
+# 当前版本指针文件名
+CURRENT_FILE = 'CURRENT'
+
+# 保留的历史版本数（仍被旧 worker 映射的版本不会立即删除）
+KEEP_VERSIONS = 3
+
+
+class MappedProfiles(Mapping):
+    """以内存映射方式只读访问的用户画像
+
+    profiles.json 为完整的 JSON 文本，按用户偏移量索引，访问单个用户时才解码；
+    整份数据通过 raw_json() 原样返回，无需在每个 worker 中反序列化。
+    """
+
+    def __init__(self, json_path, index):
+        self._path = json_path
+        self._index = index
+        with open(json_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __getitem__(self, user_id):
+        offset, length = self._index[user_id]
+        return json.loads(self._mm[offset:offset + length])
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, user_id):
+        return user_id in self._index
+
+    def raw_json(self):
+        """返回完整画像 JSON 的字节串"""
+        return bytes(self._mm[:])
+
+
+def _write_profiles(profiles, json_path):
+    """写出画像 JSON 并返回每个用户值在文件中的偏移索引"""
+    index = {}
+    with open(json_path, 'wb') as f:
+        f.write(b'{')
+        for i, (user_id, profile) in enumerate(profiles.items()):
+            prefix = (',' if i else '') + json.dumps(str(user_id), ensure_ascii=False) + ':'
+            f.write(prefix.encode('utf-8'))
+            body = json.dumps(profile, ensure_ascii=False).encode('utf-8')
+            index[str(user_id)] = (f.tell(), len(body))
+            f.write(body)
+        f.write(b'}')
+    return index
+
+
+def _write_columns(df, version_dir):
+    """将 DataFrame 按列写成 .npy 文件，返回列元数据"""
+    columns = []
+    for col in df.columns:
+        series = df[col]
+        meta = {'name': col}
+        if pd.api.types.is_datetime64_any_dtype(series):
+            values = series.to_numpy(dtype='datetime64[ns]').view('int64')
+            meta['kind'] = 'datetime'
+        elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            values = series.to_numpy()
+            meta['kind'] = 'numeric'
+        else:
+            cat = pd.Categorical(series.astype(str) if series.dtype == object else series)
+            values = cat.codes
+            meta['kind'] = 'category'
+            meta['categories'] = [str(c) for c in cat.categories]
+        np.save(version_dir / f'col_{len(columns)}.npy', values)
+        meta['file'] = f'col_{len(columns)}.npy'
+        columns.append(meta)
+    return columns
+
+
+def _read_columns(version_dir, columns):
+    """以只读内存映射方式挂载列文件，重建 DataFrame"""
+    series = {}
+    for meta in columns:
+        values = np.load(version_dir / meta['file'], mmap_mode='r')
+        if meta['kind'] == 'datetime':
+            series[meta['name']] = pd.Series(values.view('datetime64[ns]'))
+        elif meta['kind'] == 'category':
+            cat = pd.Categorical.from_codes(values, categories=meta['categories'])
+            series[meta['name']] = pd.Series(cat)
+        else:
+            series[meta['name']] = pd.Series(values)
+    if not series:
+        return pd.DataFrame()
+    return pd.concat(series, axis=1)
+
+
+class SharedStore:
+    """多 worker 共享的预计算数据存储
+
+    每次发布写入一个新的版本目录（列式 .npy、聚合结果、图表和画像），
+    再以原子替换 CURRENT 指针文件的方式切换版本。各 worker 只读映射当前版本，
+    任一 worker 发布后，其他 worker 通过检查指针即可看到新版本。
+    """
+
+    def __init__(self, root, base_columns=None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.base_columns = base_columns
+
+    @contextmanager
+    def lock(self):
+        """跨进程互斥锁，保证同一时刻只有一个进程构建/发布"""
+        lock_path = self.root / '.lock'
+        with open(lock_path, 'w') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def current_name(self):
+        """读取当前版本目录名，无版本时返回 None"""
+        try:
+            return (self.root / CURRENT_FILE).read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _next_version(self):
+        """计算下一个全局版本号"""
+        versions = [int(p.name[1:]) for p in self.root.glob('v*') if p.name[1:].isdigit()]
+        return max(versions, default=0) + 1
+
+    def publish(self, snapshot):
+        """将快照写入新版本目录并切换 CURRENT，返回版本目录名（需在 lock() 内调用）"""
+        version = self._next_version()
+        name = f'v{version:08d}'
+        tmp_dir = self.root / f'.{name}.tmp'
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir()
+
+        df = snapshot.analyzer.df
+        if self.base_columns:
+            df = df[[c for c in self.base_columns if c in df.columns]]
+
+        with timed_stage('shared_store_publish', rows=len(df)):
+            columns = _write_columns(df, tmp_dir)
+            index = _write_profiles(snapshot.user_profiles, tmp_dir / 'profiles.json')
+            for index_name, derived in snapshot.indexes.items():
+                derived.save(tmp_dir / f'index_{index_name}')
+            meta = {
+                'version': version,
+                'source': snapshot.source,
+                'created_at': snapshot.created_at,
+                'columns': columns,
+                'aggregates': snapshot.aggregates,
+                'charts_html': snapshot.charts_html,
+                'profile_index': index,
+                'indexes': sorted(snapshot.indexes),
+            }
+            with open(tmp_dir / 'meta.json', 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+            os.replace(tmp_dir, self.root / name)
+            pointer_tmp = self.root / f'{CURRENT_FILE}.tmp'
+            pointer_tmp.write_text(name)
+            os.replace(pointer_tmp, self.root / CURRENT_FILE)
+
+        self._cleanup(keep=name)
+        return name
+
+    def _cleanup(self, keep):
+        """删除过旧的版本目录（已映射的文件在 POSIX 上仍可被旧 worker 访问）"""
+        versions = sorted(p for p in self.root.glob('v*') if p.is_dir())
+        for path in versions[:-KEEP_VERSIONS]:
+            if path.name != keep:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def index_dir(self, name, index_name):
+        """指定版本中某个派生索引的目录"""
+        return self.root / name / f'index_{index_name}'
+
+    def attach(self, name, prepare_frame):
+        """只读挂载指定版本，返回 (meta, DataFrame, MappedProfiles)"""
+        version_dir = self.root / name
+        with timed_stage('shared_store_attach') as t:
+            with open(version_dir / 'meta.json', 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            df = prepare_frame(_read_columns(version_dir, meta['columns']))
+            t.set_rows(len(df))
+            profiles = MappedProfiles(version_dir / 'profiles.json', {
+                user_id: tuple(pos) for user_id, pos in meta['profile_index'].items()
+            })
+        return meta, df, profiles
+
+
+class SharedStoreWatcher:
+    """节流地检查 CURRENT 指针是否变化"""
+
+    def __init__(self, store, interval=1.0):
+        self.store = store
+        self.interval = interval
+        self._last_check = 0.0
+
+    def poll(self, attached_name):
+        """若共享存储的当前版本与已挂载版本不同，返回新版本名，否则返回 None"""
+        now = time.monotonic()
+        if now - self._last_check < self.interval:
+            return None
+        self._last_check = now
+        name = self.store.current_name()
+        if name and name != attached_name:
+            return name
+        return None
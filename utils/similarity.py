@@ -0,0 +1,219 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from utils.metrics import timed_stage
+
+
+# 画像中的标准化应用类别（与 UserProfileAnalyzer.get_app_category_pct 的输出一致）
+CATEGORY_FEATURES = ['game', 'video', 'social', 'chat', 'edu', 'web', 'dns', 'others']
+
+# 用户数达到该值时额外构建近似（倒排聚类）索引
+APPROX_MIN_USERS = 100_000
+
+# 近似检索时探查的聚类数
+DEFAULT_NPROBE = 8
+
+
+def _normalize_rows(matrix):
+    """按行做 L2 归一化（全零行保持为零）"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _block_shares(block):
+    """将一个特征块按行归一化为占比"""
+    totals = block.sum(axis=1, keepdims=True)
+    totals[totals == 0] = 1.0
+    return block / totals
+
+
+def profile_items(user_profiles):
+    """逐个产出 (字符串用户 ID, 画像)
+
+    画像的键可能是数值用户 ID（CSV 中的整数 user 列），而画像 JSON、共享存储和 URL 中的用户 ID 均为字符串；
+    各索引统一以字符串 ID 构建和查询，只在读取画像时使用原始键。
+    """
+    for user_id in user_profiles:
+        yield str(user_id), user_profiles[user_id]
+
+
+def build_feature_matrix(user_profiles):
+    """将所有用户画像转为归一化特征矩阵
+
+    特征由三块组成，每块先按行归一化为占比，再整体 L2 归一化：
+    - 应用类别占比（CATEGORY_FEATURES）
+    - 24 小时流量分布
+    - 协议占比（按出现过的协议排序）
+
+    返回 (user_ids, matrix, feature_names)，matrix 为 float32。
+    """
+    items = list(profile_items(user_profiles))
+    user_ids = [user_id for user_id, _ in items]
+    protocols = sorted({p for _, profile in items for p in (profile.get('protocol_ratio') or {})})
+    n = len(user_ids)
+
+    categories = np.zeros((n, len(CATEGORY_FEATURES)), dtype=np.float32)
+    hours = np.zeros((n, 24), dtype=np.float32)
+    protocol_block = np.zeros((n, len(protocols)), dtype=np.float32)
+    category_pos = {c: i for i, c in enumerate(CATEGORY_FEATURES)}
+    protocol_pos = {p: i for i, p in enumerate(protocols)}
+
+    for row, (_, profile) in enumerate(items):
+        for cat, pct in (profile.get('category_pct') or {}).items():
+            if cat in category_pos:
+                categories[row, category_pos[cat]] = pct
+        for hour, stats in (profile.get('active_hours') or {}).items():
+            hours[row, int(hour)] = stats.get('bytes', 0)
+        for protocol, pct in (profile.get('protocol_ratio') or {}).items():
+            protocol_block[row, protocol_pos[protocol]] = pct
+
+    matrix = np.hstack([_block_shares(categories), _block_shares(hours), _block_shares(protocol_block)])
+    feature_names = ([f'category:{c}' for c in CATEGORY_FEATURES] +
+                     [f'hour:{h:02d}' for h in range(24)] +
+                     [f'protocol:{p}' for p in protocols])
+    return user_ids, _normalize_rows(matrix).astype(np.float32), feature_names
+
+
+def minibatch_kmeans(x, k, iterations=50, batch_size=1024, seed=0):
+    """mini-batch k-means（向量化实现），返回 (centroids, labels)"""
+    n = len(x)
+    k = max(1, min(k, n))
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(n, size=k, replace=False)].astype(np.float32)
+    counts = np.zeros(k, dtype=np.float64)
+
+    for _ in range(iterations):
+        batch = x[rng.choice(n, size=min(batch_size, n), replace=False)]
+        nearest = _nearest_centroid(batch, centroids)
+        batch_counts = np.bincount(nearest, minlength=k).astype(np.float64)
+        sums = np.zeros_like(centroids, dtype=np.float64)
+        np.add.at(sums, nearest, batch)
+        updated = batch_counts > 0
+        counts[updated] += batch_counts[updated]
+        # 按累计样本数衰减的学习率更新中心
+        rate = (batch_counts[updated] / counts[updated])[:, None]
+        means = sums[updated] / batch_counts[updated][:, None]
+        centroids[updated] = (1 - rate) * centroids[updated] + rate * means
+
+    return centroids, _nearest_centroid(x, centroids)
+
+
+def _nearest_centroid(x, centroids, chunk_rows=65536):
+    """分块计算每行最近的中心（欧氏距离）"""
+    labels = np.empty(len(x), dtype=np.int32)
+    centroid_sq = (centroids ** 2).sum(axis=1)
+    for offset in range(0, len(x), chunk_rows):
+        chunk = x[offset:offset + chunk_rows]
+        dist = centroid_sq[None, :] - 2 * chunk @ centroids.T
+        labels[offset:offset + chunk_rows] = dist.argmin(axis=1)
+    return labels
+
+
+class SimilarityIndex:
+    """基于画像特征向量的用户相似度检索（余弦相似度 top-k）
+
+    默认对全部用户做一次矩阵-向量乘法精确检索；用户数较多时额外构建
+    倒排聚类（IVF）索引，近似检索只计算若干最近聚类中的候选用户。
+    """
+
+    def __init__(self, user_ids, matrix, centroids=None, list_order=None, list_offsets=None):
+        self.user_ids = list(user_ids)
+        self.matrix = matrix
+        self.centroids = centroids
+        self.list_order = list_order
+        self.list_offsets = list_offsets
+        self._positions = {user_id: i for i, user_id in enumerate(self.user_ids)}
+
+    @classmethod
+    def from_profiles(cls, user_profiles, approx_min_users=APPROX_MIN_USERS):
+        """从用户画像构建索引"""
+        with timed_stage('similarity_index', rows=len(user_profiles)):
+            user_ids, matrix, _ = build_feature_matrix(user_profiles)
+            index = cls(user_ids, matrix)
+            if len(user_ids) >= approx_min_users:
+                index.build_ivf()
+        return index
+
+    @property
+    def has_ivf(self):
+        """是否已构建近似索引"""
+        return self.centroids is not None
+
+    def build_ivf(self, n_lists=None):
+        """构建倒排聚类索引：聚类中心 + 按聚类排序的用户位置（CSR 形式）"""
+        n_lists = n_lists or max(1, int(np.sqrt(len(self.user_ids))))
+        centroids, labels = minibatch_kmeans(self.matrix, n_lists)
+        self.centroids = _normalize_rows(centroids).astype(np.float32)
+        self.list_order = np.argsort(labels, kind='stable').astype(np.int32)
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(centroids)))]).astype(np.int64)
+
+    def __contains__(self, user_id):
+        return user_id in self._positions
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def most_similar(self, user_id, k=10, approximate=None, nprobe=DEFAULT_NPROBE):
+        """返回与指定用户最相似的 k 个用户 [(user_id, score), ...]；用户不存在时返回 None"""
+        position = self._positions.get(user_id)
+        if position is None:
+            return None
+        query = self.matrix[position]
+        if approximate is None:
+            approximate = self.has_ivf
+        if approximate and self.has_ivf:
+            candidates = self._probe(query, nprobe)
+        else:
+            candidates = None
+
+        if candidates is None:
+            scores = self.matrix @ query
+            rows = np.arange(len(scores))
+        else:
+            scores = self.matrix[candidates] @ query
+            rows = candidates
+
+        # 排除自身
+        keep = rows != position
+        scores, rows = scores[keep], rows[keep]
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.user_ids[rows[i]], float(scores[i])) for i in top]
+
+    def _probe(self, query, nprobe):
+        """选出查询向量最近的 nprobe 个聚类中的候选用户"""
+        nprobe = min(nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.list_order[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists])
+
+    def save(self, directory):
+        """保存为 .npy 文件（供共享存储以内存映射方式挂载）"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / 'matrix.npy', self.matrix)
+        with open(directory / 'users.json', 'w', encoding='utf-8') as f:
+            json.dump(self.user_ids, f, ensure_ascii=False)
+        if self.has_ivf:
+            np.save(directory / 'centroids.npy', self.centroids)
+            np.save(directory / 'list_order.npy', self.list_order)
+            np.save(directory / 'list_offsets.npy', self.list_offsets)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """从 save() 的输出加载"""
+        directory = Path(directory)
+        with open(directory / 'users.json', 'r', encoding='utf-8') as f:
+            user_ids = json.load(f)
+        matrix = np.load(directory / 'matrix.npy', mmap_mode=mmap_mode)
+        if (directory / 'centroids.npy').exists():
+            return cls(user_ids, matrix,
+                       centroids=np.load(directory / 'centroids.npy', mmap_mode=mmap_mode),
+                       list_order=np.load(directory / 'list_order.npy', mmap_mode=mmap_mode),
+                       list_offsets=np.load(directory / 'list_offsets.npy', mmap_mode=mmap_mode))
+        return cls(user_ids, matrix)
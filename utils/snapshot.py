@@ -0,0 +1,161 @@
+import itertools
+import time
+from dataclasses import dataclass, field
+
+from utils.analysis import TrafficAnalyzer, generate_all_charts, ensure_time_columns
+from utils.user_profile import UserProfileAnalyzer
+from utils.profile_state import ProfileState
+from utils.metrics import timed_stage
+from utils.similarity import SimilarityIndex
+from utils.anomaly import AnomalyIndex
+from utils.tag_index import TagIndex
+from utils.pyramid import TrendPyramid
+from utils.quantiles import RecordSizeSketches
+from utils.heatmap import ActivityHeatmap
+from utils.enrichment import EnrichmentIndex
+
+
+# 快照版本号生成器（进程内单调递增）
+_version_counter = itertools.count(1)
+
+# 快照附带的派生索引类型：名称 -> 实现 save(directory) / load(directory) 的类
+INDEX_TYPES = {
+    'similarity': SimilarityIndex,
+    'anomalies': AnomalyIndex,
+    'tags': TagIndex,
+    'trend': TrendPyramid,
+    'quantiles': RecordSizeSketches,
+    'heatmap': ActivityHeatmap,
+    'enrichment': EnrichmentIndex,
+}
+
+
+@dataclass(frozen=True)
+class DatasetSnapshot:
+    """不可变的数据集快照
+
+    一个快照同时持有原始数据（分析器）、预计算的聚合结果、图表 HTML 和用户画像。
+    快照在发布前完整构建，发布后不再修改；读者只需取一次引用即可获得一致的视图。
+    """
+    version: int = 0
+    source: str = ''
+    analyzer: object = None
+    user_profile_analyzer: object = None
+    aggregates: dict = field(default_factory=dict)
+    charts_html: dict = field(default_factory=dict)
+    user_profiles: dict = field(default_factory=dict)
+    indexes: dict = field(default_factory=dict)
+    created_at: float = 0.0
+    store_version: str = ''
+
+    @property
+    def loaded(self):
+        """快照是否包含数据"""
+        return self.analyzer is not None
+
+
+# 空快照（尚未加载数据时使用）
+EMPTY_SNAPSHOT = DatasetSnapshot()
+
+
+def compute_aggregates(analyzer):
+    """预计算仪表板和 /api/stats 使用的聚合结果"""
+    with timed_stage('aggregates'):
+        return {
+            'total_traffic': analyzer.get_total_traffic(),
+            'user_ranking': analyzer.get_user_traffic_ranking(),
+            'user_ranking_top10': analyzer.get_user_traffic_ranking(top_n=10),
+            'app_category': analyzer.get_app_category_traffic(),
+            'active_hours': analyzer.get_active_hours(),
+        }
+
+
+def build_indexes(df, user_profiles, previous=None, new_df=None, ip_ranges=None):
+    """构建快照附带的派生索引
+
+    previous 为上一个快照且 new_df 为其后新增的数据时，可增量更新的索引在上一版本基础上扩展。
+    ip_ranges 为 IP 地址段表（IPRangeTable）时同时构建目的地址补充信息索引。
+    """
+    def extendable(name):
+        """上一版本中可在其基础上增量更新的索引，不满足条件时返回 None"""
+        index = previous.indexes.get(name) if previous is not None and new_df is not None else None
+        return index if index is not None and index.rows == len(df) - len(new_df) else None
+
+    anomalies = extendable('anomalies')
+    anomalies = anomalies.updated(new_df) if anomalies is not None else AnomalyIndex.from_frame(df)
+    trend = extendable('trend')
+    trend = trend.updated(df, new_df) if trend is not None else TrendPyramid.from_frame(df)
+    quantiles = extendable('quantiles')
+    quantiles = quantiles.updated(new_df) if quantiles is not None else RecordSizeSketches.from_frame(df)
+    heatmap = extendable('heatmap')
+    heatmap = heatmap.updated(new_df) if heatmap is not None else ActivityHeatmap.from_frame(df)
+
+    indexes = {
+        'similarity': SimilarityIndex.from_profiles(user_profiles),
+        'anomalies': anomalies,
+        'tags': TagIndex.from_profiles(user_profiles),
+        'trend': trend,
+        'quantiles': quantiles,
+        'heatmap': heatmap.with_clusters(user_profiles),
+    }
+    if ip_ranges is not None:
+        # 地址段表变化时不能在上一版本基础上追加
+        enrichment = extendable('enrichment')
+        if enrichment is not None and enrichment.signature == ip_ranges.signature:
+            indexes['enrichment'] = enrichment.updated(new_df, ip_ranges)
+        else:
+            indexes['enrichment'] = EnrichmentIndex.from_frame(df, ip_ranges)
+    return indexes
+
+
+def build_snapshot(df, source='', previous=None, new_df=None, ip_ranges=None):
+    """基于已准备好的 DataFrame 完整构建一个新快照（不影响当前已发布的快照）
+
+    流量分析器与画像分析器共享同一份 DataFrame，数据只解析一次。
+    previous / new_df 用于增量更新派生索引（见 build_indexes）和画像原始状态。
+    """
+    version = next(_version_counter)
+    analyzer = TrafficAnalyzer.from_dataframe(df, data_version=f'local-{version}')
+    aggregates = compute_aggregates(analyzer)
+
+    with timed_stage('charts'):
+        charts_html = generate_all_charts(analyzer)
+
+    user_profile_analyzer = UserProfileAnalyzer.from_dataframe(df)
+    previous_state = previous.user_profile_analyzer.state \
+        if previous is not None and previous.user_profile_analyzer is not None else None
+    if (new_df is not None and previous_state is not None
+            and previous_state.rows == len(df) - len(new_df) and previous_state.appendable(new_df)):
+        # 画像原始状态可合并：只为新增数据构建状态
+        user_profile_analyzer.state = previous_state.merged(ProfileState.from_frame(new_df))
+    user_profiles = user_profile_analyzer.analyze_all_users()
+    indexes = build_indexes(df, user_profiles, previous, new_df, ip_ranges)
+
+    return DatasetSnapshot(
+        version=version,
+        source=str(source),
+        analyzer=analyzer,
+        user_profile_analyzer=user_profile_analyzer,
+        aggregates=aggregates,
+        charts_html=charts_html,
+        user_profiles=user_profiles,
+        indexes=indexes,
+        created_at=time.time(),
+    )
+
+
+def snapshot_from_store(store, name):
+    """从共享存储只读挂载指定版本，构建快照"""
+    meta, df, profiles = store.attach(name, ensure_time_columns)
+    return DatasetSnapshot(
+        version=meta['version'],
+        source=meta['source'],
+        analyzer=TrafficAnalyzer.from_dataframe(df, data_version=f'store-{store.root}/{name}'),
+        aggregates=meta['aggregates'],
+        charts_html=meta['charts_html'],
+        user_profiles=profiles,
+        indexes={index_name: INDEX_TYPES[index_name].load(store.index_dir(name, index_name))
+                 for index_name in meta.get('indexes', []) if index_name in INDEX_TYPES},
+        created_at=meta['created_at'],
+        store_version=name,
+    )
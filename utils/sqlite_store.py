@@ -0,0 +1,254 @@
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from pathlib import Path
+
+import pandas as pd
+
+if __package__ in (None, ''):
+    # 以脚本方式直接运行 (python utils/sqlite_store.py) 时，将项目根目录加入搜索路径
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.analysis import NS_PER_SECOND, load_traffic_csv
+from utils.metrics import timed_stage
+
+
+# 批量写入的行数
+INSERT_BATCH_ROWS = 50_000
+
+# 只读查询默认/最大返回行数
+QUERY_DEFAULT_LIMIT = 1000
+QUERY_MAX_LIMIT = 100_000
+
+# 只读查询的执行预算（秒）
+QUERY_TIMEOUT = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS traffic (
+    ts INTEGER NOT NULL,
+    src_ip TEXT,
+    dst_ip TEXT,
+    src_port INTEGER,
+    dst_port INTEGER,
+    protocol TEXT,
+    bytes INTEGER,
+    app_category TEXT,
+    "user" TEXT,
+    hour INTEGER,
+    day INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_traffic_ts ON traffic (ts);
+CREATE INDEX IF NOT EXISTS idx_traffic_user_ts ON traffic ("user", ts);
+CREATE INDEX IF NOT EXISTS idx_traffic_dst_ip ON traffic (dst_ip);
+"""
+
+INSERT_COLUMNS = ['ts', 'src_ip', 'dst_ip', 'src_port', 'dst_port', 'protocol',
+                  'bytes', 'app_category', 'user', 'hour', 'day']
+
+INSERT_SQL = ('INSERT INTO traffic (ts, src_ip, dst_ip, src_port, dst_port, protocol, '
+              'bytes, app_category, "user", hour, day) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')
+
+# 只读查询允许的授权动作
+_READ_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    getattr(sqlite3, 'SQLITE_RECURSIVE', 33),
+}
+
+
+def _to_epoch(value, end_of_day=False):
+    """将时间参数转为 epoch 秒；只给日期的结束时间取当天最后一秒"""
+    if value is None or value == '':
+        return None
+    ts = pd.Timestamp(value)
+    if end_of_day and isinstance(value, str) and len(value.strip()) == 10:
+        ts = ts + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    return int(ts.value // NS_PER_SECOND)
+
+
+class SQLiteTrafficStore:
+    """SQLite 存储后端：流量记录表及 (ts)、(user, ts)、(dst_ip) 索引"""
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        with closing(self.connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def connect(self, read_only=False):
+        """打开连接；read_only 为 True 时以只读 URI 模式打开"""
+        if read_only:
+            conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False)
+            conn.execute('PRAGMA query_only = ON')
+        else:
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            conn.execute('PRAGMA journal_mode = WAL')
+        return conn
+
+    def _insert(self, conn, df):
+        """分批插入已准备好的 DataFrame"""
+        frame = pd.DataFrame({
+            'ts': df['timestamp'].to_numpy(dtype='datetime64[ns]').view('int64') // NS_PER_SECOND,
+            **{col: df[col] for col in INSERT_COLUMNS[1:]},
+        })
+        for offset in range(0, len(frame), INSERT_BATCH_ROWS):
+            batch = frame.iloc[offset:offset + INSERT_BATCH_ROWS].astype(object)
+            conn.executemany(INSERT_SQL, batch.itertuples(index=False, name=None))
+
+    def append_frame(self, df):
+        """追加记录"""
+        with timed_stage('sqlite_insert', rows=len(df)):
+            with closing(self.connect()) as conn, conn:
+                self._insert(conn, df)
+
+    def replace_frame(self, df):
+        """用 DataFrame 全量替换表内容"""
+        with timed_stage('sqlite_insert', rows=len(df)):
+            with closing(self.connect()) as conn, conn:
+                conn.execute('DELETE FROM traffic')
+                self._insert(conn, df)
+
+    def row_count(self):
+        """记录总数"""
+        with closing(self.connect(read_only=True)) as conn:
+            return conn.execute('SELECT COUNT(*) FROM traffic').fetchone()[0]
+
+    def query(self, sql, params=None, limit=QUERY_DEFAULT_LIMIT, timeout=QUERY_TIMEOUT):
+        """执行只读参数化查询，返回 {'columns': [...], 'rows': [...], 'truncated': bool}
+
+        使用只读连接、query_only、授权回调（只允许 SELECT 读操作）和执行时间预算，
+        并且一次只允许一条语句。
+        """
+        limit = max(1, min(int(limit), QUERY_MAX_LIMIT))
+        conn = self.connect(read_only=True)
+        try:
+            conn.set_authorizer(
+                lambda action, *args: sqlite3.SQLITE_OK if action in _READ_ACTIONS else sqlite3.SQLITE_DENY
+            )
+            deadline = time.monotonic() + timeout
+            conn.set_progress_handler(lambda: int(time.monotonic() > deadline), 10_000)
+
+            with timed_stage('sqlite_query') as t:
+                cursor = conn.execute(sql, params or ())
+                columns = [d[0] for d in cursor.description or []]
+                rows = cursor.fetchmany(limit + 1)
+                t.set_rows(len(rows))
+            truncated = len(rows) > limit
+            return {'columns': columns, 'rows': [list(r) for r in rows[:limit]], 'truncated': truncated}
+        finally:
+            conn.close()
+
+
+class SQLiteTrafficAnalyzer:
+    """以索引 SQL 实现的流量分析器，接口与 TrafficAnalyzer 的查询方法一致
+
+    可指定 start / end 时间范围，范围条件走 ts 索引，无需将数据加载为 DataFrame。
+    """
+
+    def __init__(self, store, start=None, end=None):
+        self.store = store
+        self.start = _to_epoch(start)
+        self.end = _to_epoch(end, end_of_day=True)
+
+    def _where(self, extra=None):
+        """构造时间范围条件"""
+        clauses = []
+        params = []
+        if self.start is not None:
+            clauses.append('ts >= ?')
+            params.append(self.start)
+        if self.end is not None:
+            clauses.append('ts <= ?')
+            params.append(self.end)
+        if extra:
+            clauses.append(extra[0])
+            params.extend(extra[1])
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def _fetch(self, sql, params):
+        with closing(self.store.connect(read_only=True)) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def get_total_traffic(self):
+        """获取总流量统计"""
+        where, params = self._where()
+        row = self._fetch(
+            f'SELECT COALESCE(SUM(bytes), 0), COUNT(*), COUNT(DISTINCT "user"), '
+            f'COUNT(DISTINCT src_ip), COUNT(DISTINCT dst_ip) FROM traffic{where}', params)[0]
+        if row[1] == 0:
+            return {"total_bytes": 0, "total_packets": 0, "unique_users": 0}
+        return {
+            "total_bytes": int(row[0]),
+            "total_packets": row[1],
+            "unique_users": row[2],
+            "unique_ips": row[3] + row[4]
+        }
+
+    def get_user_traffic_ranking(self, top_n=10):
+        """获取用户流量排名（top_n 为 None 时返回全部用户）"""
+        where, params = self._where()
+        sql = f'SELECT "user", SUM(bytes) AS b FROM traffic{where} GROUP BY "user" ORDER BY b DESC'
+        if top_n is not None:
+            sql += ' LIMIT ?'
+            params.append(int(top_n))
+        return [{"user": user, "bytes": int(b)} for user, b in self._fetch(sql, params)]
+
+    def get_app_category_traffic(self):
+        """获取应用类别流量分布"""
+        where, params = self._where()
+        rows = self._fetch(
+            f'SELECT app_category, SUM(bytes) AS b FROM traffic{where} '
+            f'GROUP BY app_category ORDER BY b DESC', params)
+        return [{"category": cat, "bytes": int(b)} for cat, b in rows]
+
+    def get_traffic_trend(self, unit='hour'):
+        """获取流量趋势（空时段补 0，与 TrafficAnalyzer 一致）"""
+        step = 3600 if unit == 'hour' else 300
+        where, params = self._where()
+        rows = self._fetch(
+            f'SELECT (ts / {step}) * {step} AS bucket, SUM(bytes) FROM traffic{where} '
+            f'GROUP BY bucket ORDER BY bucket', params)
+        if not rows:
+            return []
+        filled = dict(rows)
+        return [{"time": str(pd.Timestamp(bucket, unit='s')), "bytes": int(filled.get(bucket, 0))}
+                for bucket in range(rows[0][0], rows[-1][0] + step, step)]
+
+    def get_active_hours(self):
+        """获取活跃时段分析（按小时的用户活跃度）"""
+        where, params = self._where()
+        rows = self._fetch(
+            f'SELECT hour, COUNT(DISTINCT "user"), SUM(bytes), COUNT(*) FROM traffic{where} '
+            f'GROUP BY hour ORDER BY hour', params)
+        return [{"hour": f"{hour:02d}:00", "active_users": users,
+                 "total_bytes": int(total), "packet_count": count}
+                for hour, users, total, count in rows]
+
+    def get_user_app_distribution(self, user_id):
+        """获取指定用户的应用类别占比（走 (user, ts) 索引）"""
+        where, params = self._where(('"user" = ?', [user_id]))
+        rows = self._fetch(
+            f'SELECT app_category, SUM(bytes) AS b FROM traffic{where} '
+            f'GROUP BY app_category ORDER BY b DESC', params)
+        return [{"category": cat, "bytes": int(b)} for cat, b in rows]
+
+
+def build_database(csv_path, db_path):
+    """从 CSV 构建 SQLite 数据库（便利函数）"""
+    store = SQLiteTrafficStore(db_path)
+    store.replace_frame(load_traffic_csv(csv_path))
+    return store
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='将流量 CSV 导入 SQLite 数据库')
+    parser.add_argument('csv', help='流量 CSV 文件')
+    parser.add_argument('--db', default=str(Path(__file__).parent.parent / 'data' / 'traffic.db'),
+                        help='SQLite 数据库路径')
+    args = parser.parse_args()
+
+    store = build_database(args.csv, args.db)
+    print(f"已导入 {store.row_count()} 条记录至: {args.db}")
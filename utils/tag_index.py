@@ -0,0 +1,88 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from utils.metrics import timed_stage
+from utils.similarity import profile_items
+
+
+class TagIndex:
+    """标签倒排索引：标签 -> 有序的用户编号数组
+
+    用户按 ID 排序后编号，所有标签的倒排列表按 CSR 形式拼接存放（postings + offsets），
+    交集查询从最短的列表开始逐个 np.intersect1d。
+    """
+
+    def __init__(self, users, tags, postings, offsets):
+        self.users = list(users)
+        self.tags = list(tags)
+        self.postings = postings
+        self.offsets = offsets
+        self._tag_pos = {tag: i for i, tag in enumerate(self.tags)}
+
+    @classmethod
+    def from_profiles(cls, user_profiles):
+        """从用户画像构建（用户 ID 与相似度索引一样统一为字符串）"""
+        with timed_stage('tag_index', rows=len(user_profiles)):
+            items = sorted(profile_items(user_profiles), key=lambda item: item[0])
+            users = [user_id for user_id, _ in items]
+            lists = {}
+            for i, (_, profile) in enumerate(items):
+                for tag in profile.get('tags') or []:
+                    lists.setdefault(tag, []).append(i)
+            tags = sorted(lists, key=lambda t: (-len(lists[t]), t))
+            sizes = [len(lists[t]) for t in tags]
+            postings = np.array([i for t in tags for i in lists[t]], dtype=np.int32)
+            offsets = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]).astype(np.int64)
+        return cls(users, tags, postings, offsets)
+
+    def __contains__(self, tag):
+        return tag in self._tag_pos
+
+    def _postings(self, tag):
+        """单个标签的用户编号数组（有序）"""
+        i = self._tag_pos[tag]
+        return self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+    def counts(self):
+        """各标签的用户数（按用户数降序）"""
+        sizes = np.diff(np.asarray(self.offsets))
+        return [{'tag': tag, 'users': int(size)} for tag, size in zip(self.tags, sizes)]
+
+    def match(self, tags):
+        """同时带有全部指定标签的用户编号数组；含未知标签时返回空数组"""
+        if not tags or any(tag not in self._tag_pos for tag in tags):
+            return np.empty(0, dtype=np.int32)
+        lists = sorted((self._postings(tag) for tag in set(tags)), key=len)
+        result = np.asarray(lists[0])
+        for other in lists[1:]:
+            if len(result) == 0:
+                break
+            result = np.intersect1d(result, other, assume_unique=True)
+        return result
+
+    def users_with(self, tags, offset=0, limit=100):
+        """分页返回同时带有全部指定标签的用户，返回 (总数, 本页用户列表)"""
+        matched = self.match(tags)
+        page = matched[offset:offset + limit]
+        return len(matched), [self.users[i] for i in page]
+
+    def save(self, directory):
+        """保存为 .npy 文件（供共享存储以内存映射方式挂载）"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / 'postings.npy', self.postings)
+        np.save(directory / 'offsets.npy', self.offsets)
+        with open(directory / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump({'users': self.users, 'tags': self.tags}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """从 save() 的输出加载"""
+        directory = Path(directory)
+        with open(directory / 'meta.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(meta['users'], meta['tags'],
+                   np.load(directory / 'postings.npy', mmap_mode=mmap_mode),
+                   np.load(directory / 'offsets.npy', mmap_mode=mmap_mode))
@@ -1,154 +1,185 @@
 import pandas as pd
+import argparse
 import json
+import sys
 from pathlib import Path
 from collections import defaultdict, Counter
 import numpy as np
 
+if __package__ in (None, ''):
+    # 以脚本方式直接运行 (python utils/user_profile.py) 时，将项目根目录加入搜索路径
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.metrics import timed_stage
+from utils.analysis import load_traffic_csv
+from utils.clustering import category_index, cluster_users, REGULARITY_THRESHOLD
+from utils.profile_state import ProfileState, SUSPICIOUS_PORTS
+
+
+# 标准化应用类别及其关键词
+NORMALIZED_CATEGORIES = {
+    'game': ['game', 'gaming', 'games'],
+    'video': ['video streaming', 'video', 'streaming'],
+    'social': ['social media', 'social'],
+    'chat': ['chat', 'im', 'instant messaging'],
+    'edu': ['education', 'edu', 'learning'],
+    'web': ['web browse', 'web', 'http'],
+    'dns': ['dns'],
+}
+
+
+def derive_category_pct(category_bytes):
+    """原始类别字节和 -> 标准化类别占比（每个原始类别只归入首个匹配的标准类别）"""
+    total_bytes = sum(category_bytes.values())
+    if total_bytes <= 0:
+        return {}
+    names = list(NORMALIZED_CATEGORIES) + ['others']
+    sums = [0] * len(names)
+    for name, bytes_val in category_bytes.items():
+        sums[category_index(name, NORMALIZED_CATEGORIES)] += bytes_val
+    return {cat: round(value / total_bytes * 100, 2) for cat, value in zip(names, sums) if value > 0}
+
+
+def derive_session_stats(sessions):
+    """会话统计量 -> 画像中的会话汇总"""
+    count = sessions['sessions']
+    if count == 0:
+        return {}
+    return {
+        'sessions': count,
+        'avg_duration': round(sessions['duration_sum'] / count, 1),
+        'max_duration': round(sessions['duration_max'], 1),
+        'avg_bytes': int(sessions['bytes_sum'] / count),
+        'avg_records': round(sessions['records_sum'] / count, 2),
+    }
+
 
 class UserProfileAnalyzer:
-    """用户画像分析类"""
+    """用户画像分析类
+
+    画像字段均由可合并的原始状态（ProfileState）派生，状态在首次使用时从 DataFrame 一次性向量化构建。
+    """
     
     def __init__(self, csv_path):
         """初始化分析器"""
         self.csv_path = csv_path
         self.df = None
+        self.state = None
         self.user_profiles = {}
+        self.behavior = None
         self.load_data()
     
+    @classmethod
+    def from_dataframe(cls, df):
+        """基于已准备好的 DataFrame（含 hour / day 列）创建分析器"""
+        analyzer = cls.__new__(cls)
+        analyzer.csv_path = None
+        analyzer.df = df
+        analyzer.state = None
+        analyzer.user_profiles = {}
+        analyzer.behavior = None
+        return analyzer
+    
+    @classmethod
+    def from_state(cls, state):
+        """基于已有的画像状态创建分析器（不需要原始数据）"""
+        analyzer = cls.from_dataframe(None)
+        analyzer.state = state
+        return analyzer
+    
     def load_data(self):
         """加载 CSV 文件"""
         try:
-            self.df = pd.read_csv(self.csv_path)
-            self.df['timestamp'] = pd.to_datetime(self.df['timestamp'])
-            self.df['hour'] = self.df['timestamp'].dt.hour
-            self.df['date'] = self.df['timestamp'].dt.date
+            self.df = load_traffic_csv(self.csv_path)
             return True
         except Exception as e:
             print(f"数据加载失败: {e}")
             return False
     
+    def get_state(self):
+        """获取画像原始状态（首次调用时从 DataFrame 构建）"""
+        if self.state is None:
+            self.state = ProfileState.from_frame(self.df)
+        return self.state
+    
+    def _user_state(self, user_id):
+        return self.get_state().users.get(user_id)
+    
     def get_user_list(self):
         """获取所有用户"""
-        if self.df is None or len(self.df) == 0:
-            return []
-        return self.df['user'].unique().tolist()
+        return sorted(self.get_state().users)
     
     def get_app_category_pct(self, user_id):
         """获取用户应用类别占比"""
-        user_data = self.df[self.df['user'] == user_id]
-        if len(user_data) == 0:
+        state = self._user_state(user_id)
+        if state is None:
             return {}
-        
-        app_traffic = user_data.groupby('app_category')['bytes'].sum()
-        total_bytes = app_traffic.sum()
-        
-        # 标准化类别
-        normalized_categories = {
-            'game': ['game', 'gaming', 'games'],
-            'video': ['video streaming', 'video', 'streaming'],
-            'social': ['social media', 'social'],
-            'chat': ['chat', 'im', 'instant messaging'],
-            'edu': ['education', 'edu', 'learning'],
-            'web': ['web browse', 'web', 'http'],
-            'dns': ['dns'],
-        }
-        
-        category_pct = {}
-        for cat, keywords in normalized_categories.items():
-            pct = 0
-            for keyword in keywords:
-                matching = app_traffic[app_traffic.index.str.lower().str.contains(keyword, na=False)].sum()
-                pct += matching
-            if pct > 0:
-                category_pct[cat] = round(pct / total_bytes * 100, 2)
-        
-        # 其他类别
-        accounted_bytes = sum([user_data.groupby('app_category')['bytes'].sum()[cat]
-                               for cat in user_data['app_category'].unique()
-                               if any(kw in cat.lower() for kw in [w for keywords in normalized_categories.values() for w in keywords])])
-        others_pct = round((total_bytes - accounted_bytes) / total_bytes * 100, 2) if total_bytes > 0 else 0
-        if others_pct > 0:
-            category_pct['others'] = others_pct
-        
-        return category_pct
+        return derive_category_pct(state['category_bytes'])
     
     def get_active_hours(self, user_id):
         """获取用户每小时活跃度"""
-        user_data = self.df[self.df['user'] == user_id]
-        if len(user_data) == 0:
+        state = self._user_state(user_id)
+        if state is None:
             return {}
-        
-        hourly_stats = user_data.groupby('hour').agg({
-            'bytes': 'sum',
-            'timestamp': 'count'
-        }).reset_index()
-        
-        active_hours = {}
-        for _, row in hourly_stats.iterrows():
-            active_hours[int(row['hour'])] = {
-                'bytes': int(row['bytes']),
-                'count': int(row['timestamp'])
-            }
-        
-        return active_hours
+        return {
+            hour: {'bytes': bytes_val, 'count': count}
+            for hour, (bytes_val, count) in enumerate(zip(state['hour_bytes'], state['hour_count']))
+            if count > 0
+        }
     
     def get_protocol_ratio(self, user_id):
         """获取用户协议占比"""
-        user_data = self.df[self.df['user'] == user_id]
-        if len(user_data) == 0:
+        state = self._user_state(user_id)
+        if state is None:
             return {}
         
-        protocol_traffic = user_data.groupby('protocol')['bytes'].sum()
-        total_bytes = protocol_traffic.sum()
-        
-        protocol_ratio = {}
-        for protocol, bytes_val in protocol_traffic.items():
-            protocol_ratio[protocol] = round(bytes_val / total_bytes * 100, 2)
-        
-        return protocol_ratio
+        protocol_traffic = state['protocol_bytes']
+        total_bytes = sum(protocol_traffic.values())
+        if total_bytes <= 0:
+            return {}
+        return {protocol: round(protocol_traffic[protocol] / total_bytes * 100, 2)
+                for protocol in sorted(protocol_traffic)}
     
     def get_port_stats(self, user_id):
         """获取用户端口行为统计"""
-        user_data = self.df[self.df['user'] == user_id]
-        if len(user_data) == 0:
+        state = self._user_state(user_id)
+        if state is None:
             return {}
-        
-        suspicious_ports = [22, 3389, 3306, 8000, 8080, 5000]
-        port_stats = {}
-        
-        for port in suspicious_ports:
-            count = len(user_data[user_data['dst_port'] == port])
-            if count > 0:
-                port_stats[port] = count
-        
-        return port_stats
+        return {port: count for port, count in zip(SUSPICIOUS_PORTS, state['port_counts']) if count > 0}
     
     def get_dns_stats(self, user_id):
         """获取用户 DNS 行为统计"""
-        user_data = self.df[self.df['user'] == user_id]
-        if len(user_data) == 0:
+        state = self._user_state(user_id)
+        if state is None:
             return {"dns_queries": 0, "dns_bytes": 0}
         
-        dns_data = user_data[user_data['dst_port'] == 53]
-        
         return {
-            "dns_queries": len(dns_data),
-            "dns_bytes": int(dns_data['bytes'].sum())
+            "dns_queries": state['dns_queries'],
+            "dns_bytes": state['dns_bytes']
         }
     
     def get_daily_bytes(self, user_id):
         """获取用户每日总流量"""
-        user_data = self.df[self.df['user'] == user_id]
-        if len(user_data) == 0:
+        state = self._user_state(user_id)
+        if state is None:
             return {}
-        
-        daily_stats = user_data.groupby('date')['bytes'].sum()
-        
-        daily_bytes = {}
-        for date, bytes_val in daily_stats.items():
-            daily_bytes[str(date)] = int(bytes_val)
-        
-        return daily_bytes
+        return dict(sorted(state['daily_bytes'].items()))
+    
+    def get_behavior(self):
+        """获取全部用户的行为聚类和规律度（批量计算一次后缓存）"""
+        if self.behavior is None:
+            users, hour_bytes, category_bytes, unit_sum, active_days = \
+                self.get_state().matrices(NORMALIZED_CATEGORIES)
+            self.behavior = cluster_users(users, hour_bytes, category_bytes, unit_sum, active_days,
+                                          NORMALIZED_CATEGORIES)
+        return self.behavior
+    
+    def get_session_stats(self, user_id):
+        """获取用户会话统计（按五元组和空闲超时重建会话后的汇总）"""
+        state = self._user_state(user_id)
+        if state is None:
+            return {}
+        return derive_session_stats(state['sessions'])
     
     def generate_tags(self, user_id):
         """根据用户特征生成标签"""
@@ -159,11 +190,9 @@ class UserProfileAnalyzer:
         active_hours = self.get_active_hours(user_id)
         port_stats = self.get_port_stats(user_id)
         dns_stats = self.get_dns_stats(user_id)
-        daily_bytes = self.get_daily_bytes(user_id)
-        
-        user_data = self.df[self.df['user'] == user_id]
-        total_bytes = user_data['bytes'].sum()
         
+        state = self._user_state(user_id)
+        total_bytes = state['total_bytes'] if state else 0
         # ========== 应用标签 ==========
         if app_pct.get('game', 0) > 30:
             tags.append('游戏狂')
@@ -195,11 +224,10 @@ class UserProfileAnalyzer:
         if morning_ratio > 30:
             tags.append('早起族')
         
-        # 计算活跃时间方差
-        if len(active_hours) > 1:
-            hour_bytes = [active_hours.get(h, {}).get('bytes', 0) for h in range(24)]
-            variance = np.var(hour_bytes)
-            if variance < np.var(hour_bytes) * 0.5:
+        # 规律度：各活跃日小时分布的一致程度（需至少 2 个活跃日）
+        behavior = self.get_behavior().get(user_id)
+        if behavior and behavior['active_days'] > 1:
+            if behavior['regularity'] >= REGULARITY_THRESHOLD:
                 tags.append('规律用户')
             else:
                 tags.append('波动用户')
@@ -217,36 +245,44 @@ class UserProfileAnalyzer:
         if night_ratio > 60:
             tags.append('异常活跃时间')
         
-        return list(set(tags))  # 去重
+        return list(dict.fromkeys(tags))  # 去重（保持顺序）
     
     def analyze_all_users(self):
         """分析所有用户生成完整画像"""
         users = self.get_user_list()
         
-        for user_id in users:
-            self.user_profiles[user_id] = {
-                'tags': self.generate_tags(user_id),
-                'category_pct': self.get_app_category_pct(user_id),
-                'active_hours': self.get_active_hours(user_id),
-                'protocol_ratio': self.get_protocol_ratio(user_id),
-                'port_stats': self.get_port_stats(user_id),
-                'dns_stats': self.get_dns_stats(user_id),
-                'daily_bytes': self.get_daily_bytes(user_id),
-            }
+        with timed_stage('profile_generate', rows=len(users)):
+            for user_id in users:
+                self.user_profiles[user_id] = {
+                    'tags': self.generate_tags(user_id),
+                    'category_pct': self.get_app_category_pct(user_id),
+                    'active_hours': self.get_active_hours(user_id),
+                    'protocol_ratio': self.get_protocol_ratio(user_id),
+                    'port_stats': self.get_port_stats(user_id),
+                    'dns_stats': self.get_dns_stats(user_id),
+                    'daily_bytes': self.get_daily_bytes(user_id),
+                    'session_stats': self.get_session_stats(user_id),
+                    **self.get_behavior().get(user_id, {}),
+                }
         
         return self.user_profiles
     
     def save_profiles(self, output_path):
         """保存用户画像为 JSON 文件"""
         try:
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(self.user_profiles, f, ensure_ascii=False, indent=2)
+            with timed_stage('profile_save', rows=len(self.user_profiles)):
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.user_profiles, f, ensure_ascii=False, indent=2)
             print(f"用户画像已保存至: {output_path}")
             return True
         except Exception as e:
             print(f"保存用户画像失败: {e}")
             return False
     
+    def save_state(self, output_path):
+        """保存画像原始状态（供 --merge 增量合并新数据）"""
+        return self.get_state().save(output_path)
+    
     def load_profiles(self, input_path):
         """从 JSON 文件加载用户画像"""
         try:
@@ -259,24 +295,56 @@ class UserProfileAnalyzer:
             return False
 
 
-def generate_user_profiles(csv_path, output_path=None):
-    """生成用户画像（便利函数）"""
+def generate_user_profiles(csv_path, output_path=None, state_path=None):
+    """生成用户画像（便利函数）；给出 state_path 时同时保存原始状态"""
     analyzer = UserProfileAnalyzer(csv_path)
     analyzer.analyze_all_users()
     
     if output_path:
         analyzer.save_profiles(output_path)
+    if state_path:
+        analyzer.save_state(state_path)
+    
+    return analyzer.user_profiles
+
+
+def merge_user_profiles(csv_path, state_path, output_path=None):
+    """将新数据（如新一天的 CSV）合并进已有的画像状态并重新派生画像
+
+    只解析新数据，代价与新数据量成正比；状态文件不存在时退化为以该 CSV 全量生成。
+    """
+    state = ProfileState.load(state_path) if Path(state_path).exists() else None
+    if state is None:
+        print(f"未找到可用的画像状态，按全量生成: {state_path}")
+        return generate_user_profiles(csv_path, output_path, state_path)
+    
+    new_df = load_traffic_csv(csv_path)
+    if len(new_df) and not state.appendable(new_df):
+        print(f"警告: 新数据包含状态中已有的日期（最后一天 {state.last_day}），规律度和会话统计会有偏差")
+    analyzer = UserProfileAnalyzer.from_state(state.merged(ProfileState.from_frame(new_df)))
+    analyzer.analyze_all_users()
+    
+    if output_path:
+        analyzer.save_profiles(output_path)
+    analyzer.save_state(state_path)
     
     return analyzer.user_profiles
 
 
 if __name__ == '__main__':
-    # 使用示例
-    csv_path = Path(__file__).parent.parent / 'data' / 'traffic.csv'
-    output_path = Path(__file__).parent.parent / 'data' / 'user_profiles.json'
+    data_dir = Path(__file__).parent.parent / 'data'
+    parser = argparse.ArgumentParser(description='生成用户画像')
+    parser.add_argument('csv', nargs='?', default=str(data_dir / 'traffic.csv'), help='流量 CSV 文件')
+    parser.add_argument('--output', default=str(data_dir / 'user_profiles.json'), help='画像输出文件')
+    parser.add_argument('--state', default=str(data_dir / 'user_profile_state.json'), help='画像原始状态文件')
+    parser.add_argument('--merge', action='store_true', help='将 CSV 合并进已有状态，而不是全量重算')
+    args = parser.parse_args()
     
-    if csv_path.exists():
-        profiles = generate_user_profiles(str(csv_path), str(output_path))
+    if Path(args.csv).exists():
+        if args.merge:
+            profiles = merge_user_profiles(args.csv, args.state, args.output)
+        else:
+            profiles = generate_user_profiles(args.csv, args.output, args.state)
         print(f"\n成功分析 {len(profiles)} 个用户")
         
         # 打印示例用户画像
@@ -285,4 +353,4 @@ if __name__ == '__main__':
             print(f"\n示例用户 {first_user} 的画像:")
             print(json.dumps(profiles[first_user], ensure_ascii=False, indent=2))
     else:
-        print(f"CSV 文件未找到: {csv_path}")
+        print(f"CSV 文件未找到: {args.csv}")